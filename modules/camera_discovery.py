@@ -0,0 +1,198 @@
+import json
+import os
+import platform
+import tempfile
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import cv2
+
+CACHE_PATH = os.path.join(tempfile.gettempdir(), "deep-live-cam", "cameras.json")
+# Formats worth asking for: raw YUYV costs almost nothing to convert, MJPG
+# needs a JPEG decode per frame but fits higher resolutions through USB
+FOURCCS = ("YUYV", "MJPG")
+DECODE_COST = {"YUYV": 1.0, "MJPG": 3.0}  # relative CPU cost per pixel
+RESOLUTIONS = ((640, 480), (960, 540), (1280, 720), (1920, 1080))
+PROBE_FPS = 60
+MAX_INDEX = 10
+
+
+class CameraMode(NamedTuple):
+    fourcc: str
+    width: int
+    height: int
+    fps: float
+
+
+class Camera(NamedTuple):
+    index: int
+    name: str
+    modes: List[CameraMode]
+
+
+def get_backend() -> int:
+    system = platform.system()
+    if system == "Windows":
+        return cv2.CAP_DSHOW
+    if system == "Darwin":
+        return cv2.CAP_AVFOUNDATION
+    return cv2.CAP_V4L2
+
+
+def decode_fourcc(value: float) -> str:
+    code = int(value)
+    return "".join(chr((code >> 8 * i) & 0xFF) for i in range(4)).strip("\x00")
+
+
+def list_devices() -> List[Tuple[int, str]]:
+    """(index, name) of every camera, without opening devices where the platform can list them."""
+    if platform.system() == "Windows":
+        try:
+            from pygrabber.dshow_graph import FilterGraph
+
+            devices = FilterGraph().get_input_devices()
+            if devices:
+                return list(enumerate(devices))
+        except Exception as e:
+            print(f"Error detecting cameras: {str(e)}")
+    else:
+        try:
+            from cv2_enumerate_cameras import enumerate_cameras
+
+            devices = [(camera.index, camera.name) for camera in enumerate_cameras(get_backend())]
+            if devices:
+                return devices
+        except Exception as e:
+            print(f"Error detecting cameras: {str(e)}")
+
+    # Fallback: open each index in turn
+    indices = [0, 1, 2] if platform.system() == "Darwin" else range(MAX_INDEX)
+    devices = []
+    for index in indices:
+        cap = cv2.VideoCapture(index)
+        if cap.isOpened():
+            devices.append((index, "FaceTime Camera" if platform.system() == "Darwin" and index == 0 else f"Camera {index}"))
+        cap.release()
+    return devices
+
+
+def probe_modes(index: int) -> List[CameraMode]:
+    """Asks the device for each format and resolution and records what it actually delivers."""
+    cap = cv2.VideoCapture(index, get_backend())
+    if not cap.isOpened():
+        cap.release()
+        return []
+    modes = set()
+    try:
+        for fourcc in FOURCCS:
+            for width, height in RESOLUTIONS:
+                cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+                cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+                cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+                cap.set(cv2.CAP_PROP_FPS, PROBE_FPS)
+                # Drivers answer with the closest mode they support
+                actual = decode_fourcc(cap.get(cv2.CAP_PROP_FOURCC)) or fourcc
+                actual_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+                actual_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+                fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+                if actual_width > 0 and actual_height > 0:
+                    modes.add(CameraMode(actual, actual_width, actual_height, round(fps, 2)))
+    finally:
+        cap.release()
+    return sorted(modes, key=lambda mode: (mode.width * mode.height, mode.fourcc, mode.fps))
+
+
+def choose_mode(modes: List[CameraMode], width: int, height: int, fps: float) -> Optional[CameraMode]:
+    """
+    The mode that delivers at least width x height at fps for the least
+    decode work. Modes that cover the processed resolution and frame rate
+    come first, then the cheaper format per pixel, then fewer pixels. When
+    nothing covers the target, the largest and fastest mode wins.
+    """
+    if not modes:
+        return None
+
+    def rank(mode: CameraMode) -> tuple:
+        covers = mode.width >= width and mode.height >= height
+        fast_enough = mode.fps == 0 or mode.fps >= fps * 0.95
+        cost = mode.width * mode.height * DECODE_COST.get(mode.fourcc, 2.0)
+        if covers and fast_enough:
+            return (0, cost)
+        # Otherwise get as close as possible: frame rate first, then resolution
+        return (1, not fast_enough, -min(mode.width / width, mode.height / height), cost)
+
+    return min(modes, key=rank)
+
+
+class CameraDiscovery:
+    """
+    Finds cameras and their capture modes on a background thread so the UI
+    never waits for device probing. Results are cached on disk by device
+    name, so later starts list cameras immediately and only probe devices
+    that were not seen before.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cameras: Optional[List[Camera]] = None
+        self.thread = None
+        self.cache: Dict[str, List[CameraMode]] = self._load_cache()
+
+    def start(self) -> "CameraDiscovery":
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._discover, name="camera-discovery", daemon=True)
+                self.thread.start()
+        return self
+
+    def get_cameras(self) -> Optional[List[Camera]]:
+        """Discovered cameras, or None while discovery is still running."""
+        with self.lock:
+            return self.cameras
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[List[Camera]]:
+        self.start()
+        self.thread.join(timeout)
+        return self.get_cameras()
+
+    def get_mode(self, index: int, width: int, height: int, fps: float) -> Optional[CameraMode]:
+        """Best known mode for a camera; None if it has not been probed yet."""
+        for camera in self.get_cameras() or []:
+            if camera.index == index:
+                return choose_mode(camera.modes, width, height, fps)
+        return None
+
+    def _discover(self) -> None:
+        cameras = []
+        try:
+            for index, name in list_devices():
+                key = f"{index}:{name}"
+                modes = self.cache.get(key)
+                if modes is None:
+                    modes = probe_modes(index)
+                    if modes:  # a busy device is probed again next time
+                        self.cache[key] = modes
+                cameras.append(Camera(index, name, modes))
+            self._save_cache()
+        except Exception as e:
+            print(f"Error detecting cameras: {str(e)}")
+        with self.lock:
+            self.cameras = cameras
+
+    def _load_cache(self) -> Dict[str, List[CameraMode]]:
+        try:
+            with open(CACHE_PATH, "r", encoding="utf-8") as file:
+                return {key: [CameraMode(*mode) for mode in modes] for key, modes in json.load(file).items()}
+        except (OSError, ValueError, TypeError):
+            return {}
+
+    def _save_cache(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+            with open(CACHE_PATH, "w", encoding="utf-8") as file:
+                json.dump({key: [list(mode) for mode in modes] for key, modes in self.cache.items()}, file)
+        except OSError as e:
+            print(f"Camera cache not saved: {e}")
+
+
+CAMERA_DISCOVERY = CameraDiscovery()
@@ -1,32 +1,134 @@
 from typing import Any
+from collections import OrderedDict
+import bisect
+import threading
 import cv2
 import modules.globals  # Import the globals to check the color correction toggle
+from modules import probe_cache
 
 
-def get_video_frame(video_path: str, frame_number: int = 0) -> Any:
-    capture = cv2.VideoCapture(video_path)
+FRAME_CACHE_BYTES = 256 * 1024 * 1024
+FORWARD_DECODE_LIMIT = 48  # frames; scrubbing further than this seeks instead
+
+
+class PreviewFrameService:
+    """
+    Keeps one decoder open for the current target and an LRU of recently
+    decoded frames, bounded by FRAME_CACHE_BYTES. A request a few frames
+    ahead of the decoder is served by grabbing forward rather than seeking,
+    which would restart decoding from the previous keyframe.
+    """
+
+    def __init__(self, max_bytes: int = FRAME_CACHE_BYTES, forward_limit: int = FORWARD_DECODE_LIMIT):
+        self.max_bytes = max_bytes
+        self.forward_limit = forward_limit
+        self.video_path = None
+        self.capture = None
+        self.frame_total = 0
+        self.position = 0  # index of the frame the next read() returns
+        self.frames = OrderedDict()
+        self.cached_bytes = 0
+        self.keyframes = {}  # video path -> sorted keyframe indices, when known
+        self.lock = threading.Lock()
+
+    def get_frame(self, video_path: str, frame_index: int) -> Any:
+        with self.lock:
+            if video_path != self.video_path:
+                self._open(video_path)
+            if self.capture is None:
+                return None
+            if self.frame_total > 0:
+                frame_index = min(frame_index, self.frame_total - 1)
+            frame_index = max(0, frame_index)
+
+            frame = self.frames.get(frame_index)
+            if frame is not None:
+                self.frames.move_to_end(frame_index)
+                return frame.copy()
+            frame = self._decode(frame_index)
+            if frame is None:
+                return None
+            self._store(frame_index, frame)
+            return frame.copy()
+
+    def set_keyframes(self, video_path: str, keyframes: list) -> None:
+        with self.lock:
+            self.keyframes[video_path] = sorted(keyframes)
+
+    def release(self) -> None:
+        with self.lock:
+            self._close()
+
+    def _open(self, video_path: str) -> None:
+        self._close()
+        self.video_path = video_path
+        self.capture = cv2.VideoCapture(video_path)
+        if not self.capture.isOpened():
+            self.capture = None
+            return
+        self.frame_total = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.position = 0
 
-    # Set MJPEG format to ensure correct color space handling
-    capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
-    
-    # Only force RGB conversion if color correction is enabled
-    if modules.globals.color_correction:
-        capture.set(cv2.CAP_PROP_CONVERT_RGB, 1)
-    
-    frame_total = capture.get(cv2.CAP_PROP_FRAME_COUNT)
-    capture.set(cv2.CAP_PROP_POS_FRAMES, min(frame_total, frame_number - 1))
-    has_frame, frame = capture.read()
-
-    if has_frame and modules.globals.color_correction:
+    def _close(self) -> None:
+        if self.capture is not None:
+            self.capture.release()
+        self.capture = None
+        self.video_path = None
+        self.frames.clear()
+        self.cached_bytes = 0
+
+    def _decode(self, frame_index: int) -> Any:
+        distance = frame_index - self.position
+        keyframes = self.keyframes.get(self.video_path)
+        # With a keyframe index, decoding forward also wins whenever no keyframe lies in between
+        no_keyframe_between = keyframes is not None and bisect.bisect_right(keyframes, frame_index) == bisect.bisect_right(keyframes, self.position)
+        if distance >= 0 and (distance <= self.forward_limit or no_keyframe_between):
+            for _ in range(distance):
+                if not self.capture.grab():
+                    # The capture already moved forward, force a seek next time
+                    self.position = -self.forward_limit - 1
+                    return None
+        else:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+        has_frame, frame = self.capture.read()
+        if not has_frame:
+            # Position is unknown after a failed read, force a seek next time
+            self.position = -self.forward_limit - 1
+            return None
+        self.position = frame_index + 1
+        return frame
+
+    def _store(self, frame_index: int, frame: Any) -> None:
+        self.frames[frame_index] = frame
+        self.cached_bytes += frame.nbytes
+        while self.cached_bytes > self.max_bytes and len(self.frames) > 1:
+            _, evicted = self.frames.popitem(last=False)
+            self.cached_bytes -= evicted.nbytes
+
+
+PREVIEW_FRAME_SERVICE = PreviewFrameService()
+
+
+def get_video_frame(video_path: str, frame_number: int = 0) -> Any:
+    # frame_number is 1-based (0 also means the first frame); slider values may be floats
+    frame = PREVIEW_FRAME_SERVICE.get_frame(video_path, int(frame_number) - 1)
+    if frame is not None and modules.globals.color_correction:
         # Convert the frame color if necessary
         frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    return frame
 
-    capture.release()
-    return frame if has_frame else None
+
+def release_video_frames() -> None:
+    PREVIEW_FRAME_SERVICE.release()
 
 
 def get_video_frame_total(video_path: str) -> int:
+    video_frame_total = probe_cache.get_value(video_path, "frame_total")
+    if video_frame_total is not None:
+        return int(video_frame_total)
     capture = cv2.VideoCapture(video_path)
     video_frame_total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
     capture.release()
+    if video_frame_total > 0:
+        probe_cache.set_values(video_path, frame_total=video_frame_total)
     return video_frame_total
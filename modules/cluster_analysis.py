@@ -1,24 +1,155 @@
 import numpy as np
-from sklearn.cluster import KMeans
-from sklearn.metrics import silhouette_score
-from typing import Any
+from scipy.optimize import linear_sum_assignment
+from typing import Any, Dict, List, Optional, Tuple
 
 
-def find_cluster_centroids(embeddings, max_k=10) -> Any:
-    inertia = []
-    cluster_centroids = []
-    K = range(1, max_k+1)
+class OnlineFaceClusterer:
+    """
+    Streaming leader clustering for normed face embeddings.
+
+    Embeddings are consumed one at a time while the analysis pass runs. Each
+    one joins the most similar cluster when the cosine similarity to its
+    centroid reaches assign_threshold, otherwise it starts a new cluster.
+    Only per-cluster sums and counts are kept, and the number of live
+    clusters is capped at max_clusters by merging the closest pair, so
+    memory does not depend on video length. finalize() merges clusters whose
+    centroids still agree, folds tiny clusters into their nearest neighbour
+    and caps the result at max_k, which selects k without refitting models.
+    """
+
+    def __init__(
+        self,
+        assign_threshold: float = 0.45,
+        merge_threshold: float = 0.55,
+        max_clusters: int = 64,
+        max_k: int = 10,
+        min_cluster_fraction: float = 0.01,
+    ):
+        self.assign_threshold = assign_threshold
+        self.merge_threshold = merge_threshold
+        self.max_clusters = max_clusters
+        self.max_k = max_k
+        self.min_cluster_fraction = min_cluster_fraction
+        self.total = 0
+        self._sums: Optional[np.ndarray] = None
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._centroids: Optional[np.ndarray] = None
+        self._ids: List[int] = []
+        self._next_id = 0
+        self._merged_into: Dict[int, int] = {}
+        self._final_labels: Dict[int, int] = {}
+
+    def partial_fit(self, embedding: Any) -> int:
+        """Adds one normed embedding and returns the id of the cluster it joined."""
+        embedding = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(embedding)
+        if norm > 0:
+            embedding = embedding / norm
+        self.total += 1
+
+        if self._sums is None:
+            self._sums = np.zeros((0, embedding.shape[0]), dtype=np.float64)
+            self._centroids = np.zeros((0, embedding.shape[0]), dtype=np.float32)
+
+        if len(self._ids) > 0:
+            similarities = self._centroids @ embedding
+            index = int(np.argmax(similarities))
+            if similarities[index] >= self.assign_threshold:
+                self._sums[index] += embedding
+                self._counts[index] += 1
+                self._refresh_centroid(index)
+                return self._ids[index]
+
+        cluster_id = self._next_id
+        self._next_id += 1
+        self._sums = np.vstack([self._sums, embedding[np.newaxis, :]])
+        self._counts = np.append(self._counts, 1)
+        self._centroids = np.vstack([self._centroids, embedding[np.newaxis, :]])
+        self._ids.append(cluster_id)
+        if len(self._ids) > self.max_clusters:
+            self._merge_closest_pair()
+        return self.resolve(cluster_id)
+
+    def partial_fit_many(self, embeddings: Any) -> List[int]:
+        return [self.partial_fit(embedding) for embedding in embeddings]
+
+    def resolve(self, cluster_id: int) -> int:
+        """Follows merges so a cluster id handed out earlier maps to its surviving cluster."""
+        while cluster_id in self._merged_into:
+            cluster_id = self._merged_into[cluster_id]
+        return cluster_id
+
+    def label(self, cluster_id: int) -> Optional[int]:
+        """Index into the finalized centroids for a cluster id returned by partial_fit."""
+        return self._final_labels.get(self.resolve(cluster_id))
+
+    def finalize(self) -> np.ndarray:
+        """Merges and prunes the live clusters and returns the final normalized centroids."""
+        if self._sums is None or len(self._ids) == 0:
+            self._final_labels = {}
+            return np.zeros((0, 0), dtype=np.float32)
+
+        while len(self._ids) > 1:
+            i, j, similarity = self._closest_pair()
+            if similarity < self.merge_threshold:
+                break
+            self._merge(i, j)
+
+        min_count = max(1, int(self.total * self.min_cluster_fraction))
+        while len(self._ids) > 1 and int(self._counts.min()) < min_count:
+            small = int(np.argmin(self._counts))
+            similarities = self._centroids @ self._centroids[small]
+            similarities[small] = -np.inf
+            self._merge(int(np.argmax(similarities)), small)
 
-    for k in K:
-        kmeans = KMeans(n_clusters=k, random_state=0)
-        kmeans.fit(embeddings)
-        inertia.append(kmeans.inertia_)
-        cluster_centroids.append({"k": k, "centroids": kmeans.cluster_centers_})
+        while len(self._ids) > self.max_k:
+            self._merge_closest_pair()
 
-    diffs = [inertia[i] - inertia[i+1] for i in range(len(inertia)-1)]
-    optimal_centroids = cluster_centroids[diffs.index(max(diffs)) + 1]['centroids']
+        self._final_labels = {cluster_id: index for index, cluster_id in enumerate(self._ids)}
+        return self._centroids.copy()
 
-    return optimal_centroids
+    @property
+    def centroids(self) -> np.ndarray:
+        if self._centroids is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        return self._centroids.copy()
+
+    @property
+    def counts(self) -> np.ndarray:
+        return self._counts.copy()
+
+    def _refresh_centroid(self, index: int) -> None:
+        centroid = self._sums[index]
+        norm = np.linalg.norm(centroid)
+        self._centroids[index] = centroid / norm if norm > 0 else centroid
+
+    def _closest_pair(self) -> tuple:
+        similarities = self._centroids @ self._centroids.T
+        np.fill_diagonal(similarities, -np.inf)
+        i, j = np.unravel_index(int(np.argmax(similarities)), similarities.shape)
+        return int(i), int(j), float(similarities[i, j])
+
+    def _merge_closest_pair(self) -> None:
+        i, j, _ = self._closest_pair()
+        self._merge(i, j)
+
+    def _merge(self, keep: int, drop: int) -> None:
+        if self._counts[drop] > self._counts[keep]:
+            keep, drop = drop, keep
+        self._sums[keep] += self._sums[drop]
+        self._counts[keep] += self._counts[drop]
+        self._refresh_centroid(keep)
+        self._merged_into[self._ids[drop]] = self._ids[keep]
+        self._sums = np.delete(self._sums, drop, axis=0)
+        self._counts = np.delete(self._counts, drop)
+        self._centroids = np.delete(self._centroids, drop, axis=0)
+        del self._ids[drop]
+
+
+def find_cluster_centroids(embeddings, max_k=10) -> Any:
+    clusterer = OnlineFaceClusterer(max_k=max_k)
+    clusterer.partial_fit_many(embeddings)
+    return clusterer.finalize()
 
 def find_closest_centroid(centroids: list, normed_face_embedding) -> list:
     try:
@@ -26,7 +157,31 @@ def find_closest_centroid(centroids: list, normed_face_embedding) -> list:
         normed_face_embedding = np.array(normed_face_embedding)
         similarities = np.dot(centroids, normed_face_embedding)
         closest_centroid_index = np.argmax(similarities)
-        
+
         return closest_centroid_index, centroids[closest_centroid_index]
     except ValueError:
-        return None
\ No newline at end of file
+        return None
+
+
+def build_embedding_matrix(embeddings: list) -> np.ndarray:
+    """Stacks embeddings into a contiguous float32 matrix with unit-length rows."""
+    if len(embeddings) == 0:
+        return np.zeros((0, 0), dtype=np.float32)
+    matrix = np.ascontiguousarray(np.stack([np.asarray(embedding, dtype=np.float32).ravel() for embedding in embeddings]))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def match_faces_to_targets(target_matrix: np.ndarray, face_embeddings: list) -> List[Tuple[int, int]]:
+    """
+    One-to-one assignment of detected faces to mapped targets. A single
+    matrix multiply scores every pair, then the Hungarian method picks the
+    pairing with the highest total similarity, so two targets never claim
+    the same face. Returns (face_index, target_index) pairs.
+    """
+    if len(face_embeddings) == 0 or target_matrix.size == 0:
+        return []
+    similarities = build_embedding_matrix(face_embeddings) @ target_matrix.T
+    face_indices, target_indices = linear_sum_assignment(similarities, maximize=True)
+    return list(zip(face_indices.tolist(), target_indices.tolist()))
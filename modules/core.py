@@ -11,14 +11,17 @@ import platform
 import signal
 import shutil
 import argparse
+import time
 import torch
 import onnxruntime
-import tensorflow
 
 import modules.globals
 import modules.metadata
 import modules.ui as ui
 from modules.processors.frame.core import get_frame_processors_modules
+import modules.face_library as face_library
+from modules.live_session import LiveSession
+import modules.server as server
 from modules.utilities import has_image_extension, is_image, is_video, detect_fps, create_video, extract_frames, get_temp_frame_paths, restore_audio, create_temp, move_temp, clean_temp, normalize_output_path
 
 if 'ROCMExecutionProvider' in modules.globals.execution_providers:
@@ -27,6 +30,9 @@ if 'ROCMExecutionProvider' in modules.globals.execution_providers:
 warnings.filterwarnings('ignore', category=FutureWarning, module='insightface')
 warnings.filterwarnings('ignore', category=UserWarning, module='torchvision')
 
+# Called as (message, scope) for every status update, e.g. by server workers reporting job stages
+STATUS_CALLBACK = None
+
 
 def parse_args() -> None:
     signal.signal(signal.SIGINT, lambda signal_number, frame: destroy())
@@ -34,6 +40,10 @@ def parse_args() -> None:
     program.add_argument('-s', '--source', help='select an source image', dest='source_path')
     program.add_argument('-t', '--target', help='select an target image or video', dest='target_path')
     program.add_argument('-o', '--output', help='select output file or directory', dest='output_path')
+    program.add_argument('--source-id', help='use a face from the source face library (id or name) instead of a source image', dest='source_id')
+    program.add_argument('--face-library', help='directory of the source face library (default: ~/.deep-live-cam/faces)', dest='face_library')
+    program.add_argument('--add-source-face', help='store the face of the source image (-s) in the face library, optionally under NAME, and print its id', dest='add_source_face', nargs='?', const='', metavar='NAME')
+    program.add_argument('--list-source-faces', help='list the faces in the source face library', dest='list_source_faces', action='store_true', default=False)
     program.add_argument('--frame-processor', help='pipeline of frame processors', dest='frame_processor', default=['face_swapper'], choices=['face_swapper', 'face_enhancer'], nargs='+')
     program.add_argument('--keep-fps', help='keep original fps', dest='keep_fps', action='store_true', default=False)
     program.add_argument('--keep-audio', help='keep original audio', dest='keep_audio', action='store_true', default=True)
@@ -42,14 +52,39 @@ def parse_args() -> None:
     program.add_argument('--nsfw-filter', help='filter the NSFW image or video', dest='nsfw_filter', action='store_true', default=False)
     program.add_argument('--map-faces', help='map source target faces', dest='map_faces', action='store_true', default=False)
     program.add_argument('--mouth-mask', help='mask the mouth region', dest='mouth_mask', action='store_true', default=False)
+    program.add_argument('--enhance-all-faces', help='enhance every face, not only the swapped ones', dest='enhance_all_faces', action='store_true', default=False)
+    program.add_argument('--enhancer-min-face', help='skip enhancing faces smaller than this size in pixels', dest='enhancer_min_face', type=int, default=32)
+    program.add_argument('--enhancer-max-face', help='skip enhancing faces larger than this size in pixels (0 = no limit)', dest='enhancer_max_face', type=int, default=512)
+    program.add_argument('--enhancer-reuse-frames', help='reuse an enhanced face for up to this many live frames while its pose is stable', dest='enhancer_reuse_frames', type=int, default=0)
+    program.add_argument('--preview-proxy', help='scrub video previews from a low-resolution proxy built in the background', dest='preview_proxy', action='store_true', default=False)
+    program.add_argument('--preview-proxy-stride', help='keep every Nth frame in the preview proxy', dest='preview_proxy_stride', type=int, default=5)
+    program.add_argument('--preview-proxy-cache-size', help='megabytes of preview proxies kept on disk; one proxy may use half of it, and longer videos get a larger stride', dest='preview_proxy_cache_size', type=int, default=4096)
     program.add_argument('--video-encoder', help='adjust output video encoder', dest='video_encoder', default='libx264', choices=['libx264', 'libx265', 'libvpx-vp9'])
     program.add_argument('--video-quality', help='adjust output video quality', dest='video_quality', type=int, default=18, choices=range(52), metavar='[0-51]')
     program.add_argument('-l', '--lang', help='Ui language', default="en")
+    program.add_argument('--server', help='run a headless HTTP server that processes swap jobs', dest='server', action='store_true', default=False)
+    program.add_argument('--server-host', help='address the job server listens on', dest='server_host', default='127.0.0.1')
+    program.add_argument('--server-port', help='port the job server listens on', dest='server_port', type=int, default=8000)
+    program.add_argument('--server-workers', help='number of job worker processes, each keeping its models loaded', dest='server_workers', type=int, default=1)
+    program.add_argument('--server-root', help='directory for uploads and results of the job server', dest='server_root')
+    program.add_argument('--server-allow-paths', help='let jobs reference local files by path, not only uploads', dest='server_allow_paths', action='store_true', default=False)
+    program.add_argument('--server-max-live-sessions', help='most WebSocket live sessions the job server runs at the same time (0 = no limit)', dest='server_max_live_sessions', type=int, default=4)
+    program.add_argument('--server-retention', help='hours the job server keeps finished jobs, their results and unused uploads (0 = forever)', dest='server_retention', type=float, default=24.0, metavar='HOURS')
+    program.add_argument('--live', help='run live swapping without the UI from a camera index, video file or stream URL; output goes to -o (file, udp:// or rtmp://). Repeat for several concurrent streams, with {index} in -o', dest='live_sources', action='append', metavar='SOURCE')
+    program.add_argument('--live-loop', help='loop a --live video file instead of stopping at its end', dest='live_loop', action='store_true', default=False)
     program.add_argument('--live-mirror', help='The live camera display as you see it in the front-facing camera frame', dest='live_mirror', action='store_true', default=False)
     program.add_argument('--live-resizable', help='The live camera frame is resizable', dest='live_resizable', action='store_true', default=False)
+    program.add_argument('--live-async-detection', help='detect faces in the background and track them between detections in live mode', dest='live_async_detection', action='store_true', default=False)
+    program.add_argument('--live-quality-control', help='lower and restore live quality settings automatically to hold the target fps', dest='live_quality_control', action='store_true', default=False)
+    program.add_argument('--live-target-fps', help='frame rate the live quality control aims for', dest='live_target_fps', type=int, default=24)
+    program.add_argument('--live-analysis-size', help='longest side in pixels of the frame copy live faces are detected on; swapping stays at full resolution (0 = full frame)', dest='live_analysis_size', type=int, default=640, metavar='PIXELS')
+    program.add_argument('--live-record', help='record the processed live stream to this video file (later takes from the Record button get new names next to it)', dest='live_record_path', metavar='PATH')
+    program.add_argument('--live-record-audio', help='audio device to mux into live recordings (pulse source, dshow device name or avfoundation index)', dest='live_record_audio', metavar='DEVICE')
+    program.add_argument('--live-latency-target', help='drop live frames that waited longer than this many milliseconds (0 = off)', dest='live_latency_target', type=int, default=250)
     program.add_argument('--max-memory', help='maximum amount of RAM in GB', dest='max_memory', type=int, default=suggest_max_memory())
     program.add_argument('--execution-provider', help='execution provider', dest='execution_provider', default=['cpu'], choices=suggest_execution_providers(), nargs='+')
     program.add_argument('--execution-threads', help='number of execution threads', dest='execution_threads', type=int, default=suggest_execution_threads())
+    program.add_argument('--inference-batch-deadline', help='milliseconds to gather concurrent model calls from live sessions and worker threads into one batch (0 = off)', dest='inference_batch_deadline', type=float, default=0, metavar='MS')
     program.add_argument('-v', '--version', action='version', version=f'{modules.metadata.name} {modules.metadata.version}')
 
     # register deprecated args
@@ -62,23 +97,53 @@ def parse_args() -> None:
 
     modules.globals.source_path = args.source_path
     modules.globals.target_path = args.target_path
-    modules.globals.output_path = normalize_output_path(modules.globals.source_path, modules.globals.target_path, args.output_path)
+    # A library face names the output like a source image would
+    modules.globals.output_path = normalize_output_path(modules.globals.source_path or args.source_id, modules.globals.target_path, args.output_path)
+    modules.globals.source_id = args.source_id
+    modules.globals.face_library = args.face_library
+    modules.globals.add_source_face = args.add_source_face
+    modules.globals.list_source_faces = args.list_source_faces
     modules.globals.frame_processors = args.frame_processor
-    modules.globals.headless = args.source_path or args.target_path or args.output_path
+    modules.globals.headless = args.source_path or args.source_id or args.target_path or args.output_path or args.live_sources or args.server
     modules.globals.keep_fps = args.keep_fps
     modules.globals.keep_audio = args.keep_audio
     modules.globals.keep_frames = args.keep_frames
     modules.globals.many_faces = args.many_faces
     modules.globals.mouth_mask = args.mouth_mask
+    modules.globals.selective_enhancement = not args.enhance_all_faces
+    modules.globals.enhancer_min_face_size = args.enhancer_min_face
+    modules.globals.enhancer_max_face_size = args.enhancer_max_face
+    modules.globals.enhancer_reuse_frames = args.enhancer_reuse_frames
+    modules.globals.preview_proxy = args.preview_proxy
+    modules.globals.preview_proxy_stride = args.preview_proxy_stride
+    modules.globals.preview_proxy_cache_size = args.preview_proxy_cache_size
     modules.globals.nsfw_filter = args.nsfw_filter
     modules.globals.map_faces = args.map_faces
     modules.globals.video_encoder = args.video_encoder
     modules.globals.video_quality = args.video_quality
+    modules.globals.server = args.server
+    modules.globals.server_host = args.server_host
+    modules.globals.server_port = args.server_port
+    modules.globals.server_workers = args.server_workers
+    modules.globals.server_root = args.server_root
+    modules.globals.server_allow_paths = args.server_allow_paths
+    modules.globals.server_max_live_sessions = args.server_max_live_sessions
+    modules.globals.server_retention = args.server_retention
+    modules.globals.live_sources = args.live_sources or []
+    modules.globals.live_loop = args.live_loop
     modules.globals.live_mirror = args.live_mirror
     modules.globals.live_resizable = args.live_resizable
+    modules.globals.live_async_detection = args.live_async_detection
+    modules.globals.live_quality_control = args.live_quality_control
+    modules.globals.live_target_fps = args.live_target_fps
+    modules.globals.live_latency_target = args.live_latency_target
+    modules.globals.live_analysis_size = args.live_analysis_size
+    modules.globals.live_record_path = args.live_record_path
+    modules.globals.live_record_audio = args.live_record_audio
     modules.globals.max_memory = args.max_memory
     modules.globals.execution_providers = decode_execution_providers(args.execution_provider)
     modules.globals.execution_threads = args.execution_threads
+    modules.globals.inference_batch_deadline = args.inference_batch_deadline
     modules.globals.lang = args.lang
 
     #for ENHANCER tumbler:
@@ -137,10 +202,7 @@ def suggest_execution_threads() -> int:
 
 
 def limit_resources() -> None:
-    # prevent tensorflow memory leak
-    gpus = tensorflow.config.experimental.list_physical_devices('GPU')
-    for gpu in gpus:
-        tensorflow.config.experimental.set_memory_growth(gpu, True)
+    # tensorflow is only loaded (and configured) lazily by the NSFW predicter
     # limit memory usage
     if modules.globals.max_memory:
         memory = modules.globals.max_memory * 1024 ** 3
@@ -172,6 +234,8 @@ def pre_check() -> bool:
 
 def update_status(message: str, scope: str = 'DLC.CORE') -> None:
     print(f'[{scope}] {message}')
+    if STATUS_CALLBACK is not None:
+        STATUS_CALLBACK(message, scope)
     if not modules.globals.headless:
         ui.update_status(message)
 
@@ -201,11 +265,11 @@ def start() -> None:
     if modules.globals.nsfw_filter and ui.check_and_ignore_nsfw(modules.globals.target_path, destroy):
         return
 
-    if not modules.globals.map_faces:
-        update_status('Creating temp resources...')
-        create_temp(modules.globals.target_path)
-        update_status('Extracting frames...')
-        extract_frames(modules.globals.target_path)
+    # map-faces analysis streams the video itself, so frames are extracted here in every mode
+    update_status('Creating temp resources...')
+    create_temp(modules.globals.target_path)
+    update_status('Extracting frames...')
+    extract_frames(modules.globals.target_path)
 
     temp_frame_paths = get_temp_frame_paths(modules.globals.target_path)
     for frame_processor in get_frame_processors_modules(modules.globals.frame_processors):
@@ -238,6 +302,70 @@ def start() -> None:
         update_status('Processing to video failed!')
 
 
+def start_live() -> None:
+    """Headless live mode: swaps frames from a camera, file or URL and encodes them with ffmpeg."""
+    for frame_processor in get_frame_processors_modules(modules.globals.frame_processors):
+        if not frame_processor.pre_start():
+            return
+    if not modules.globals.output_path:
+        update_status('Live mode needs an output file or stream URL (-o).')
+        return
+    source_face = face_library.get_source_face(modules.globals.source_path)
+    if source_face is None:
+        update_status(f'Face {modules.globals.source_id} is not in the face library.' if modules.globals.source_id else 'No face found in the source image.')
+        return
+    if modules.globals.map_faces:
+        update_status('Face mapping needs the UI; live mode swaps with the source face only.')
+        modules.globals.map_faces = False
+
+    live_sources = modules.globals.live_sources
+    if len(live_sources) > 1 and '{index}' not in modules.globals.output_path:
+        update_status('Several live sources need {index} in the output path (-o) to tell their outputs apart.')
+        return
+    frame_processors = get_frame_processors_modules(modules.globals.frame_processors)
+    sessions = []
+    for index, live_source in enumerate(live_sources):
+        output_path = modules.globals.output_path.replace('{index}', str(index))
+        session = LiveSession(
+            int(live_source) if live_source.isdigit() else live_source,
+            source_face=source_face,
+            output=output_path,
+            loop=modules.globals.live_loop,
+            record_path=modules.globals.live_record_path.replace('{index}', str(index)) if modules.globals.live_record_path else None,
+        )
+        if not session.start(frame_processors):
+            update_status(f'Failed to open live source {live_source}.')
+            continue
+        update_status(f'Live swapping {live_source} to {output_path}...')
+        sessions.append(session)
+    try:
+        while any(session.is_alive() for session in sessions):
+            time.sleep(5)
+            for session in sessions:
+                stats = session.get_stats()
+                update_status(f'{stats["source"]}: {stats["fps"]:.1f} fps, latency {stats["pipeline"]["latency_ms"]:.0f} ms, encoder dropped {stats["encoder_dropped"]}', 'DLC.LIVE')
+    finally:
+        for session in sessions:
+            session.stop()
+    update_status('Live swapping stopped.')
+
+
+def manage_face_library() -> None:
+    """Runs --add-source-face and --list-source-faces."""
+    if modules.globals.add_source_face is not None:
+        if not modules.globals.source_path:
+            update_status('--add-source-face needs a source image (-s).')
+        else:
+            try:
+                entry = face_library.add_face(modules.globals.source_path, modules.globals.add_source_face or None)
+                update_status(f'Source face stored in the face library as {entry["id"]}' + (f' ({entry["name"]})' if entry['name'] else '') + '.', face_library.NAME)
+            except ValueError as e:
+                update_status(f'Could not add the source face: {e}', face_library.NAME)
+    if modules.globals.list_source_faces:
+        for entry in face_library.list_faces():
+            print(f'{entry["id"]}  {entry["name"] or "-":<24} {entry["source_path"]}')
+
+
 def destroy(to_quit=True) -> None:
     if modules.globals.target_path:
         clean_temp(modules.globals.target_path)
@@ -252,7 +380,16 @@ def run() -> None:
         if not frame_processor.pre_check():
             return
     limit_resources()
-    if modules.globals.headless:
+    if modules.globals.add_source_face is not None or modules.globals.list_source_faces:
+        manage_face_library()
+        # Library commands run on their own unless there is also something to process
+        if not (modules.globals.target_path or modules.globals.live_sources or modules.globals.server):
+            return
+    if modules.globals.server:
+        server.serve()
+    elif modules.globals.live_sources:
+        start_live()
+    elif modules.globals.headless:
         start()
     else:
         window = ui.init(start, destroy, modules.globals.lang)
@@ -0,0 +1,48 @@
+from typing import Any, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image, ImageTk
+
+from modules.typing import Frame
+
+
+class DisplaySink:
+    """
+    Shows BGR frames on a Tk label without per-frame allocations. One
+    PhotoImage and one RGBA buffer are kept for as long as the frame size
+    stays the same: the color conversion writes into the buffer, PIL maps it
+    without copying (RGBA is one of the modes PIL can map), and paste()
+    updates the PhotoImage in place. Frames are only resampled when they do
+    not already have the requested size.
+    """
+
+    def __init__(self, label: Any):
+        self.label = label
+        self.photo: Optional[ImageTk.PhotoImage] = None
+        self.rgba_buffer: Optional[np.ndarray] = None
+        self.resize_buffer: Optional[np.ndarray] = None
+        self.image: Optional[Image.Image] = None
+        self.size: Tuple[int, int] = (0, 0)
+
+    def show(self, frame: Frame, size: Optional[Tuple[int, int]] = None) -> None:
+        """Displays frame, scaled to size (width, height) only when it differs."""
+        height, width = frame.shape[:2]
+        if size is not None and size != (width, height) and size[0] > 0 and size[1] > 0:
+            if self.resize_buffer is None or self.resize_buffer.shape[:2] != (size[1], size[0]):
+                self.resize_buffer = np.empty((size[1], size[0], 3), dtype=np.uint8)
+            frame = cv2.resize(frame, size, dst=self.resize_buffer, interpolation=cv2.INTER_LINEAR)
+            width, height = size
+
+        if (width, height) != self.size:
+            self._allocate(width, height)
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGBA, dst=self.rgba_buffer)
+        self.photo.paste(self.image)
+
+    def _allocate(self, width: int, height: int) -> None:
+        self.size = (width, height)
+        self.rgba_buffer = np.empty((height, width, 4), dtype=np.uint8)
+        # Shares rgba_buffer's memory, so it always shows the latest conversion
+        self.image = Image.frombuffer("RGBA", (width, height), self.rgba_buffer, "raw", "RGBA", 0, 1)
+        self.photo = ImageTk.PhotoImage("RGBA", (width, height))
+        self.label.configure(image=self.photo, width=width, height=height)
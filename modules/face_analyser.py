@@ -1,18 +1,26 @@
 import os
 import shutil
-from typing import Any
+from typing import Any, Optional
 import insightface
 
 import cv2
 import numpy as np
 import modules.globals
 from tqdm import tqdm
-from modules.typing import Frame
-from modules.cluster_analysis import find_cluster_centroids, find_closest_centroid
-from modules.utilities import get_temp_directory_path, create_temp, extract_frames, clean_temp, get_temp_frame_paths
+from modules.typing import Face, Frame
+from modules.cluster_analysis import OnlineFaceClusterer, build_embedding_matrix
+from modules.face_store import FaceStore
+from modules.capturer import get_video_frame
+from modules.preview_proxy import get_proxy
+from modules.inference_scheduler import INFERENCE_SCHEDULER
+from modules.inference_broker import install as install_broker
+from modules.utilities import get_temp_directory_path, get_temp_frame_path, stream_frames
 from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 FACE_ANALYSER = None
+DET_SIZE = (640, 640)
 
 
 def get_face_analyser() -> Any:
@@ -20,21 +28,45 @@ def get_face_analyser() -> Any:
 
     if FACE_ANALYSER is None:
         FACE_ANALYSER = insightface.app.FaceAnalysis(name='buffalo_l', providers=modules.globals.execution_providers)
-        FACE_ANALYSER.prepare(ctx_id=0, det_size=(640, 640))
+        FACE_ANALYSER.prepare(ctx_id=0, det_size=DET_SIZE)
+        for task_name, model in FACE_ANALYSER.models.items():
+            install_broker(model, task_name)
     return FACE_ANALYSER
 
 
+def detect_faces(frame: Frame, det_size: Optional[int] = None) -> Any:
+    """
+    FaceAnalysis.get() with the detector input size chosen per call, so live
+    sessions can shrink detection without re-preparing the shared model
+    under other threads' feet.
+    """
+    face_analyser = get_face_analyser()
+    if det_size is None or (det_size, det_size) == DET_SIZE:
+        return face_analyser.get(frame)
+    bboxes, kpss = face_analyser.det_model.detect(frame, input_size=(det_size, det_size), max_num=0, metric='default')
+    faces = []
+    for index in range(bboxes.shape[0]):
+        face = Face(bbox=bboxes[index, 0:4], kps=kpss[index] if kpss is not None else None, det_score=bboxes[index, 4])
+        for task_name, model in face_analyser.models.items():
+            if task_name != 'detection':
+                model.get(frame, face)
+        faces.append(face)
+    return faces
+
+
 def get_one_face(frame: Frame) -> Any:
-    face = get_face_analyser().get(frame)
+    with INFERENCE_SCHEDULER.slot("detect"):
+        face = get_face_analyser().get(frame)
     try:
         return min(face, key=lambda x: x.bbox[0])
     except ValueError:
         return None
 
 
-def get_many_faces(frame: Frame) -> Any:
+def get_many_faces(frame: Frame, det_size: Optional[int] = None) -> Any:
     try:
-        return get_face_analyser().get(frame)
+        with INFERENCE_SCHEDULER.slot("detect"):
+            return detect_faces(frame, det_size)
     except IndexError:
         return None
 
@@ -58,7 +90,8 @@ def simplify_maps() -> Any:
             centroids.append(map['target']['face'].normed_embedding)
             faces.append(map['source']['face'])
 
-    modules.globals.simple_map = {'source_faces': faces, 'target_embeddings': centroids}
+    # Normalised once here so live matching is a single matrix multiply per frame
+    modules.globals.simple_map = {'source_faces': faces, 'target_embeddings': centroids, 'target_matrix': build_embedding_matrix(centroids)}
     return None
 
 def add_blank_map() -> Any:
@@ -94,96 +127,110 @@ def get_unique_faces_from_target_image() -> Any:
         return None
     
     
+def crop_face(frame: Frame, face: Any) -> Frame:
+    x_min, y_min, x_max, y_max = face['bbox']
+    return frame[max(0, int(y_min)):int(y_max), max(0, int(x_min)):int(x_max)].copy()
+
+
 def get_unique_faces_from_target_video() -> Any:
+    """
+    Streams the target through ffmpeg, detects faces on a worker pool and
+    clusters them in the same pass. The best-scoring crop per cluster is kept
+    while frames are in memory, so no frame has to be written to disk or
+    re-read afterwards.
+    """
     try:
         modules.globals.source_target_map = []
-        frame_face_embeddings = []
-        face_embeddings = []
-    
-        print('Creating temp resources...')
-        clean_temp(modules.globals.target_path)
-        create_temp(modules.globals.target_path)
-        print('Extracting frames...')
-        extract_frames(modules.globals.target_path)
-
-        temp_frame_paths = get_temp_frame_paths(modules.globals.target_path)
-
-        i = 0
-        for temp_frame_path in tqdm(temp_frame_paths, desc="Extracting face embeddings from frames"):
-            temp_frame = cv2.imread(temp_frame_path)
-            many_faces = get_many_faces(temp_frame)
-
-            for face in many_faces:
-                face_embeddings.append(face.normed_embedding)
-            
-            frame_face_embeddings.append({'frame': i, 'faces': many_faces, 'location': temp_frame_path})
-            i += 1
-
-        centroids = find_cluster_centroids(face_embeddings)
-
-        for frame in frame_face_embeddings:
-            for face in frame['faces']:
-                closest_centroid_index, _ = find_closest_centroid(centroids, face.normed_embedding)
-                face['target_centroid'] = closest_centroid_index
+        face_store = FaceStore()
+        clusterer = OnlineFaceClusterer()
+        best_candidates = {} # leader cluster id -> (det_score, store row, face, crop)
+        max_workers = max(1, modules.globals.execution_threads or 1)
+        pending = deque()
+
+        def consume(frame_index: int, frame: Frame, future: Any) -> None:
+            many_faces = future.result() or []
+            rows = face_store.append_many(frame_index, many_faces)
+            face_store.set_location(frame_index, get_temp_frame_path(modules.globals.target_path, frame_index))
+            for row, face in zip(rows, many_faces):
+                cluster_id = clusterer.partial_fit(face.normed_embedding)
+                best = best_candidates.get(cluster_id)
+                if best is None or face['det_score'] > best[0]:
+                    best_candidates[cluster_id] = (face['det_score'], row, face, crop_face(frame, face))
+            # Leader clusters merged away by the clusterer hand their best crop to the survivor
+            for cluster_id in [cluster_id for cluster_id in best_candidates if clusterer.resolve(cluster_id) != cluster_id]:
+                candidate = best_candidates.pop(cluster_id)
+                survivor = clusterer.resolve(cluster_id)
+                if survivor not in best_candidates or candidate[0] > best_candidates[survivor][0]:
+                    best_candidates[survivor] = candidate
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor, tqdm(desc="Extracting face embeddings from frames", unit="frame") as progress:
+            for frame_index, frame in enumerate(stream_frames(modules.globals.target_path)):
+                pending.append((frame_index, frame, executor.submit(get_many_faces, frame)))
+                if len(pending) >= max_workers * 2:
+                    consume(*pending.popleft())
+                    progress.update(1)
+            while pending:
+                consume(*pending.popleft())
+                progress.update(1)
+
+        centroids = clusterer.finalize()
+        clusters = face_store.assign_clusters(centroids)
 
         for i in range(len(centroids)):
             modules.globals.source_target_map.append({
-                'id' : i
+                'id' : i,
+                'target_faces_in_frame' : face_store.view(i)
             })
 
-            temp = []
-            for frame in tqdm(frame_face_embeddings, desc=f"Mapping frame embeddings to centroids-{i}"):
-                temp.append({'frame': frame['frame'], 'faces': [face for face in frame['faces'] if face['target_centroid'] == i], 'location': frame['location']})
+        for _, row, face, crop in best_candidates.values():
+            map = modules.globals.source_target_map[int(clusters[row])]
+            if 'target' not in map or face['det_score'] > map['target']['face']['det_score']:
+                map['target'] = {'cv2' : crop, 'face' : face, 'frame' : int(face_store.column('frame')[row])}
 
-            modules.globals.source_target_map[i]['target_faces_in_frame'] = temp
-
-        # dump_faces(centroids, frame_face_embeddings)
+        # dump_faces(face_store)
         default_target_face()
     except ValueError:
         return None
     
 
 def default_target_face():
+    """Fills in a target for clusters the analysis pass did not pick a crop for."""
     for map in modules.globals.source_target_map:
-        best_face = None
-        best_frame = None
-        for frame in map['target_faces_in_frame']:
-            if len(frame['faces']) > 0:
-                best_face = frame['faces'][0]
-                best_frame = frame
-                break
-
-        for frame in map['target_faces_in_frame']:
-            for face in frame['faces']:
-                if face['det_score'] > best_face['det_score']:
-                    best_face = face
-                    best_frame = frame
-
-        x_min, y_min, x_max, y_max = best_face['bbox']
-
-        target_frame = cv2.imread(best_frame['location'])
+        if 'target' in map:
+            continue
+        view = map['target_faces_in_frame']
+        best_row = view.store.best_row(view.cluster)
+        if best_row is None:
+            continue
+        best_face = view.store.face(best_row)
+        # The thumbnail only needs the preview proxy's resolution when one is built
+        proxy = get_proxy(modules.globals.target_path)
+        crop = proxy.get_face_crop(best_face['frame'], best_face['bbox']) if proxy else None
+        if crop is None:
+            target_frame = get_video_frame(modules.globals.target_path, best_face['frame'] + 1)
+            if target_frame is None:
+                continue
+            crop = crop_face(target_frame, best_face)
+
         map['target'] = {
-                        'cv2' : target_frame[int(y_min):int(y_max), int(x_min):int(x_max)],
-                        'face' : best_face
+                        'cv2' : crop,
+                        'face' : best_face,
+                        'frame' : best_face['frame']
                         }
 
 
-def dump_faces(centroids: Any, frame_face_embeddings: list):
+def dump_faces(face_store: FaceStore):
+    """Writes every face crop to temp/<cluster>/ in a single decode pass."""
     temp_directory_path = get_temp_directory_path(modules.globals.target_path)
+    cluster_total = int(face_store.column('cluster').max()) + 1 if len(face_store) else 0
 
-    for i in range(len(centroids)):
+    for i in range(cluster_total):
         if os.path.exists(temp_directory_path + f"/{i}") and os.path.isdir(temp_directory_path + f"/{i}"):
             shutil.rmtree(temp_directory_path + f"/{i}")
         Path(temp_directory_path + f"/{i}").mkdir(parents=True, exist_ok=True)
 
-        for frame in tqdm(frame_face_embeddings, desc=f"Copying faces to temp/./{i}"):
-            temp_frame = cv2.imread(frame['location'])
-
-            j = 0
-            for face in frame['faces']:
-                if face['target_centroid'] == i:
-                    x_min, y_min, x_max, y_max = face['bbox']
-
-                    if temp_frame[int(y_min):int(y_max), int(x_min):int(x_max)].size > 0:
-                        cv2.imwrite(temp_directory_path + f"/{i}/{frame['frame']}_{j}.png", temp_frame[int(y_min):int(y_max), int(x_min):int(x_max)])
-                j += 1
\ No newline at end of file
+    for frame_index, temp_frame in enumerate(tqdm(stream_frames(modules.globals.target_path), desc="Copying faces to temp")):
+        for j, face in enumerate(face_store.faces_in_frame(frame_index)):
+            crop = crop_face(temp_frame, face)
+            if crop.size > 0:
+                cv2.imwrite(temp_directory_path + f"/{face['target_centroid']}/{frame_index}_{j}.png", crop)
@@ -0,0 +1,270 @@
+import io
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import cv2
+import numpy as np
+from insightface.utils import face_align
+
+import modules.globals
+from modules import probe_cache
+from modules.face_analyser import get_one_face
+from modules.typing import Face, Frame
+
+NAME = "DLC.FACE-LIBRARY"
+# Persistent and private to the user, since the library holds biometric data
+LIBRARY_DIR = os.path.join(os.path.expanduser("~"), ".deep-live-cam", "faces")
+DATABASE_NAME = "faces.sqlite3"
+# Aligned like the swapper's input, so the crop shows exactly what identity is used
+CROP_SIZE = 128
+# Metadata columns returned by list_faces() and get_entry()
+FIELDS = {
+    "id": "TEXT PRIMARY KEY",
+    "name": "TEXT UNIQUE",
+    "source_path": "TEXT",
+    "source_hash": "TEXT",
+    "created": "REAL",
+    "width": "INTEGER",
+    "height": "INTEGER",
+    "det_score": "REAL",
+    "gender": "INTEGER",
+    "age": "INTEGER",
+}
+# Face fields stored as .npy blobs
+ARRAYS = ("bbox", "kps", "landmark_2d_106", "embedding")
+
+CONNECTION = None
+CONNECTION_PATH: Optional[str] = None
+THREAD_LOCK = threading.Lock()
+# Serialises detection so threads asking for the same new image detect it once
+DETECT_LOCK = threading.Lock()
+# Faces materialised in this process, by library id and by image content hash
+FACES: Dict[str, Face] = {}
+IMAGE_FACES: Dict[str, Optional[Face]] = {}
+
+
+def get_library_dir() -> str:
+    return modules.globals.face_library or LIBRARY_DIR
+
+
+def make_private_dirs(path: str) -> None:
+    """Creates path with every missing parent readable by the owner only."""
+    missing = []
+    while not os.path.isdir(path):
+        missing.append(path)
+        path = os.path.dirname(path)
+    for directory in reversed(missing):
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+
+def get_connection() -> Optional[sqlite3.Connection]:
+    global CONNECTION, CONNECTION_PATH
+
+    path = os.path.join(get_library_dir(), DATABASE_NAME)
+    if CONNECTION_PATH != path:
+        if CONNECTION:
+            CONNECTION.close()
+        CONNECTION, CONNECTION_PATH = None, path
+        FACES.clear()
+    if CONNECTION is None:
+        try:
+            make_private_dirs(os.path.dirname(path))
+            CONNECTION = sqlite3.connect(path, timeout=5, check_same_thread=False)
+            columns = ", ".join(f"{name} {kind}" for name, kind in FIELDS.items())
+            arrays = ", ".join(f"{name} BLOB" for name in ARRAYS)
+            CONNECTION.execute(f"CREATE TABLE IF NOT EXISTS faces ({columns}, {arrays}, crop BLOB)")
+            CONNECTION.execute("CREATE INDEX IF NOT EXISTS faces_source_hash ON faces (source_hash)")
+            CONNECTION.commit()
+        except sqlite3.Error as e:
+            print(f"{NAME}: face library unavailable: {e}")
+            CONNECTION = False
+    return CONNECTION or None
+
+
+def pack_array(array: Any) -> Optional[bytes]:
+    if array is None:
+        return None
+    buffer = io.BytesIO()
+    np.save(buffer, np.asarray(array), allow_pickle=False)
+    return buffer.getvalue()
+
+
+def unpack_array(blob: Optional[bytes]) -> Optional[np.ndarray]:
+    return None if blob is None else np.load(io.BytesIO(blob), allow_pickle=False)
+
+
+def _entry(row: tuple) -> Dict[str, Any]:
+    return dict(zip(FIELDS, row))
+
+
+def _select(columns: str, face_id: str) -> Optional[tuple]:
+    # Ids win over names, so a name that looks like an id cannot shadow another face
+    with THREAD_LOCK:
+        connection = get_connection()
+        if connection is None:
+            return None
+        try:
+            return connection.execute(
+                f"SELECT {columns} FROM faces WHERE id = ? OR name = ? ORDER BY id = ? DESC LIMIT 1",
+                (face_id, face_id, face_id),
+            ).fetchone()
+        except sqlite3.Error:
+            return None
+
+
+def list_faces() -> List[Dict[str, Any]]:
+    with THREAD_LOCK:
+        connection = get_connection()
+        if connection is None:
+            return []
+        try:
+            rows = connection.execute(f"SELECT {', '.join(FIELDS)} FROM faces ORDER BY created").fetchall()
+        except sqlite3.Error:
+            return []
+    return [_entry(row) for row in rows]
+
+
+def get_entry(face_id: str) -> Optional[Dict[str, Any]]:
+    """Metadata of a library face, looked up by id or by name."""
+    row = _select(", ".join(FIELDS), face_id)
+    return _entry(row) if row is not None else None
+
+
+def get_face(face_id: str) -> Optional[Face]:
+    """The stored face, ready for the swapper; loaded from the library once per process."""
+    face = FACES.get(face_id)
+    if face is not None:
+        return face
+    row = _select(", ".join(("id",) + ARRAYS + ("det_score", "gender", "age")), face_id)
+    if row is None:
+        return None
+    bbox, kps, landmarks, embedding = (unpack_array(blob) for blob in row[1:5])
+    det_score, gender, age = row[5:]
+    face = Face(bbox=bbox, kps=kps, landmark_2d_106=landmarks, embedding=embedding, det_score=det_score, gender=gender, age=age)
+    FACES[face_id] = FACES[row[0]] = face
+    return face
+
+
+def get_crop(face_id: str) -> Optional[bytes]:
+    """The aligned face crop as PNG."""
+    row = _select("crop", face_id)
+    return row[0] if row is not None else None
+
+
+def add_face(image_path: str, name: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Detects the face in an image and stores it. An image whose content is
+    already in the library returns the existing entry. Raises ValueError
+    with a message fit for users when the image cannot be used.
+    """
+    source_hash = probe_cache.full_hash(image_path)
+    if source_hash is None:
+        raise ValueError(f"cannot read {image_path}")
+    existing = find_entry(source_hash)
+    if existing is not None:
+        return existing
+    if name is not None and get_entry(name) is not None:
+        raise ValueError(f"a library face is already called {name}")
+    frame = cv2.imread(image_path)
+    if frame is None:
+        raise ValueError(f"{image_path} is not a readable image")
+    face = get_one_face(frame)
+    if face is None:
+        raise ValueError(f"no face found in {image_path}")
+    entry = {
+        "id": uuid.uuid4().hex[:12],
+        "name": name,
+        "source_path": os.path.abspath(image_path),
+        "source_hash": source_hash,
+        "created": time.time(),
+        "width": frame.shape[1],
+        "height": frame.shape[0],
+        "det_score": float(face.get("det_score", 0.0)),
+        "gender": None if face.get("gender") is None else int(face.gender),
+        "age": None if face.get("age") is None else int(face.age),
+    }
+    arrays = [pack_array(face.get(field)) for field in ARRAYS]
+    crop = cv2.imencode(".png", face_align.norm_crop(frame, face.kps, CROP_SIZE))[1].tobytes()
+    with THREAD_LOCK:
+        connection = get_connection()
+        if connection is None:
+            raise ValueError("the face library is unavailable")
+        try:
+            names = list(FIELDS) + list(ARRAYS) + ["crop"]
+            connection.execute(
+                f"INSERT INTO faces ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+                list(entry.values()) + arrays + [crop],
+            )
+            connection.commit()
+        except sqlite3.Error as e:
+            raise ValueError(f"could not store the face: {e}")
+    FACES[entry["id"]] = face
+    IMAGE_FACES[source_hash] = face
+    return entry
+
+
+def remove_face(face_id: str) -> bool:
+    entry = get_entry(face_id)
+    if entry is None:
+        return False
+    with THREAD_LOCK:
+        connection = get_connection()
+        if connection is None:
+            return False
+        try:
+            connection.execute("DELETE FROM faces WHERE id = ?", (entry["id"],))
+            connection.commit()
+        except sqlite3.Error:
+            return False
+    for key in (entry["id"], entry["name"]):
+        FACES.pop(key, None)
+    IMAGE_FACES.pop(entry["source_hash"], None)
+    return True
+
+
+def find_entry(source_hash: str) -> Optional[Dict[str, Any]]:
+    with THREAD_LOCK:
+        connection = get_connection()
+        if connection is None:
+            return None
+        try:
+            row = connection.execute(f"SELECT {', '.join(FIELDS)} FROM faces WHERE source_hash = ? LIMIT 1", (source_hash,)).fetchone()
+        except sqlite3.Error:
+            return None
+    return _entry(row) if row is not None else None
+
+
+def load_face(image_path: str, frame: Optional[Frame] = None) -> Optional[Face]:
+    """
+    The face in a source image. Images already in the library skip
+    detection, and every image is detected at most once per process, so
+    frame workers asking for the same source again get it for free.
+    """
+    source_hash = probe_cache.full_hash(image_path)
+    if source_hash is None:
+        return None
+    if source_hash in IMAGE_FACES:
+        return IMAGE_FACES[source_hash]
+    with DETECT_LOCK:
+        if source_hash not in IMAGE_FACES:
+            entry = find_entry(source_hash)
+            if entry is not None:
+                IMAGE_FACES[source_hash] = get_face(entry["id"])
+            else:
+                frame = cv2.imread(image_path) if frame is None else frame
+                IMAGE_FACES[source_hash] = get_one_face(frame) if frame is not None else None
+        return IMAGE_FACES[source_hash]
+
+
+def get_source_face(source_path: Optional[str] = None) -> Optional[Face]:
+    """The face selected with --source-id, otherwise the face in source_path."""
+    if modules.globals.source_id:
+        return get_face(modules.globals.source_id)
+    if not source_path:
+        return None
+    return load_face(source_path)
+
@@ -0,0 +1,188 @@
+import os
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from modules.typing import Face
+
+# name: (per-row shape, dtype). Embeddings are stored normed in float16, which
+# is plenty for cosine matching and halves the largest column.
+COLUMNS = {
+    "frame": ((), np.int32),
+    "bbox": ((4,), np.float32),
+    "kps": ((5, 2), np.float32),
+    "landmark_2d_106": ((106, 2), np.float32),
+    "embedding": ((512,), np.float16),
+    "det_score": ((), np.float32),
+    "cluster": ((), np.int32),
+}
+EMBEDDING_CHUNK = 65536
+
+
+class FaceStore:
+    """
+    Struct-of-arrays store for every face found in a target video.
+
+    Instead of keeping the full insightface Face dict per detection, only the
+    fields the swapper and the mapper need are kept in contiguous columns
+    (frame index, bbox, kps, landmark_2d_106, normed embedding, det_score and
+    cluster id), which costs about 2 KB per face. Columns live in RAM or, when
+    a directory is given, in memory-mapped files. Face objects are
+    materialised on demand from a row.
+    """
+
+    def __init__(self, capacity: int = 1024, directory: Optional[str] = None):
+        self.directory = directory
+        self.size = 0
+        self.capacity = 0
+        self.columns: Dict[str, np.ndarray] = {}
+        self.locations: Dict[str, int] = {}
+        self.frame_locations: Dict[int, str] = {}
+        self._frame_index: Optional[tuple] = None
+        self._cluster_rows: Dict[int, np.ndarray] = {}
+        self._grow(max(1, capacity))
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column[:self.size].nbytes for column in self.columns.values())
+
+    def append(self, frame_index: int, face: Face) -> int:
+        """Copies the needed fields of one detected face into the columns and returns its row."""
+        if self.size == self.capacity:
+            self._grow(self.capacity * 2)
+        row = self.size
+        columns = self.columns
+        columns["frame"][row] = frame_index
+        columns["bbox"][row] = face.bbox
+        columns["kps"][row] = face.kps if face.get("kps") is not None else 0
+        landmarks = face.get("landmark_2d_106")
+        columns["landmark_2d_106"][row] = landmarks if landmarks is not None else np.nan
+        columns["embedding"][row] = face.normed_embedding if face.get("embedding") is not None else 0
+        columns["det_score"][row] = face.get("det_score", 0.0)
+        columns["cluster"][row] = -1
+        self.size += 1
+        self._frame_index = None
+        return row
+
+    def append_many(self, frame_index: int, faces: List[Face]) -> List[int]:
+        return [self.append(frame_index, face) for face in faces or []]
+
+    def set_location(self, frame_index: int, location: str) -> None:
+        self.locations[location] = frame_index
+        self.frame_locations[frame_index] = location
+
+    def frame_index_of(self, location: str) -> Optional[int]:
+        """Frame index for a temp frame path; falls back to the %04d.png naming of extract_frames."""
+        frame_index = self.locations.get(location)
+        if frame_index is None:
+            stem = os.path.splitext(os.path.basename(location))[0]
+            if stem.isdigit():
+                frame_index = int(stem) - 1
+        return frame_index
+
+    def column(self, name: str) -> np.ndarray:
+        return self.columns[name][:self.size]
+
+    def assign_clusters(self, centroids: Any) -> np.ndarray:
+        """Labels every row with its closest centroid, in chunks so no full similarity matrix is built."""
+        centroids = np.asarray(centroids, dtype=np.float32)
+        clusters = self.columns["cluster"]
+        for start in range(0, self.size, EMBEDDING_CHUNK):
+            stop = min(self.size, start + EMBEDDING_CHUNK)
+            similarities = self.columns["embedding"][start:stop].astype(np.float32) @ centroids.T
+            clusters[start:stop] = np.argmax(similarities, axis=1)
+        self._cluster_rows = {}
+        return self.column("cluster")
+
+    def rows_in_frame(self, frame_index: int, cluster: Optional[int] = None) -> np.ndarray:
+        # Built once and swapped in as a tuple so frame worker threads never see half of it
+        frame_index_arrays = self._frame_index
+        if frame_index_arrays is None:
+            order = np.argsort(self.column("frame"), kind="stable")
+            frame_index_arrays = (order, self.column("frame")[order])
+            self._frame_index = frame_index_arrays
+        order, frames = frame_index_arrays
+        start = np.searchsorted(frames, frame_index, side="left")
+        stop = np.searchsorted(frames, frame_index, side="right")
+        rows = order[start:stop]
+        if cluster is not None:
+            rows = rows[self.columns["cluster"][rows] == cluster]
+        return rows
+
+    def rows_in_cluster(self, cluster: int) -> np.ndarray:
+        rows = self._cluster_rows.get(cluster)
+        if rows is None:
+            rows = np.flatnonzero(self.column("cluster") == cluster)
+            self._cluster_rows[cluster] = rows
+        return rows
+
+    def best_row(self, cluster: int) -> Optional[int]:
+        rows = self.rows_in_cluster(cluster)
+        if len(rows) == 0:
+            return None
+        return int(rows[np.argmax(self.columns["det_score"][rows])])
+
+    def face(self, row: int) -> Face:
+        columns = self.columns
+        landmarks = columns["landmark_2d_106"][row]
+        return Face(
+            bbox=columns["bbox"][row].copy(),
+            kps=columns["kps"][row].copy(),
+            landmark_2d_106=None if np.isnan(landmarks).any() else landmarks.copy(),
+            embedding=columns["embedding"][row].astype(np.float32),
+            det_score=float(columns["det_score"][row]),
+            target_centroid=int(columns["cluster"][row]),
+            frame=int(columns["frame"][row]),
+        )
+
+    def faces_in_frame(self, frame_index: int, cluster: Optional[int] = None) -> List[Face]:
+        return [self.face(int(row)) for row in self.rows_in_frame(frame_index, cluster)]
+
+    def view(self, cluster: int) -> "ClusterView":
+        return ClusterView(self, cluster)
+
+    def _grow(self, capacity: int) -> None:
+        for name, (shape, dtype) in COLUMNS.items():
+            if self.directory:
+                path = os.path.join(self.directory, f"faces.{name}.{capacity}.npy")
+                column = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(capacity,) + shape)
+            else:
+                column = np.empty((capacity,) + shape, dtype=dtype)
+            previous = self.columns.get(name)
+            if previous is not None:
+                column[:self.size] = previous[:self.size]
+                self._release(name, previous)
+            self.columns[name] = column
+        self.capacity = capacity
+
+    def _release(self, name: str, column: np.ndarray) -> None:
+        if isinstance(column, np.memmap):
+            path = column.filename
+            del column
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class ClusterView:
+    """Per-identity view over a FaceStore, used as a map's target_faces_in_frame."""
+
+    def __init__(self, store: FaceStore, cluster: int):
+        self.store = store
+        self.cluster = cluster
+
+    def __len__(self) -> int:
+        return len(self.store.rows_in_cluster(self.cluster))
+
+    def faces_in_frame(self, frame_index: int) -> List[Face]:
+        return self.store.faces_in_frame(frame_index, self.cluster)
+
+    def faces_at(self, location: str) -> List[Face]:
+        frame_index = self.store.frame_index_of(location)
+        if frame_index is None:
+            return []
+        return self.faces_in_frame(frame_index)
@@ -0,0 +1,159 @@
+import threading
+import time
+from contextlib import nullcontext
+from typing import Any, Callable, List, Optional
+
+import cv2
+import numpy as np
+
+from modules.face_analyser import get_many_faces
+from modules.typing import Face, Frame
+
+# Pyramidal Lucas-Kanade settings for frame-to-frame point tracking
+LK_PARAMS = dict(
+    winSize=(21, 21),
+    maxLevel=3,
+    criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03),
+)
+# Extra corners tracked inside each face box besides its landmarks
+MAX_CORNERS = 24
+MIN_TRACKED_POINTS = 6
+
+
+class TrackedFace:
+    """A detected face plus the points used to carry it from frame to frame."""
+
+    def __init__(self, face: Face, points: np.ndarray):
+        self.face = face
+        self.points = points
+
+
+class FaceTracker:
+    """
+    Decouples live face detection from the frame rate. Frames are offered to
+    a detector thread that always works on the newest one and runs as fast
+    as it can. Between detections, every frame reuses the latest detections
+    with their bbox, kps and 106-point landmarks moved to the current frame
+    by sparse optical flow and a per-face similarity transform.
+    """
+
+    def __init__(self, max_age: float = 1.0, scope: Optional[Callable[[], Any]] = None):
+        self.max_age = max_age
+        # Context the detector thread runs in, e.g. the live session it works for
+        self.scope = scope or nullcontext
+        self.pending = None  # newest frame waiting for the detector
+        self.pending_det_size = None  # detector input size asked for with it
+        self.detection = None  # (gray, faces, detected_at) not yet merged into the tracks
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.tracks: List[TrackedFace] = []
+        self.previous_gray = None
+        self.detected_at = 0.0
+        self.detections = 0
+
+    def start(self) -> "FaceTracker":
+        self.running = True
+        self.thread = threading.Thread(target=self._detect_loop, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+
+    def submit(self, frame: Frame, det_size: Optional[int] = None) -> None:
+        """Offers a frame to the detector; an older frame still waiting is replaced."""
+        with self.condition:
+            self.pending, self.pending_det_size = frame, det_size
+            self.condition.notify()
+
+    def track(self, frame: Frame) -> List[Face]:
+        """Faces for frame: the latest detections motion-compensated to it."""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        with self.condition:
+            detection, self.detection = self.detection, None
+
+        if detection is not None:
+            detection_gray, faces, detected_at = detection
+            # Detections describe an older frame; carry them forward to this one
+            self.tracks = [TrackedFace(face, self._face_points(detection_gray, face)) for face in faces]
+            self.detected_at = detected_at
+            if detection_gray.shape == gray.shape:
+                self._advance(detection_gray, gray)
+        elif self.previous_gray is not None and self.previous_gray.shape == gray.shape:
+            self._advance(self.previous_gray, gray)
+        self.previous_gray = gray
+
+        if time.time() - self.detected_at > self.max_age:
+            self.tracks = []
+        return [track.face for track in self.tracks]
+
+    def _detect_loop(self) -> None:
+        with self.scope():
+            self._detect()
+
+    def _detect(self) -> None:
+        while True:
+            with self.condition:
+                while self.running and self.pending is None:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                frame, det_size, self.pending = self.pending, self.pending_det_size, None
+            try:
+                faces = get_many_faces(frame, det_size) or []
+            except Exception as e:
+                print(f"Face tracker: detection failed: {e}")
+                continue
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            with self.condition:
+                self.detection = (gray, faces, time.time())
+                self.detections += 1
+
+    def _face_points(self, gray: np.ndarray, face: Face) -> np.ndarray:
+        points = [np.asarray(face.kps, dtype=np.float32).reshape(-1, 2)] if face.get("kps") is not None else []
+        if face.get("landmark_2d_106") is not None:
+            points.append(np.asarray(face.landmark_2d_106, dtype=np.float32).reshape(-1, 2))
+        x1, y1, x2, y2 = np.asarray(face.bbox).astype(int)
+        mask = np.zeros_like(gray)
+        mask[max(0, y1):max(0, y2), max(0, x1):max(0, x2)] = 255
+        corners = cv2.goodFeaturesToTrack(gray, MAX_CORNERS, 0.01, 5, mask=mask)
+        if corners is not None:
+            points.append(corners.reshape(-1, 2))
+        if not points:
+            return np.zeros((0, 1, 2), dtype=np.float32)
+        return np.concatenate(points).reshape(-1, 1, 2).astype(np.float32)
+
+    def _advance(self, previous_gray: np.ndarray, gray: np.ndarray) -> None:
+        for track in self.tracks:
+            if len(track.points) < MIN_TRACKED_POINTS:
+                continue
+            next_points, status, _ = cv2.calcOpticalFlowPyrLK(previous_gray, gray, track.points, None, **LK_PARAMS)
+            good = status.reshape(-1) == 1
+            if good.sum() < MIN_TRACKED_POINTS:
+                continue
+            matrix, _ = cv2.estimateAffinePartial2D(track.points[good], next_points[good], method=cv2.RANSAC, ransacReprojThreshold=3.0)
+            if matrix is None:
+                continue
+            track.face = transform_face(track.face, matrix)
+            # Points lost by LK keep following the face through the fitted transform
+            track.points = cv2.transform(track.points, matrix)
+            track.points[good] = next_points[good]
+
+
+def transform_face(face: Face, matrix: np.ndarray) -> Face:
+    """Copy of face with bbox, kps and landmarks mapped through a 2x3 affine matrix."""
+    moved = Face(face)
+    x1, y1, x2, y2 = np.asarray(face.bbox, dtype=np.float32)
+    corners = cv2.transform(np.array([[[x1, y1]], [[x2, y1]], [[x1, y2]], [[x2, y2]]], dtype=np.float32), matrix).reshape(-1, 2)
+    moved.bbox = np.concatenate([corners.min(axis=0), corners.max(axis=0)]).astype(np.float32)
+    for key in ("kps", "landmark_2d_106"):
+        points: Optional[Any] = face.get(key)
+        if points is not None:
+            points = np.asarray(points, dtype=np.float32)
+            moved[key] = cv2.transform(points.reshape(-1, 1, 2), matrix).reshape(points.shape)
+    return moved
@@ -0,0 +1,190 @@
+import queue
+import subprocess
+import threading
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+import modules.globals
+from modules.typing import Frame
+from modules.utilities import get_quality_args
+
+# Longest run of repeated frames written for a gap between timestamped frames, in seconds
+MAX_GAP = 2.0
+# Container ffmpeg needs for each streaming protocol; files pick theirs from the extension
+STREAM_FORMATS = {
+    "rtmp://": "flv",
+    "rtmps://": "flv",
+    "udp://": "mpegts",
+    "srt://": "mpegts",
+    "tcp://": "mpegts",
+}
+
+
+def get_stream_format(output: str) -> Optional[str]:
+    for prefix, stream_format in STREAM_FORMATS.items():
+        if output.lower().startswith(prefix):
+            return stream_format
+    return None
+
+
+class FFmpegSink:
+    """
+    Encodes BGR frames with ffmpeg from a rawvideo stdin pipe to a file, UDP
+    or RTMP target. write() never blocks the caller: frames go into a
+    bounded queue that an encoder thread drains. When the encoder falls
+    behind, drop_policy decides which frame is lost: "oldest" keeps the
+    stream current, "newest" keeps what is already queued. Frames written
+    with a capture timestamp are placed on the constant-rate output grid by
+    that timestamp, repeating the previous frame over gaps left by dropped
+    frames, so playback speed and audio sync survive drops.
+    """
+
+    def __init__(
+        self,
+        output: str,
+        width: int,
+        height: int,
+        fps: float = 30.0,
+        encoder: Optional[str] = None,
+        quality: Optional[int] = None,
+        queue_size: int = 8,
+        drop_policy: str = "oldest",
+        audio_input: Optional[List[str]] = None,
+    ):
+        if drop_policy not in ("oldest", "newest"):
+            raise ValueError(f"Unknown drop policy: {drop_policy}")
+        self.output = output
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.encoder = encoder or modules.globals.video_encoder or "libx264"
+        self.quality = next(value for value in (quality, modules.globals.video_quality, 18) if value is not None)
+        self.drop_policy = drop_policy
+        # ffmpeg input options for a second, audio-only input, e.g. ["-f", "pulse", "-i", "default"]
+        self.audio_input = audio_input
+        self.frames: "queue.Queue[Optional[Tuple[Frame, Optional[float]]]]" = queue.Queue(maxsize=max(1, queue_size))
+        self.process = None
+        self.thread = None
+        self.written = 0
+        self.dropped = 0
+        self.duplicated = 0
+        self.error = None
+        self.first_timestamp = None
+        self.next_slot = 0
+        self.previous_frame = None
+
+    def build_command(self) -> List[str]:
+        stream_format = get_stream_format(self.output)
+        commands = [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            modules.globals.log_level,
+            "-y",
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "bgr24",
+            "-s",
+            f"{self.width}x{self.height}",
+            "-r",
+            str(self.fps),
+            "-i",
+            "pipe:0",
+        ]
+        if self.audio_input:
+            commands.extend(["-thread_queue_size", "1024", *self.audio_input, "-map", "0:v", "-map", "1:a", "-c:a", "aac", "-shortest"])
+        commands.extend(["-c:v", self.encoder, *get_quality_args(self.encoder, self.quality)])
+        if stream_format and self.encoder in ("libx264", "libx265"):
+            # Streams favour latency over compression
+            commands.extend(["-preset", "veryfast", "-tune", "zerolatency"])
+        commands.extend(["-pix_fmt", "yuv420p"])
+        if stream_format:
+            commands.extend(["-f", stream_format])
+        commands.append(self.output)
+        return commands
+
+    def start(self) -> "FFmpegSink":
+        self.process = subprocess.Popen(self.build_command(), stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self.thread = threading.Thread(target=self._encode_loop, daemon=True)
+        self.thread.start()
+        return self
+
+    def write(self, frame: Frame, timestamp: Optional[float] = None) -> bool:
+        """Queues a frame for encoding; returns False if a frame had to be dropped."""
+        if self.error is not None:
+            return False
+        item = (frame, timestamp)
+        try:
+            self.frames.put_nowait(item)
+            return True
+        except queue.Full:
+            pass
+        self.dropped += 1
+        if self.drop_policy == "newest":
+            return False
+        try:
+            self.frames.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            self.frames.put_nowait(item)
+        except queue.Full:
+            pass
+        return False
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Flushes queued frames and waits for ffmpeg to finish the output."""
+        if self.thread is not None:
+            try:
+                self.frames.put(None, timeout=timeout)
+            except queue.Full:
+                pass  # the encoder thread already stopped on an error
+            self.thread.join(timeout)
+            self.thread = None
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+            self.process = None
+
+    def _encode_loop(self) -> None:
+        while True:
+            item = self.frames.get()
+            if item is None:
+                return
+            frame, timestamp = item
+            if frame.shape[1] != self.width or frame.shape[0] != self.height:
+                frame = cv2.resize(frame, (self.width, self.height))
+            frame = np.ascontiguousarray(frame)
+            try:
+                if timestamp is None:
+                    self.process.stdin.write(frame.data)
+                    self.written += 1
+                    continue
+                if self.first_timestamp is None:
+                    self.first_timestamp = timestamp
+                slot = round((timestamp - self.first_timestamp) * self.fps)
+                if slot < self.next_slot:
+                    continue  # its slot is already taken by an earlier frame
+                # Gaps up to MAX_GAP seconds are filled; longer stalls are closed up
+                gap = min(slot - self.next_slot, int(self.fps * MAX_GAP))
+                if self.previous_frame is not None:
+                    for _ in range(gap):
+                        self.process.stdin.write(self.previous_frame.data)
+                    self.duplicated += gap
+                self.process.stdin.write(frame.data)
+                self.written += 1
+                self.next_slot = slot + 1
+                self.previous_frame = frame
+            except (BrokenPipeError, OSError) as e:
+                self.error = e
+                print(f"FFmpeg sink: encoder stopped: {e}")
+                return
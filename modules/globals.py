@@ -19,6 +19,10 @@ simple_map: Dict[str, Any] = {}             # Stores simplified map (embeddings/
 source_path: str | None = None
 target_path: str | None = None
 output_path: str | None = None
+source_id: str | None = None          # Face library id or name used instead of source_path
+face_library: str | None = None       # Face library directory; ~/.deep-live-cam/faces by default
+add_source_face: str | None = None    # Store the source image's face in the library under this name ("" = unnamed)
+list_source_faces: bool = False
 
 # Processing Options
 frame_processors: List[str] = []
@@ -35,17 +39,35 @@ video_encoder: str | None = None
 video_quality: int | None = None # Typically a CRF value or bitrate
 
 # Live Mode Options
+live_sources: list[str] = []      # Camera indices, files or URLs for headless --live mode, one session each
+live_loop: bool = False           # Restart a --live video file at its end
 live_mirror: bool = False
 live_resizable: bool = True
 camera_input_combobox: Any | None = None # Placeholder for UI element if needed
 webcam_preview_running: bool = False
 show_fps: bool = False
+live_async_detection: bool = False # Detect on a background thread and track faces between detections
+live_quality_control: bool = False # Step live quality knobs down/up to hold live_target_fps
+live_target_fps: int = 24
+live_latency_target: int = 250 # ms; frames that waited longer are dropped before detection (0 = off)
+live_analysis_size: int = 640  # Longest side of the copy live faces are detected on (0 = full frame)
+live_record_path: str | None = None   # Record the processed live stream here (the preview's Record button picks a name otherwise)
+live_record_audio: str | None = None  # Audio device muxed into live recordings (pulse/dshow/avfoundation name)
 
 # System Configuration
 max_memory: int | None = None        # Memory limit in GB? (Needs clarification)
 execution_providers: List[str] = []  # e.g., ['CUDAExecutionProvider', 'CPUExecutionProvider']
 execution_threads: int | None = None # Number of threads for CPU execution
+inference_batch_deadline: float = 0 # ms to gather concurrent model calls into one batch (0 = off)
 headless: bool | None = None         # Run without UI?
+server: bool = False                 # Run the HTTP job server instead of the UI or a one-shot run
+server_host: str = "127.0.0.1"
+server_port: int = 8000
+server_workers: int = 1              # Worker processes, each with its own loaded models
+server_root: str | None = None       # Uploads and results; a temp directory by default
+server_allow_paths: bool = False     # Let jobs reference local files by path instead of upload id
+server_max_live_sessions: int = 4   # WebSocket live sessions served at the same time (0 = no limit)
+server_retention: float = 24.0       # Hours finished jobs, their results and unused uploads are kept (0 = forever)
 log_level: str = "error"             # Logging level (e.g., 'debug', 'info', 'warning', 'error')
 
 # Face Processor UI Toggles (Example)
@@ -56,6 +78,19 @@ face_swapper_enabled: bool = True # General toggle for the swapper processor
 opacity: float = 1.0              # Blend factor for the swapped face (0.0-1.0)
 sharpness: float = 0.0            # Sharpness enhancement for swapped face (0.0-1.0+)
 
+# Face Enhancer Options
+selective_enhancement: bool = True # Enhance only faces the swapper touched in the frame
+enhancer_min_face_size: int = 32   # Skip swapped faces smaller than this (px, longest bbox side)
+enhancer_max_face_size: int = 512  # Skip faces already larger than GFPGAN's 512px output (0 = no limit)
+enhancer_reuse_frames: int = 0     # Reuse a track's enhanced patch for up to K frames in live/preview (0 = off)
+enhancer_reuse_tolerance: float = 0.02 # Max landmark drift (fraction of face size) for a pose to count as stable
+
+# Preview Options
+preview_proxy: bool = False       # Scrub videos from a low-resolution proxy built in the background
+preview_proxy_height: int = 480   # Proxy frame height in pixels
+preview_proxy_stride: int = 5     # Keep every Nth frame in the proxy
+preview_proxy_cache_size: int = 4096 # MB of proxies kept on disk; least recently used ones are deleted first
+
 # Mouth Mask Options
 mouth_mask: bool = False           # Enable mouth area masking/pasting
 show_mouth_mask_box: bool = False  # Visualize the mouth mask area (for debugging)
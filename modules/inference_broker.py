@@ -0,0 +1,167 @@
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import modules.globals
+from modules.inference_scheduler import current_client
+
+NAME = "DLC.BROKER"
+MAX_BATCH = 8
+# Callers seen within this window count as concurrent when deciding whether to wait for company
+ACTIVE_WINDOW = 1.0
+# How onnxruntime reports inputs a model cannot take (rank or dimension mismatches); anything else may be transient
+SHAPE_ERRORS = ("invalid_argument", "invalidargument", "invalid rank", "invalid dimensions")
+
+
+def is_shape_error(error: Exception) -> bool:
+    text = f"{type(error).__name__}: {error}".lower()
+    return any(marker in text for marker in SHAPE_ERRORS)
+
+
+class InferenceRequest:
+    __slots__ = ("feeds", "output_names", "rows", "outputs", "error", "done")
+
+    def __init__(self, output_names: Optional[List[str]], feeds: Dict[str, np.ndarray]):
+        self.output_names = output_names
+        self.feeds = feeds
+        self.rows = next(iter(feeds.values())).shape[0]
+        self.outputs = None
+        self.error = None
+        self.done = threading.Event()
+
+    def batch_key(self) -> Tuple:
+        # Only requests for the same outputs with identically shaped inputs can share a run
+        names = tuple(self.output_names) if self.output_names else None
+        return names, tuple((name, value.shape[1:], value.dtype.str) for name, value in sorted(self.feeds.items()))
+
+
+class BatchingSession:
+    """
+    Stands in for an onnxruntime InferenceSession inside an insightface model.
+    run() calls from any thread are queued; one worker thread collects the
+    requests that arrive within deadline seconds of the first, concatenates
+    them along the batch axis and runs the real session once, then slices
+    the outputs back to each caller. Cropping and pasting stay on the
+    callers' threads, only the model run is shared. Models whose batch
+    dimension is fixed, or whose outputs cannot be split per request, fall
+    back to running the queued requests one by one on the same worker. A
+    batch failing for another reason, such as running out of GPU memory, is
+    run one by one instead and later batches are kept smaller.
+    """
+
+    def __init__(self, session: Any, deadline: float, max_batch: int = MAX_BATCH, name: str = "model"):
+        self.session = session
+        self.deadline = deadline
+        self.max_batch = max_batch
+        self.name = name
+        self.batchable = all(not isinstance(model_input.shape[0], int) for model_input in session.get_inputs())
+        self.condition = threading.Condition()
+        self.pending: List[InferenceRequest] = []
+        self.active_clients: Dict[Any, float] = {}
+        self.runs = 0
+        self.requests = 0
+        self.thread = threading.Thread(target=self._run_loop, name=f"inference-broker-{name}", daemon=True)
+        self.thread.start()
+
+    def __getattr__(self, name: str) -> Any:
+        # get_inputs(), get_providers() and friends still come from the real session
+        return getattr(self.session, name)
+
+    def run(self, output_names: Optional[List[str]], feeds: Dict[str, np.ndarray], run_options: Any = None) -> List[np.ndarray]:
+        request = InferenceRequest(output_names, feeds)
+        with self.condition:
+            self.active_clients[current_client() or threading.get_ident()] = time.time()
+            self.pending.append(request)
+            self.condition.notify_all()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.outputs
+
+    def get_stats(self) -> dict:
+        with self.condition:
+            return {
+                "batchable": self.batchable,
+                "requests": self.requests,
+                "runs": self.runs,
+                "average_batch": self.requests / self.runs if self.runs else 0.0,
+            }
+
+    def _concurrent_clients(self) -> int:
+        now = time.time()
+        for client, seen_at in list(self.active_clients.items()):
+            if now - seen_at > ACTIVE_WINDOW:
+                del self.active_clients[client]
+        return len(self.active_clients)
+
+    def _collect(self) -> List[InferenceRequest]:
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+            first = self.pending[0]
+            # A lone caller never waits; with company the batch may grow until the deadline
+            if self.batchable and self._concurrent_clients() > 1:
+                until = time.perf_counter() + self.deadline
+                while len(self.pending) < self.max_batch and time.perf_counter() < until:
+                    self.condition.wait(max(0.0, until - time.perf_counter()))
+            key = first.batch_key() if self.batchable else None
+            batch = [request for request in self.pending if self.batchable and request.batch_key() == key][:self.max_batch] or [first]
+            self.pending = [request for request in self.pending if request not in batch]
+            return batch
+
+    def _run_loop(self) -> None:
+        while True:
+            batch = self._collect()
+            if len(batch) > 1 and self._run_batch(batch):
+                continue
+            for request in batch:
+                self._run_single(request)
+
+    def _run_single(self, request: InferenceRequest) -> None:
+        try:
+            request.outputs = self.session.run(request.output_names, request.feeds)
+        except Exception as e:
+            request.error = e
+        with self.condition:
+            self.runs += 1
+            self.requests += 1
+        request.done.set()
+
+    def _run_batch(self, batch: List[InferenceRequest]) -> bool:
+        rows = sum(request.rows for request in batch)
+        feeds = {name: np.concatenate([request.feeds[name] for request in batch]) for name in batch[0].feeds}
+        try:
+            outputs = self.session.run(batch[0].output_names, feeds)
+        except Exception as e:
+            if is_shape_error(e):
+                print(f"{NAME}: {self.name} cannot run batches ({e}), running requests one by one")
+                self.batchable = False
+            else:
+                self.max_batch = max(2, len(batch) // 2)
+                print(f"{NAME}: {self.name} batch of {len(batch)} failed ({e}), running it one by one and batching at most {self.max_batch}")
+            return False
+        if any(output.shape[0] != rows for output in outputs):
+            print(f"{NAME}: {self.name} outputs have no batch axis, running requests one by one")
+            self.batchable = False
+            return False
+        start = 0
+        for request in batch:
+            request.outputs = [output[start:start + request.rows] for output in outputs]
+            start += request.rows
+        with self.condition:
+            self.runs += 1
+            self.requests += len(batch)
+        for request in batch:
+            request.done.set()
+        return True
+
+
+def install(model: Any, name: str) -> None:
+    """Routes an insightface model's session through a BatchingSession when batching is enabled."""
+    deadline = modules.globals.inference_batch_deadline
+    if not deadline or model is None or isinstance(getattr(model, "session", None), BatchingSession):
+        return
+    model.session = BatchingSession(model.session, deadline / 1000, name=name)
+    print(f"{NAME}: batching {name} requests within {deadline} ms")
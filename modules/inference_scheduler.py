@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+import modules.globals
+
+# Providers that run every model on one device, where concurrent runs only queue inside onnxruntime
+GPU_PROVIDERS = ("CUDAExecutionProvider", "TensorrtExecutionProvider", "DmlExecutionProvider", "CoreMLExecutionProvider", "ROCMExecutionProvider")
+
+_LOCAL = threading.local()
+
+
+@contextmanager
+def client_scope(client_id: Optional[str]) -> Iterator[None]:
+    """Binds the calling thread to a client, usually a live session; None leaves it unscheduled."""
+    previous = getattr(_LOCAL, "client", None)
+    _LOCAL.client = client_id
+    try:
+        yield
+    finally:
+        _LOCAL.client = previous
+
+
+def current_client() -> Optional[str]:
+    return getattr(_LOCAL, "client", None)
+
+
+def default_concurrency() -> int:
+    if any(provider in GPU_PROVIDERS for provider in modules.globals.execution_providers):
+        return 1
+    return max(1, (os.cpu_count() or 1) // 4)
+
+
+class InferenceScheduler:
+    """
+    Shares the process-wide face analyser and swapper between live sessions.
+    Calls from threads bound to a client wait for a slot in arrival order, so
+    a session with a busy camera cannot starve the others and the device
+    never runs more than max_concurrent models at once. Calls from unbound
+    threads (the UI preview, file processing) run immediately as before.
+    """
+
+    def __init__(self, max_concurrent: Optional[int] = None):
+        self.max_concurrent = max_concurrent
+        self.condition = threading.Condition()
+        self.waiting: deque = deque()
+        self.running = 0
+        self.stats: Dict[str, Dict[str, Any]] = {}
+
+    @contextmanager
+    def slot(self, kind: str) -> Iterator[None]:
+        client_id = current_client()
+        # With batching on, the inference broker already serializes model runs
+        if client_id is None or modules.globals.inference_batch_deadline:
+            yield
+            return
+        if self.max_concurrent is None:
+            self.max_concurrent = default_concurrency()
+
+        ticket = object()
+        queued = time.perf_counter()
+        with self.condition:
+            self.waiting.append(ticket)
+            while self.waiting[0] is not ticket or self.running >= self.max_concurrent:
+                self.condition.wait()
+            self.waiting.popleft()
+            self.running += 1
+            # The next ticket may fit into a free slot as well
+            self.condition.notify_all()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            finished = time.perf_counter()
+            with self.condition:
+                self.running -= 1
+                stats = self.stats.setdefault(client_id, {}).setdefault(kind, {"calls": 0, "wait": 0.0, "run": 0.0})
+                stats["calls"] += 1
+                stats["wait"] += started - queued
+                stats["run"] += finished - started
+                self.condition.notify_all()
+
+    def get_stats(self, client_id: str) -> Dict[str, Dict[str, float]]:
+        """Per kind: calls, and average queueing and run time in ms for one client."""
+        with self.condition:
+            stats = {kind: dict(values) for kind, values in self.stats.get(client_id, {}).items()}
+        return {
+            kind: {
+                "calls": values["calls"],
+                "wait_ms": values["wait"] * 1000 / values["calls"],
+                "run_ms": values["run"] * 1000 / values["calls"],
+            }
+            for kind, values in stats.items()
+        }
+
+    def forget(self, client_id: str) -> None:
+        with self.condition:
+            self.stats.pop(client_id, None)
+
+
+INFERENCE_SCHEDULER = InferenceScheduler()
@@ -0,0 +1,328 @@
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+import modules.globals
+from modules.face_analyser import get_many_faces
+from modules.face_tracker import FaceTracker, transform_face
+from modules.quality_controller import QualityController, quality_scope
+from modules.processors.frame import enhancement_policy
+from modules.typing import Face, Frame
+
+ENHANCER_NAME = "DLC.FACE-ENHANCER"
+# Weight of the newest sample in the per-stage timing averages
+EWMA_ALPHA = 0.1
+
+
+class LatestQueue:
+    """
+    Bounded hand-off between two stages. put() never blocks: when the queue
+    is full the oldest item is dropped, so a slow consumer always gets the
+    most recent work instead of a growing backlog.
+    """
+
+    def __init__(self, maxsize: int = 1):
+        self.items = deque(maxlen=max(1, maxsize))
+        self.condition = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item: Any) -> None:
+        with self.condition:
+            if len(self.items) == self.items.maxlen:
+                self.dropped += 1
+            self.items.append(item)
+            self.condition.notify()
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        """Oldest queued item, or None on timeout or once the queue is closed and empty."""
+        with self.condition:
+            if not self.items and not self.closed:
+                self.condition.wait(timeout)
+            if self.items:
+                return self.items.popleft()
+            return None
+
+    def close(self) -> None:
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    @property
+    def finished(self) -> bool:
+        """Closed and emptied, so nothing will come out of it any more."""
+        with self.condition:
+            return self.closed and not self.items
+
+
+class LiveFrame:
+    """A camera frame travelling through the pipeline with its timing."""
+
+    __slots__ = ("sequence", "captured_at", "frame", "faces", "display_size")
+
+    def __init__(self, sequence: int, captured_at: float, frame: Frame):
+        self.sequence = sequence
+        self.captured_at = captured_at
+        self.frame = frame
+        self.faces: Optional[List[Face]] = None
+        self.display_size = (frame.shape[1], frame.shape[0])
+
+
+class LivePipeline:
+    """
+    Live camera processing split into capture, analysis, swap and enhance
+    stages, each on its own thread and connected by LatestQueues, with the
+    display stage polled from the UI thread. Faces are detected on a copy
+    scaled down to live_analysis_size and swapped into the full frame, so the
+    cost of analysis does not grow with the camera or window resolution. While the swapper works on one
+    frame the detector already runs on the next, so throughput is bounded by
+    the slowest stage instead of the sum of all of them. Frames that waited
+    longer than latency_target seconds are dropped before detection, while at
+    least one frame per latency_target is still let through so a slow
+    machine keeps showing output.
+    """
+
+    def __init__(
+        self,
+        capturer: Any,
+        frame_processors: List[Any],
+        source_face: Optional[Face] = None,
+        prepare_frame: Optional[Callable[[Frame], Frame]] = None,
+        latency_target: float = 0.25,
+        async_detection: bool = False,
+        quality_controller: Optional[QualityController] = None,
+        session: Any = None,
+        restore_size: bool = True,
+    ):
+        self.capturer = capturer
+        self.frame_processors = frame_processors
+        self.source_face = source_face
+        self.prepare_frame = prepare_frame
+        self.latency_target = latency_target
+        # Stage threads bind themselves to the LiveSession this pipeline serves, if any
+        self.session = session
+        self.stream = session.session_id if session is not None else None
+        # With async detection the analysis stage only tracks; detection runs at its own rate
+        self.tracker = FaceTracker(scope=self._scope) if async_detection else None
+        self.quality_controller = quality_controller
+        # Off when the consumer resizes frames itself, so reduced-scale frames are resized only once
+        self.restore_size = restore_size
+        self.analysed_frames = 0
+        self.last_faces: Optional[List[Face]] = None
+        self.last_shape = None
+        self.analysis_queue = LatestQueue()
+        self.swap_queue = LatestQueue()
+        self.enhance_queue = LatestQueue()
+        self.display_queue = LatestQueue()
+        self.running = False
+        self.threads: List[threading.Thread] = []
+        self.stage_times: Dict[str, float] = {}
+        self.latency = 0.0
+        self.stale_frames = 0
+        self.last_admitted = 0.0
+        self.lock = threading.Lock()
+
+    def start(self) -> "LivePipeline":
+        self.running = True
+        if self.tracker is not None:
+            self.tracker.start()
+        stages = [
+            ("capture", self._capture_stage),
+            ("analysis", self._analysis_stage),
+            ("swap", self._swap_stage),
+            ("enhance", self._enhance_stage),
+        ]
+        self.threads = [threading.Thread(target=self._guard, args=(name, stage), name=f"live-{name}", daemon=True) for name, stage in stages]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.running = False
+        for queue in (self.analysis_queue, self.swap_queue, self.enhance_queue, self.display_queue):
+            queue.close()
+        for thread in self.threads:
+            thread.join(timeout=2)
+        self.threads = []
+        if self.tracker is not None:
+            self.tracker.stop()
+        if self.quality_controller is not None:
+            self.quality_controller.restore()
+
+    def get_frame(self, timeout: float = 0.01) -> Optional[LiveFrame]:
+        """Display stage: the newest finished frame, or None if nothing new is ready."""
+        live_frame = self.display_queue.get(timeout)
+        if live_frame is None and self.display_queue.finished:
+            # The input ended and every frame still in flight has been shown
+            self.running = False
+        if live_frame is not None:
+            self._record_latency(live_frame)
+            if self.quality_controller is not None:
+                with self.lock:
+                    stage_times = dict(self.stage_times)
+                self.quality_controller.observe(time.time() - live_frame.captured_at, stage_times)
+        return live_frame
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "stage_ms": {name: value * 1000 for name, value in self.stage_times.items()},
+                "latency_ms": self.latency * 1000,
+                "stale_frames": self.stale_frames,
+                "detections": self.tracker.detections if self.tracker is not None else None,
+                "quality_level": self.quality_controller.level if self.quality_controller is not None else None,
+                "dropped": {
+                    "capture": getattr(self.capturer, "dropped_frames", 0),
+                    "analysis": self.analysis_queue.dropped,
+                    "swap": self.swap_queue.dropped,
+                    "enhance": self.enhance_queue.dropped,
+                    "display": self.display_queue.dropped,
+                },
+            }
+
+    def _scope(self):
+        return self.session.scope() if self.session is not None else nullcontext()
+
+    def _source_face(self) -> Optional[Face]:
+        # A session's source face may be replaced while it runs
+        return self.session.source_face if self.session is not None else self.source_face
+
+    def _map_faces(self) -> bool:
+        return self.session.map_faces if self.session is not None else modules.globals.map_faces
+
+    def _guard(self, name: str, stage: Callable[[], None]) -> None:
+        # A failing frame must not silently kill its stage thread
+        with self._scope():
+            while self.running:
+                try:
+                    stage()
+                    break
+                except Exception as e:
+                    print(f"Live pipeline: {name} stage failed: {e}")
+
+    def _record_time(self, stage: str, started: float) -> None:
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            previous = self.stage_times.get(stage)
+            self.stage_times[stage] = elapsed if previous is None else previous + EWMA_ALPHA * (elapsed - previous)
+
+    def _record_latency(self, live_frame: LiveFrame) -> None:
+        with self.lock:
+            self.latency += EWMA_ALPHA * ((time.time() - live_frame.captured_at) - self.latency)
+
+    def _admit(self, live_frame: LiveFrame) -> bool:
+        now = time.time()
+        stale = self.latency_target and now - live_frame.captured_at > self.latency_target
+        if stale and now - self.last_admitted < self.latency_target:
+            with self.lock:
+                self.stale_frames += 1
+            return False
+        self.last_admitted = now
+        return True
+
+    def _stage_items(self, queue: LatestQueue, admit: bool = False):
+        while self.running:
+            live_frame = queue.get(0.1)
+            if live_frame is None and queue.finished:
+                return
+            if live_frame is None or (admit and not self._admit(live_frame)):
+                continue
+            yield live_frame
+
+    def _capture_stage(self) -> None:
+        while self.running:
+            ret, frame, captured_at, sequence = self.capturer.read_latest(wait_for_new=True, timeout=1.0)
+            if not ret:
+                if not self.capturer.is_running:
+                    # End of input: the later stages finish the frames in flight, then close in turn
+                    self.analysis_queue.close()
+                    return
+                continue
+            started = time.perf_counter()
+            frame = frame.copy()
+            if modules.globals.live_mirror:
+                frame = cv2.flip(frame, 1)
+            if self.prepare_frame is not None:
+                frame = self.prepare_frame(frame)
+            live_frame = LiveFrame(sequence, captured_at, frame)
+            scale = self.quality_controller.processing_scale if self.quality_controller is not None else 1.0
+            if scale < 1.0:
+                # Processed at reduced size; scaled back to display_size after enhancement only with restore_size
+                live_frame.frame = cv2.resize(frame, (int(frame.shape[1] * scale), int(frame.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+            self._record_time("capture", started)
+            self.analysis_queue.put(live_frame)
+
+    def _analysis_frame(self, frame: Frame) -> Tuple[Frame, float]:
+        """Copy of frame no larger than live_analysis_size on its longest side, with its scale."""
+        size = modules.globals.live_analysis_size
+        height, width = frame.shape[:2]
+        if not size or max(height, width) <= size:
+            return frame, 1.0
+        scale = size / max(height, width)
+        return cv2.resize(frame, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA), scale
+
+    def _analysis_stage(self) -> None:
+        for live_frame in self._stage_items(self.analysis_queue, admit=True):
+            started = time.perf_counter()
+            interval = self.quality_controller.detection_interval if self.quality_controller is not None else 1
+            det_size = self.quality_controller.detection_size if self.quality_controller is not None else None
+            if self.tracker is None and self.last_faces is not None and self.analysed_frames % interval != 0 and self.last_shape == live_frame.frame.shape:
+                # Between detections the previous faces are reused as they are
+                live_frame.faces = self.last_faces
+            else:
+                # Faces are found on a small copy and mapped back; the swap itself runs on the full frame
+                analysis_frame, scale = self._analysis_frame(live_frame.frame)
+                if self.tracker is not None:
+                    self.tracker.submit(analysis_frame, det_size)
+                    faces = self.tracker.track(analysis_frame)
+                else:
+                    faces = get_many_faces(analysis_frame, det_size) or []
+                if scale != 1.0:
+                    to_full = np.array([[1 / scale, 0, 0], [0, 1 / scale, 0]], dtype=np.float32)
+                    faces = [transform_face(face, to_full) for face in faces]
+                live_frame.faces = faces
+            self.analysed_frames += 1
+            self.last_faces, self.last_shape = live_frame.faces, live_frame.frame.shape
+            self._record_time("analysis", started)
+            self.swap_queue.put(live_frame)
+        self.swap_queue.close()
+
+    def _swap_stage(self) -> None:
+        for live_frame in self._stage_items(self.swap_queue):
+            started = time.perf_counter()
+            frame_scope = enhancement_policy.frame_scope(("live", self.stream, live_frame.sequence), sequential=True, stream=self.stream)
+            with frame_scope, quality_scope(self.quality_controller):
+                for frame_processor in self.frame_processors:
+                    if frame_processor.NAME == ENHANCER_NAME:
+                        continue
+                    if self._map_faces():
+                        live_frame.frame = frame_processor.process_frame_v2(live_frame.frame, detected_faces=live_frame.faces)
+                    else:
+                        live_frame.frame = frame_processor.process_frame(self._source_face(), live_frame.frame, detected_faces=live_frame.faces)
+            self._record_time("swap", started)
+            self.enhance_queue.put(live_frame)
+        self.enhance_queue.close()
+
+    def _enhance_stage(self) -> None:
+        for live_frame in self._stage_items(self.enhance_queue):
+            started = time.perf_counter()
+            enhancer_allowed = self.quality_controller is None or self.quality_controller.enhancer_allowed
+            if modules.globals.fp_ui.get("face_enhancer", False) and enhancer_allowed:
+                with enhancement_policy.frame_scope(("live", self.stream, live_frame.sequence), sequential=True, stream=self.stream):
+                    for frame_processor in self.frame_processors:
+                        if frame_processor.NAME != ENHANCER_NAME:
+                            continue
+                        if self._map_faces():
+                            live_frame.frame = frame_processor.process_frame_v2(live_frame.frame)
+                        else:
+                            live_frame.frame = frame_processor.process_frame(None, live_frame.frame)
+            if self.restore_size and (live_frame.frame.shape[1], live_frame.frame.shape[0]) != live_frame.display_size:
+                live_frame.frame = cv2.resize(live_frame.frame, live_frame.display_size, interpolation=cv2.INTER_LINEAR)
+            self._record_time("enhance", started)
+            self.display_queue.put(live_frame)
+        self.display_queue.close()
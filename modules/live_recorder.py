@@ -0,0 +1,80 @@
+import os
+import platform
+import time
+from typing import List, Optional
+
+from modules.ffmpeg_sink import FFmpegSink
+from modules.typing import Frame
+
+NAME = "DLC.RECORDER"
+# Frames held for the encoder; beyond this the oldest is dropped rather than stalling the preview
+QUEUE_SIZE = 16
+# Names handed out by get_record_path(), which may not exist on disk until the first frame is encoded
+ISSUED_PATHS = set()
+
+
+def get_audio_input(device: str) -> List[str]:
+    """ffmpeg input options that capture an audio device on this platform."""
+    system = platform.system()
+    if system == "Windows":
+        return ["-f", "dshow", "-i", f"audio={device}"]
+    if system == "Darwin":
+        return ["-f", "avfoundation", "-i", device if device.startswith(":") else f":{device}"]
+    return ["-f", "pulse", "-i", device]
+
+
+def get_record_path(directory: Optional[str] = None) -> str:
+    """A new timestamped recording name in directory (the working directory by default); numbered if already taken."""
+    base = os.path.join(directory or os.getcwd(), f"live-{time.strftime('%Y%m%d-%H%M%S')}")
+    path, count = base + ".mp4", 1
+    while os.path.exists(path) or path in ISSUED_PATHS:
+        count += 1
+        path = f"{base}-{count}.mp4"
+    ISSUED_PATHS.add(path)
+    return path
+
+
+class LiveRecorder:
+    """
+    Records processed live frames to a video file in the background. write()
+    only queues the frame and its capture timestamp; FFmpegSink encodes on
+    its own thread, drops the oldest queued frame when it falls behind and
+    places frames on the output timeline by capture time, so dropped frames
+    neither speed up the recording nor shift it against the audio track.
+    The encoder is started with the first frame, which fixes the size.
+    """
+
+    def __init__(self, path: str, fps: float = 30.0, audio_device: Optional[str] = None):
+        self.path = path
+        self.fps = fps
+        self.audio_device = audio_device
+        self.sink: Optional[FFmpegSink] = None
+        self.stopped = False
+
+    @property
+    def recording(self) -> bool:
+        return not self.stopped and (self.sink is None or self.sink.error is None)
+
+    def write(self, frame: Frame, captured_at: Optional[float] = None) -> bool:
+        if not self.recording:
+            return False
+        if self.sink is None:
+            height, width = frame.shape[:2]
+            self.sink = FFmpegSink(
+                self.path,
+                width,
+                height,
+                self.fps,
+                queue_size=QUEUE_SIZE,
+                audio_input=get_audio_input(self.audio_device) if self.audio_device else None,
+            ).start()
+            print(f"{NAME}: recording to {self.path}")
+        return self.sink.write(frame, time.time() if captured_at is None else captured_at)
+
+    def stop(self) -> None:
+        if self.stopped:
+            return
+        self.stopped = True
+        if self.sink is not None:
+            self.sink.close()
+            print(f"{NAME}: saved {self.path} ({self.sink.written} frames, {self.sink.dropped} dropped, {self.sink.duplicated} repeated)")
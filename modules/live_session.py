@@ -0,0 +1,190 @@
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
+
+import modules.globals
+from modules.ffmpeg_sink import FFmpegSink
+from modules.inference_scheduler import INFERENCE_SCHEDULER, client_scope
+from modules.live_pipeline import LiveFrame, LivePipeline
+from modules.live_recorder import LiveRecorder
+from modules.quality_controller import QualityController
+from modules.typing import Face, Frame
+from modules.video_capture import VideoCapturer
+
+NAME = "DLC.LIVE"
+
+_LOCAL = threading.local()
+SESSIONS: Dict[str, "LiveSession"] = {}
+SESSIONS_LOCK = threading.Lock()
+
+
+def current_session() -> Optional["LiveSession"]:
+    """The live session whose frame the calling thread is processing, if any."""
+    return getattr(_LOCAL, "session", None)
+
+
+def get_sessions() -> List["LiveSession"]:
+    with SESSIONS_LOCK:
+        return list(SESSIONS.values())
+
+
+def get_session(session_id: str) -> Optional["LiveSession"]:
+    with SESSIONS_LOCK:
+        return SESSIONS.get(session_id)
+
+
+def stop_all() -> None:
+    for session in get_sessions():
+        session.stop()
+
+
+class LiveSession:
+    """
+    One live stream: its input, source face, face mapping, temporal state and
+    output. Several sessions can run in one process at the same time. The
+    models stay process-wide singletons; every thread working for a session
+    is bound to it, so the swapper keeps interpolation state per session and
+    INFERENCE_SCHEDULER hands out model time fairly between sessions.
+    """
+
+    def __init__(
+        self,
+        source: Union[int, str, None] = None,
+        source_face: Optional[Face] = None,
+        simple_map: Optional[dict] = None,
+        output: Optional[str] = None,
+        capturer: Any = None,
+        loop: bool = False,
+        prepare_frame: Optional[Callable[[Frame], Frame]] = None,
+        session_id: Optional[str] = None,
+        record_path: Optional[str] = None,
+    ):
+        self.session_id = session_id or uuid.uuid4().hex[:8]
+        self.source = source
+        self.source_face = source_face
+        self.simple_map = simple_map
+        self.output = output
+        self.capturer = capturer
+        self.loop = loop
+        self.prepare_frame = prepare_frame
+        # Read and written by the face swapper while this session is bound
+        self.previous_frame_result: Optional[Frame] = None
+        self.pipeline: Optional[LivePipeline] = None
+        self.sink: Optional[FFmpegSink] = None
+        self.record_path = record_path
+        self.recorder: Optional[LiveRecorder] = None
+        self.output_thread = None
+        self.running = False
+        self.started_at = 0.0
+        self.frames = 0
+
+    @property
+    def map_faces(self) -> bool:
+        return self.simple_map is not None
+
+    @contextmanager
+    def scope(self) -> Iterator[None]:
+        """Binds the calling thread to this session for the swapper and the inference scheduler."""
+        previous = getattr(_LOCAL, "session", None)
+        _LOCAL.session = self
+        try:
+            with client_scope(self.session_id):
+                yield
+        finally:
+            _LOCAL.session = previous
+
+    def start(self, frame_processors: List[Any]) -> bool:
+        if self.capturer is None:
+            self.capturer = VideoCapturer(self.source, loop=self.loop)
+            if not self.capturer.start():
+                print(f"{NAME}: session {self.session_id} failed to open {self.source}")
+                return False
+        self.pipeline = LivePipeline(
+            self.capturer,
+            frame_processors,
+            source_face=self.source_face,
+            prepare_frame=self.prepare_frame,
+            latency_target=modules.globals.live_latency_target / 1000,
+            async_detection=modules.globals.live_async_detection,
+            quality_controller=QualityController(modules.globals.live_target_fps, modules.globals.live_latency_target / 1000) if modules.globals.live_quality_control else None,
+            session=self,
+        ).start()
+        if self.record_path:
+            self.recorder = LiveRecorder(self.record_path, self.capturer.get_fps(), modules.globals.live_record_audio)
+        self.running = True
+        self.started_at = time.time()
+        with SESSIONS_LOCK:
+            SESSIONS[self.session_id] = self
+        if self.output:
+            self.output_thread = threading.Thread(target=self._output_loop, name=f"live-output-{self.session_id}", daemon=True)
+            self.output_thread.start()
+        return True
+
+    def stop(self) -> None:
+        self.running = False
+        if self.output_thread is not None:
+            self.output_thread.join(timeout=2)
+            self.output_thread = None
+        if self.pipeline is not None:
+            self.pipeline.stop()
+        if self.capturer is not None:
+            self.capturer.release()
+        while self.sink is not None:
+            # Frames that were finished before the stop still belong in the output
+            live_frame = self.get_frame(timeout=0)
+            if live_frame is None:
+                break
+            self.sink.write(live_frame.frame)
+        if self.sink is not None:
+            self.sink.close()
+            self.sink = None
+        if self.recorder is not None:
+            self.recorder.stop()
+            self.recorder = None
+        with SESSIONS_LOCK:
+            SESSIONS.pop(self.session_id, None)
+        INFERENCE_SCHEDULER.forget(self.session_id)
+
+    def is_alive(self) -> bool:
+        return self.running and self.pipeline is not None and self.pipeline.running
+
+    def get_frame(self, timeout: float = 0.01) -> Optional[LiveFrame]:
+        """Newest processed frame for sessions without an output; sessions with one encode it themselves."""
+        live_frame = self.pipeline.get_frame(timeout) if self.pipeline is not None else None
+        if live_frame is not None:
+            self.frames += 1
+            if self.recorder is not None:
+                self.recorder.write(live_frame.frame, live_frame.captured_at)
+        return live_frame
+
+    def get_stats(self) -> dict:
+        elapsed = time.time() - self.started_at if self.started_at else 0.0
+        return {
+            "session_id": self.session_id,
+            "source": str(self.source),
+            "output": self.output,
+            "frames": self.frames,
+            "fps": self.frames / elapsed if elapsed > 0 else 0.0,
+            "pipeline": self.pipeline.get_stats() if self.pipeline is not None else None,
+            "inference": INFERENCE_SCHEDULER.get_stats(self.session_id),
+            "encoder_dropped": self.sink.dropped if self.sink is not None else 0,
+        }
+
+    def _output_loop(self) -> None:
+        while self.running:
+            live_frame = self.get_frame(timeout=0.1)
+            if live_frame is None:
+                if not self.pipeline.running:
+                    break
+                continue
+            if self.sink is None:
+                # Encoder geometry comes from the first processed frame
+                height, width = live_frame.frame.shape[:2]
+                self.sink = FFmpegSink(self.output, width, height, self.capturer.get_fps()).start()
+            self.sink.write(live_frame.frame)
+            if self.sink.error is not None:
+                print(f"{NAME}: session {self.session_id} output stopped: {self.sink.error}")
+                break
+        self.running = False
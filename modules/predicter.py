@@ -1,36 +1,161 @@
+import os
+import threading
+from typing import Any, Iterable, Iterator, List
+
+import cv2
 import numpy
-import opennsfw2
-from PIL import Image
-import cv2  # Add OpenCV import
-import modules.globals  # Import globals to access the color correction toggle
+import modules.globals
 
+from modules import probe_cache
 from modules.typing import Frame
+from modules.utilities import resolve_relative_path
 
 MAX_PROBABILITY = 0.85
+FRAME_INTERVAL = 100
+BATCH_SIZE = 8
+MODEL_PATH = resolve_relative_path("../models/open_nsfw.onnx")
+# Yahoo open_nsfw preprocessing: 256px resize, 224px centre crop, BGR mean subtraction
+RESIZE_SIZE = 256
+INPUT_SIZE = 224
+VGG_MEAN = numpy.array([104.0, 117.0, 123.0], dtype=numpy.float32)
 
-# Preload the model once for efficiency
+# Loaded on first use so startup never pays for onnxruntime/TensorFlow NSFW setup
 model = None
+MODEL_LOCK = threading.Lock()
 
-def predict_frame(target_frame: Frame) -> bool:
-    # Convert the frame to RGB before processing if color correction is enabled
-    if modules.globals.color_correction:
-        target_frame = cv2.cvtColor(target_frame, cv2.COLOR_BGR2RGB)
-        
-    image = Image.fromarray(target_frame)
-    image = opennsfw2.preprocess_image(image, opennsfw2.Preprocessing.YAHOO)
+
+def get_model() -> Any:
+    """
+    Returns a callable mapping a (N, 224, 224, 3) batch to NSFW probabilities.
+    Prefers the ONNX export of open_nsfw; without it, falls back to opennsfw2
+    (TensorFlow) and exports the ONNX model for next time when tf2onnx is
+    installed.
+    """
     global model
-    if model is None: 
-        model = opennsfw2.make_open_nsfw_model()
-        
-    views = numpy.expand_dims(image, axis=0)
-    _, probability = model.predict(views)[0]
-    return probability > MAX_PROBABILITY
+
+    with MODEL_LOCK:
+        if model is None:
+            if os.path.isfile(MODEL_PATH):
+                model = load_onnx_model(MODEL_PATH)
+            else:
+                model = load_tensorflow_model()
+    return model
+
+
+def load_onnx_model(model_path: str) -> Any:
+    import onnxruntime
+
+    session = onnxruntime.InferenceSession(model_path, providers=modules.globals.execution_providers)
+    input_name = session.get_inputs()[0].name
+
+    def run(views: numpy.ndarray) -> numpy.ndarray:
+        return session.run(None, {input_name: views})[0][:, 1]
+
+    return run
+
+
+def load_tensorflow_model() -> Any:
+    import opennsfw2
+    import tensorflow
+
+    # prevent tensorflow memory leak
+    for gpu in tensorflow.config.experimental.list_physical_devices('GPU'):
+        tensorflow.config.experimental.set_memory_growth(gpu, True)
+    keras_model = opennsfw2.make_open_nsfw_model()
+    export_onnx_model(keras_model)
+
+    def run(views: numpy.ndarray) -> numpy.ndarray:
+        return keras_model.predict(views, verbose=0)[:, 1]
+
+    return run
+
+
+def export_onnx_model(keras_model: Any) -> bool:
+    try:
+        import tf2onnx
+    except ImportError:
+        return False
+    try:
+        tf2onnx.convert.from_keras(keras_model, output_path=MODEL_PATH)
+        return True
+    except Exception as e:
+        print(f"Could not export NSFW model to ONNX: {e}")
+        return False
+
+
+def preprocess_frame(target_frame: Frame) -> numpy.ndarray:
+    # Frames are BGR already, which is the channel order open_nsfw was trained on
+    image = cv2.resize(target_frame, (RESIZE_SIZE, RESIZE_SIZE), interpolation=cv2.INTER_LINEAR)
+    # The reference preprocessing round-trips through JPEG; keep it so scores match
+    _, encoded = cv2.imencode(".jpg", image)
+    image = cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+    offset = (RESIZE_SIZE - INPUT_SIZE) // 2
+    image = image[offset:offset + INPUT_SIZE, offset:offset + INPUT_SIZE].astype(numpy.float32)
+    return image - VGG_MEAN
+
+
+def score_frames(target_frames: List[Frame]) -> numpy.ndarray:
+    views = numpy.stack([preprocess_frame(target_frame) for target_frame in target_frames])
+    return numpy.asarray(get_model()(views), dtype=numpy.float32)
+
+
+def predict_frames(target_frames: Iterable[Frame], batch_size: int = BATCH_SIZE) -> bool:
+    """Scores frames in batches and stops at the first batch with a frame over the threshold."""
+    batch = []
+    for target_frame in target_frames:
+        if target_frame is None:
+            continue
+        batch.append(target_frame)
+        if len(batch) == batch_size:
+            if numpy.any(score_frames(batch) > MAX_PROBABILITY):
+                return True
+            batch = []
+    return bool(batch) and bool(numpy.any(score_frames(batch) > MAX_PROBABILITY))
+
+
+def predict_frame(target_frame: Frame) -> bool:
+    return bool(score_frames([target_frame])[0] > MAX_PROBABILITY)
+
+
+def get_settings_key() -> str:
+    # Cached verdicts are only valid for the model and thresholds that produced them
+    backend = "onnx" if os.path.isfile(MODEL_PATH) else "opennsfw2"
+    return f"{backend}:{MAX_PROBABILITY}:{FRAME_INTERVAL}"
 
 
 def predict_image(target_path: str) -> bool:
-    return opennsfw2.predict_image(target_path) > MAX_PROBABILITY
+    settings_key = get_settings_key()
+    verdict = probe_cache.get_nsfw(target_path, settings_key)
+    if verdict is not None:
+        return verdict
+    target_frame = cv2.imread(target_path)
+    if target_frame is None:
+        return False
+    verdict = predict_frame(target_frame)
+    probe_cache.set_nsfw(target_path, settings_key, verdict)
+    return verdict
+
+
+def sample_video_frames(target_path: str, frame_interval: int = FRAME_INTERVAL) -> Iterator[Frame]:
+    """Seeks straight to every frame_interval-th frame instead of decoding the whole video."""
+    capture = cv2.VideoCapture(target_path)
+    try:
+        frame_total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        for frame_number in range(0, max(frame_total, 1), frame_interval):
+            if frame_number:
+                capture.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+            has_frame, frame = capture.read()
+            if not has_frame:
+                break
+            yield frame
+    finally:
+        capture.release()
 
 
 def predict_video(target_path: str) -> bool:
-    _, probabilities = opennsfw2.predict_video_frames(video_path=target_path, frame_interval=100)
-    return any(probability > MAX_PROBABILITY for probability in probabilities)
+    settings_key = get_settings_key()
+    verdict = probe_cache.get_nsfw(target_path, settings_key)
+    if verdict is None:
+        verdict = predict_frames(sample_video_frames(target_path))
+        probe_cache.set_nsfw(target_path, settings_key, verdict)
+    return verdict
@@ -0,0 +1,257 @@
+import json
+import math
+import os
+import subprocess
+import tempfile
+import threading
+from typing import Any, List, Optional
+
+import cv2
+import numpy as np
+
+import modules.globals
+from modules import probe_cache
+from modules.capturer import PREVIEW_FRAME_SERVICE, get_video_frame_total
+from modules.typing import Frame
+from modules.utilities import detect_fps, get_keyframe_times, get_video_dimensions, probe_video
+
+PROXY_DIRECTORY = os.path.join(tempfile.gettempdir(), "deep-live-cam", "proxies")
+# Share of preview_proxy_cache_size a single proxy may use before its stride is raised
+MAX_PROXY_SHARE = 0.5
+
+PROXY = None
+THREAD_LOCK = threading.Lock()
+
+
+class PreviewProxy:
+    """
+    Downscaled copy of a target video for scrubbing. Every stride-th frame is
+    decoded once by ffmpeg at proxy height into a memory-mapped array, on a
+    background thread, so frames are available as soon as they are written.
+    Proxies are named by content hash and reused across runs once complete.
+    The proxy directory is capped at preview_proxy_cache_size: the least
+    recently used proxies are deleted to make room, a video too long for its
+    share gets a larger stride, and unfinished proxies are not kept.
+    """
+
+    def __init__(self, target_path: str, height: int = 480, stride: int = 5):
+        self.target_path = target_path
+        self.stride = max(1, stride)
+        source_width, source_height = get_video_dimensions(target_path)
+        self.height = min(height, source_height) // 2 * 2
+        self.width = max(2, round(source_width * self.height / source_height / 2) * 2)
+        self.frame_total = get_video_frame_total(target_path)
+        if self.frame_total <= 0:
+            self.frame_total = int(probe_video(target_path).get("duration", 0) * detect_fps(target_path))
+        self.slots = max(1, math.ceil(self.frame_total / self.stride))
+        budget = modules.globals.preview_proxy_cache_size * MAX_PROXY_SHARE * (1 << 20)
+        if self.size > budget:
+            if self.frame_size > budget:
+                raise ValueError("a single proxy frame exceeds the proxy cache size")
+            self.stride = math.ceil(self.frame_total / (budget // self.frame_size))
+            self.slots = max(1, math.ceil(self.frame_total / self.stride))
+            print(f"Preview proxy: keeping one frame in {self.stride} to stay within {budget / (1 << 20):.0f} MB")
+        self.ready = 0
+        self.saved = False
+        self.keyframes: List[int] = []
+        self.error = None
+        self.frames = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+        digest = probe_cache.content_hash(target_path) or "unknown"
+        name = f"{digest}-{self.height}p-{self.stride}"
+        self.frames_path = os.path.join(PROXY_DIRECTORY, name + ".npy")
+        self.info_path = os.path.join(PROXY_DIRECTORY, name + ".json")
+
+    @property
+    def complete(self) -> bool:
+        return self.ready >= self.slots
+
+    @property
+    def frame_size(self) -> int:
+        return self.width * self.height * 3
+
+    @property
+    def size(self) -> int:
+        return self.slots * self.frame_size
+
+    def start(self) -> "PreviewProxy":
+        os.makedirs(PROXY_DIRECTORY, exist_ok=True)
+        if self._load_existing():
+            return self
+        evict_proxies(self.size, keep=self.frames_path)
+        self.frames = np.lib.format.open_memmap(self.frames_path, mode="w+", dtype=np.uint8, shape=(self.slots, self.height, self.width, 3))
+        self.thread = threading.Thread(target=self._build, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+        if not self.saved:
+            self._discard()
+
+    def get_frame(self, frame_index: int) -> Optional[Frame]:
+        """Nearest proxy frame at or before frame_index, or None if it is not decoded yet."""
+        slot = min(max(0, frame_index) // self.stride, self.slots - 1)
+        if slot >= self.ready:
+            return None
+        return np.array(self.frames[slot])
+
+    def get_face_crop(self, frame_index: int, bbox: Any) -> Optional[Frame]:
+        """Crop for a bbox given in source pixels; only exact proxy frames qualify."""
+        if frame_index % self.stride != 0 or frame_index // self.stride >= self.ready:
+            return None
+        scale = self.height / get_video_dimensions(self.target_path)[1]
+        x_min, y_min, x_max, y_max = (np.asarray(bbox, dtype=np.float32) * scale).astype(int)
+        frame = self.frames[frame_index // self.stride]
+        crop = np.array(frame[max(0, y_min):y_max, max(0, x_min):x_max])
+        return crop if crop.size > 0 else None
+
+    def _load_existing(self) -> bool:
+        try:
+            with open(self.info_path) as file:
+                info = json.load(file)
+            if info.get("expected_slots") != self.slots or not os.path.isfile(self.frames_path):
+                return False
+            self.frames = np.load(self.frames_path, mmap_mode="r")
+            self.keyframes = info.get("keyframes", [])
+            self.slots = self.ready = info["slots"]
+            self.saved = True
+            PREVIEW_FRAME_SERVICE.set_keyframes(self.target_path, self.keyframes)
+            # Marks the proxy as recently used for eviction
+            os.utime(self.frames_path)
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def _build(self) -> None:
+        try:
+            fps = detect_fps(self.target_path)
+            self.keyframes = sorted({int(round(time * fps)) for time in get_keyframe_times(self.target_path)})
+            PREVIEW_FRAME_SERVICE.set_keyframes(self.target_path, self.keyframes)
+        except Exception as e:
+            print(f"Preview proxy: could not read keyframes: {e}")
+
+        commands = [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            modules.globals.log_level,
+            "-i",
+            self.target_path,
+            "-vf",
+            f"select=not(mod(n\\,{self.stride})),scale={self.width}:{self.height}",
+            "-vsync",
+            "0",
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "bgr24",
+            "pipe:1",
+        ]
+        frame_size = self.frame_size
+        process = subprocess.Popen(commands, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        try:
+            while self.ready < self.slots and not self.stopped.is_set():
+                view = memoryview(self.frames[self.ready].reshape(-1))
+                received = 0
+                while received < frame_size:
+                    count = process.stdout.readinto(view[received:])
+                    if not count:
+                        break
+                    received += count
+                if received < frame_size:
+                    break
+                self.ready += 1
+        except Exception as e:
+            self.error = e
+            print(f"Preview proxy: build failed: {e}")
+        finally:
+            process.stdout.close()
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+
+        if self.stopped.is_set():
+            return
+        if self.error is not None or self.ready == 0:
+            self._discard()
+            return
+        # Containers that over-report the frame count end early; the proxy is still complete
+        expected_slots = self.slots
+        self.slots = self.ready
+        self.frames.flush()
+        with open(self.info_path, "w") as file:
+            json.dump({"expected_slots": expected_slots, "slots": self.slots, "keyframes": self.keyframes}, file)
+        self.saved = True
+
+    def _discard(self) -> None:
+        """Deletes an unfinished proxy; frames already mapped stay readable until the proxy is dropped."""
+        for path in (self.info_path, self.frames_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def evict_proxies(needed: int, keep: Optional[str] = None) -> None:
+    """Deletes the least recently used proxies until needed more bytes fit in preview_proxy_cache_size."""
+    budget = modules.globals.preview_proxy_cache_size * (1 << 20)
+    proxies = []
+    for name in os.listdir(PROXY_DIRECTORY):
+        path = os.path.join(PROXY_DIRECTORY, name)
+        if not name.endswith(".npy") or path == keep:
+            continue
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        proxies.append((stat.st_mtime, stat.st_size, path))
+    used = sum(size for _, size, _ in proxies)
+    for _, size, path in sorted(proxies):
+        if used + needed <= budget:
+            break
+        for stale_path in (path, path[:-len(".npy")] + ".json"):
+            try:
+                os.remove(stale_path)
+            except OSError:
+                pass
+        used -= size
+
+
+def start_proxy(target_path: str) -> Optional[PreviewProxy]:
+    """Starts (or reuses) the proxy for target_path and stops any proxy built for another target."""
+    global PROXY
+
+    with THREAD_LOCK:
+        if PROXY is not None and PROXY.target_path == target_path:
+            return PROXY
+        if PROXY is not None:
+            PROXY.stop()
+        try:
+            PROXY = PreviewProxy(target_path, modules.globals.preview_proxy_height, modules.globals.preview_proxy_stride).start()
+        except Exception as e:
+            print(f"Preview proxy: disabled for this target: {e}")
+            PROXY = None
+        return PROXY
+
+
+def get_proxy(target_path: str) -> Optional[PreviewProxy]:
+    proxy = PROXY
+    if proxy is None or proxy.target_path != target_path:
+        return None
+    return proxy
+
+
+def get_proxy_frame(target_path: str, frame_number: int = 0) -> Optional[Frame]:
+    """Proxy counterpart of capturer.get_video_frame (same 1-based frame_number and colour handling)."""
+    proxy = get_proxy(target_path)
+    if proxy is None:
+        return None
+    frame = proxy.get_frame(int(frame_number) - 1)
+    if frame is not None and modules.globals.color_correction:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    return frame
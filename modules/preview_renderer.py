@@ -0,0 +1,151 @@
+import os
+import threading
+from typing import Any, Callable, Optional
+
+import cv2
+
+import modules.globals
+from modules.capturer import get_video_frame
+from modules.face_analyser import get_one_face
+from modules.preview_proxy import get_proxy_frame
+from modules.processors.frame import enhancement_policy
+from modules.processors.frame.core import get_frame_processors_modules
+from modules.typing import Face, Frame
+
+# Longest side of the quick pass rendered before the full-resolution one
+QUICK_PASS_SIZE = 640
+
+
+class PreviewCancelled(Exception):
+    pass
+
+
+class PreviewRenderer:
+    """
+    Renders preview frames on a background thread. Only the most recent
+    request is kept: submitting bumps a generation counter, and a render
+    whose generation is no longer current stops at the next processor
+    boundary. Each request is rendered as a quick downscaled pass first and
+    then at full size. Results are picked up by the UI thread with poll().
+    """
+
+    def __init__(self):
+        self.generation = 0
+        self.request = None
+        self.result = None
+        self.condition = threading.Condition()
+        self.source_cache = (None, None)  # (source path, mtime) -> source face
+        self.thread = None
+
+    def submit(self, frame_number: float = 0, full_resolution: bool = False) -> int:
+        # Processor modules are resolved here, on the UI thread that owns their toggles
+        frame_processors = list(get_frame_processors_modules(modules.globals.frame_processors))
+        with self.condition:
+            self.generation += 1
+            self.request = (self.generation, frame_number, full_resolution, frame_processors)
+            self.condition.notify()
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        return self.generation
+
+    def cancel(self) -> None:
+        with self.condition:
+            self.generation += 1
+            self.request = None
+            self.result = None
+
+    def poll(self) -> Optional[dict]:
+        """Returns the newest finished pass once, or None when nothing new is ready."""
+        with self.condition:
+            result, self.result = self.result, None
+        if result is not None and result["generation"] != self.generation:
+            return None
+        return result
+
+    def get_source_face(self) -> Optional[Face]:
+        source_path = modules.globals.source_path
+        try:
+            key = (source_path, os.path.getmtime(source_path))
+        except (OSError, TypeError):
+            return None
+        if self.source_cache[0] != key:
+            self.source_cache = (key, get_one_face(cv2.imread(source_path)))
+        return self.source_cache[1]
+
+    def _check(self, generation: int) -> None:
+        if generation != self.generation:
+            raise PreviewCancelled()
+
+    def _publish(self, generation: int, **result: Any) -> None:
+        with self.condition:
+            if generation == self.generation:
+                self.result = dict(generation=generation, **result)
+
+    def _run(self) -> None:
+        while True:
+            with self.condition:
+                while self.request is None:
+                    self.condition.wait()
+                generation, frame_number, full_resolution, frame_processors = self.request
+                self.request = None
+            try:
+                self._render(generation, frame_number, full_resolution, frame_processors)
+            except PreviewCancelled:
+                continue
+            except Exception as e:
+                print(f"Preview render failed: {e}")
+                self._publish(generation, frame=None, final=True, error=str(e))
+
+    def _render(self, generation: int, frame_number: float, full_resolution: bool, frame_processors: list) -> None:
+        temp_frame = None
+        if modules.globals.preview_proxy and not full_resolution:
+            # Scrubbing is served from the proxy; full resolution is decoded on request
+            temp_frame = get_proxy_frame(modules.globals.target_path, frame_number)
+        if temp_frame is None:
+            temp_frame = get_video_frame(modules.globals.target_path, frame_number)
+        self._check(generation)
+        if temp_frame is None:
+            self._publish(generation, frame=None, final=True, error="Could not read the target frame")
+            return
+        if modules.globals.nsfw_filter:
+            from modules.predicter import predict_frame
+
+            if predict_frame(temp_frame):
+                self._publish(generation, frame=None, final=True, nsfw=True)
+                return
+        source_face = self.get_source_face()
+        self._check(generation)
+
+        height, width = temp_frame.shape[:2]
+        scale = QUICK_PASS_SIZE / max(height, width)
+        if scale < 0.75:
+            quick_frame = cv2.resize(temp_frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+            self._publish(generation, frame=self._process(generation, frame_processors, source_face, quick_frame, "quick"), final=False)
+        self._publish(generation, frame=self._process(generation, frame_processors, source_face, temp_frame, "full"), final=True)
+
+    def _process(self, generation: int, frame_processors: list, source_face: Optional[Face], temp_frame: Frame, pass_name: str) -> Frame:
+        # Scrubbed frames are not consecutive, so enhancement patch reuse stays off
+        with enhancement_policy.frame_scope(("preview", generation, pass_name)):
+            try:
+                for frame_processor in frame_processors:
+                    self._check(generation)
+                    temp_frame = frame_processor.process_frame(source_face, temp_frame)
+            finally:
+                enhancement_policy.take_swapped_faces()
+        self._check(generation)
+        return temp_frame
+
+
+PREVIEW_RENDERER = PreviewRenderer()
+
+
+def schedule_poll(root: Any, on_result: Callable[[dict], None], interval: int = 30) -> None:
+    """Polls the renderer from the Tk main loop; results are handed to on_result on that thread."""
+    def poll() -> None:
+        result = PREVIEW_RENDERER.poll()
+        if result is not None:
+            on_result(result)
+        root.after(interval, poll)
+
+    root.after(interval, poll)
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional
+
+CACHE_PATH = os.path.join(tempfile.gettempdir(), "deep-live-cam", "probe_cache.sqlite3")
+SAMPLE_SIZE = 1 << 20  # bytes hashed from the start, middle and end of a file
+FIELDS = {
+    "fps": "REAL",
+    "frame_total": "INTEGER",
+    "width": "INTEGER",
+    "height": "INTEGER",
+    "duration": "REAL",
+    "keyframes": "TEXT",  # JSON list of keyframe timestamps in seconds
+    "nsfw": "TEXT",  # JSON object: predicter settings key -> verdict
+}
+JSON_FIELDS = {"keyframes", "nsfw"}
+
+CONNECTION = None
+THREAD_LOCK = threading.Lock()
+# (path, size, mtime_ns) -> content hash, so a file is only hashed once per run
+CONTENT_HASHES: Dict[tuple, str] = {}
+FULL_HASHES: Dict[tuple, str] = {}
+
+
+def get_connection() -> Optional[sqlite3.Connection]:
+    global CONNECTION
+
+    if CONNECTION is None:
+        try:
+            os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+            CONNECTION = sqlite3.connect(CACHE_PATH, timeout=5, check_same_thread=False)
+            columns = ", ".join(f"{name} {kind}" for name, kind in FIELDS.items())
+            CONNECTION.execute(f"CREATE TABLE IF NOT EXISTS probes (hash TEXT PRIMARY KEY, {columns}, updated REAL)")
+            CONNECTION.commit()
+        except sqlite3.Error as e:
+            print(f"Probe cache disabled: {e}")
+            CONNECTION = False
+    return CONNECTION or None
+
+
+def content_hash(path: str) -> Optional[str]:
+    """
+    Identifies a file by content rather than by name: blake2b over its size
+    and 1 MB samples from the start, middle and end. Cheap even for large
+    videos, and a renamed or copied asset still hits the cache. Edits that
+    keep the size and miss the samples go unnoticed, so it only keys probe
+    metadata; see full_hash().
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    digest = CONTENT_HASHES.get(key)
+    if digest is not None:
+        return digest
+
+    hasher = hashlib.blake2b(digest_size=20)
+    hasher.update(str(stat.st_size).encode())
+    with open(path, "rb") as file:
+        for offset in sorted({0, max(0, stat.st_size // 2 - SAMPLE_SIZE // 2), max(0, stat.st_size - SAMPLE_SIZE)}):
+            file.seek(offset)
+            hasher.update(file.read(SAMPLE_SIZE))
+    digest = hasher.hexdigest()
+    CONTENT_HASHES[key] = digest
+    return digest
+
+
+def full_hash(path: str) -> Optional[str]:
+    """
+    blake2b over the whole file. Slower than content_hash() but exact, so it
+    keys anything an edit must invalidate: NSFW verdicts and face identities.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    digest = FULL_HASHES.get(key)
+    if digest is not None:
+        return digest
+
+    hasher = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(SAMPLE_SIZE), b""):
+            hasher.update(chunk)
+    digest = hasher.hexdigest()
+    FULL_HASHES[key] = digest
+    return digest
+
+
+def get_entry(path: str) -> Dict[str, Any]:
+    """Returns every cached field for the file's content; missing fields are absent."""
+    digest = content_hash(path)
+    if digest is None:
+        return {}
+    with THREAD_LOCK:
+        connection = get_connection()
+        if connection is None:
+            return {}
+        try:
+            row = connection.execute(f"SELECT {', '.join(FIELDS)} FROM probes WHERE hash = ?", (digest,)).fetchone()
+        except sqlite3.Error:
+            return {}
+    if row is None:
+        return {}
+    entry = {}
+    for name, value in zip(FIELDS, row):
+        if value is not None:
+            entry[name] = json.loads(value) if name in JSON_FIELDS else value
+    return entry
+
+
+def get_value(path: str, name: str, default: Any = None) -> Any:
+    return get_entry(path).get(name, default)
+
+
+def set_values(path: str, **values: Any) -> None:
+    """Stores the given fields for the file's content, leaving other fields untouched."""
+    unknown = set(values) - set(FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown probe cache fields: {', '.join(sorted(unknown))}")
+    values = {name: value for name, value in values.items() if value is not None}
+    digest = content_hash(path)
+    if digest is None or not values:
+        return
+    names = list(values)
+    parameters = [json.dumps(values[name]) if name in JSON_FIELDS else values[name] for name in names]
+    with THREAD_LOCK:
+        connection = get_connection()
+        if connection is None:
+            return
+        try:
+            connection.execute("INSERT OR IGNORE INTO probes (hash) VALUES (?)", (digest,))
+            assignments = ", ".join(f"{name} = ?" for name in names)
+            connection.execute(f"UPDATE probes SET {assignments}, updated = ? WHERE hash = ?", parameters + [time.time(), digest])
+            connection.commit()
+        except sqlite3.Error as e:
+            print(f"Probe cache write failed: {e}")
+
+
+def get_nsfw_key(path: str, settings_key: str) -> Optional[str]:
+    # Keyed by model and threshold so changing either re-scores, and by the
+    # full file hash so an edit the sampled row hash misses is never trusted
+    digest = full_hash(path)
+    return None if digest is None else f"{settings_key}:{digest}"
+
+
+def get_nsfw(path: str, settings_key: str) -> Optional[bool]:
+    nsfw_key = get_nsfw_key(path, settings_key)
+    verdict = get_value(path, "nsfw", {}).get(nsfw_key) if nsfw_key else None
+    return None if verdict is None else bool(verdict)
+
+
+def set_nsfw(path: str, settings_key: str, verdict: bool) -> None:
+    nsfw_key = get_nsfw_key(path, settings_key)
+    if nsfw_key is None:
+        return
+    # Only this content's verdicts are kept; older keys belong to other edits of the file
+    verdicts = {key: value for key, value in get_value(path, "nsfw", {}).items() if key.endswith(nsfw_key.rsplit(":", 1)[1])}
+    verdicts[nsfw_key] = bool(verdict)
+    set_values(path, nsfw=verdicts)
@@ -1,5 +1,6 @@
 import sys
 import importlib
+import threading
 from concurrent.futures import ThreadPoolExecutor
 from types import ModuleType
 from typing import Any, List, Callable
@@ -9,6 +10,8 @@ import modules
 import modules.globals                   
 
 FRAME_PROCESSORS_MODULES: List[ModuleType] = []
+# Called as (frames done, frames total, frame processor name) while a video is processed
+PROGRESS_CALLBACK: Callable[[int, int, str], None] | None = None
 FRAME_PROCESSORS_INTERFACE = [
     'pre_check',
     'pre_start',
@@ -66,11 +69,31 @@ def set_frame_processors_modules_from_ui(frame_processors: List[str]) -> None:
             except Exception as e:
                  print(f"Warning: Error removing frame processor {frame_processor}: {e}")
 
+def set_progress_callback(callback: Callable[[int, int, str], None] | None) -> None:
+    global PROGRESS_CALLBACK
+
+    PROGRESS_CALLBACK = callback
+
+
 def multi_process_frame(source_path: str, temp_frame_paths: List[str], process_frames: Callable[[str, List[str], Any], None], progress: Any = None) -> None:
+    callback = PROGRESS_CALLBACK
+    processor_name = process_frames.__module__.split('.')[-1]
+    total = len(temp_frame_paths)
+    done = [0]
+    lock = threading.Lock()
+
+    def report(_future: Any) -> None:
+        with lock:
+            done[0] += 1
+            count = done[0]
+        callback(count, total, processor_name)
+
     with ThreadPoolExecutor(max_workers=modules.globals.execution_threads) as executor:
         futures = []
         for path in temp_frame_paths:
             future = executor.submit(process_frames, source_path, [path], progress)
+            if callback is not None:
+                future.add_done_callback(report)
             futures.append(future)
         for future in futures:
             future.result()
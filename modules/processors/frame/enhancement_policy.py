@@ -0,0 +1,240 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import threading
+
+import cv2
+import numpy as np
+
+import modules.globals
+
+# Frames processed without an explicit scope (live camera, preview) share this key
+LIVE_KEY = "live"
+# Live/preview records that were never consumed (enhancer toggled off mid-stream)
+MAX_SEQUENTIAL_RECORDS = 64
+# Context added around a face bbox so GFPGAN's own detector still finds the face
+PATCH_MARGIN = 0.5
+# Minimum IoU for a face to continue an existing enhancement track
+TRACK_IOU = 0.5
+
+_LOCAL = threading.local()
+_LOCK = threading.Lock()
+_SWAPPED_FACES: "OrderedDict[Any, List[Tuple[np.ndarray, Optional[np.ndarray]]]]" = OrderedDict()
+_TRACKS: List[Dict[str, Any]] = []
+_FEATHER_MASKS: Dict[Tuple[int, int], np.ndarray] = {}
+_STATS: Dict[str, int] = {}
+
+
+def reset() -> None:
+    """Clears pending swap records, reuse tracks and counters."""
+    with _LOCK:
+        _SWAPPED_FACES.clear()
+        _TRACKS.clear()
+        _STATS.clear()
+        _STATS.update(
+            {
+                "full_frames": 0,
+                "enhanced": 0,
+                "reused": 0,
+                "skipped_size": 0,
+                "frames_without_swaps": 0,
+            }
+        )
+
+
+reset()
+
+
+@contextmanager
+def frame_scope(key: Any, sequential: bool = False, stream: Any = None) -> Iterator[None]:
+    """
+    Binds the calling thread to a frame key so the swapper and the enhancer
+    agree on which frame a record belongs to. Patch reuse across frames is
+    only allowed for sequential scopes, where frames arrive in order, and
+    only between frames of the same stream.
+    """
+    previous = (getattr(_LOCAL, "key", None), getattr(_LOCAL, "sequential", None), getattr(_LOCAL, "stream", None))
+    _LOCAL.key, _LOCAL.sequential, _LOCAL.stream = key, sequential, stream
+    try:
+        yield
+    finally:
+        _LOCAL.key, _LOCAL.sequential, _LOCAL.stream = previous
+
+
+def current_key() -> Any:
+    key = getattr(_LOCAL, "key", None)
+    return LIVE_KEY if key is None else key
+
+
+def current_stream() -> Any:
+    return getattr(_LOCAL, "stream", None)
+
+
+def is_sequential() -> bool:
+    sequential = getattr(_LOCAL, "sequential", None)
+    return True if sequential is None else sequential
+
+
+def is_enabled() -> bool:
+    return getattr(modules.globals, "selective_enhancement", True)
+
+
+def enhancer_requested() -> bool:
+    return modules.globals.fp_ui.get("face_enhancer", False) or "face_enhancer" in modules.globals.frame_processors
+
+
+def record_swapped_faces(faces: List[Any]) -> None:
+    """Called by the swapper with the target faces it touched in the current frame."""
+    if not is_enabled() or not enhancer_requested():
+        return
+    record = []
+    for face in faces:
+        bbox = getattr(face, "bbox", None)
+        if bbox is None:
+            continue
+        kps = getattr(face, "kps", None)
+        record.append((np.array(bbox, dtype=np.float32), None if kps is None else np.array(kps, dtype=np.float32)))
+    key = current_key()
+    with _LOCK:
+        _SWAPPED_FACES[key] = record
+        _SWAPPED_FACES.move_to_end(key)
+        if is_sequential():
+            while len(_SWAPPED_FACES) > MAX_SEQUENTIAL_RECORDS:
+                _SWAPPED_FACES.popitem(last=False)
+
+
+def take_swapped_faces() -> Optional[List[Tuple[np.ndarray, Optional[np.ndarray]]]]:
+    """Returns the faces swapped in the current frame, or None when no swapper ran on it."""
+    with _LOCK:
+        return _SWAPPED_FACES.pop(current_key(), None)
+
+
+def face_size(bbox: np.ndarray) -> float:
+    return float(max(bbox[2] - bbox[0], bbox[3] - bbox[1]))
+
+
+def in_size_band(bbox: np.ndarray) -> bool:
+    size = face_size(bbox)
+    min_size = getattr(modules.globals, "enhancer_min_face_size", 0) or 0
+    max_size = getattr(modules.globals, "enhancer_max_face_size", 0) or 0
+    if size < min_size:
+        return False
+    if max_size and size > max_size:
+        return False
+    return True
+
+
+def patch_box(bbox: np.ndarray, frame_shape: Tuple[int, ...]) -> Tuple[int, int, int, int]:
+    """Expands a face bbox by PATCH_MARGIN on every side and clamps it to the frame."""
+    height, width = frame_shape[:2]
+    x1, y1, x2, y2 = bbox
+    margin_x = (x2 - x1) * PATCH_MARGIN
+    margin_y = (y2 - y1) * PATCH_MARGIN
+    return (
+        max(0, int(x1 - margin_x)),
+        max(0, int(y1 - margin_y)),
+        min(width, int(x2 + margin_x)),
+        min(height, int(y2 + margin_y)),
+    )
+
+
+def _iou(a: np.ndarray, b: np.ndarray) -> float:
+    inter_w = min(a[2], b[2]) - max(a[0], b[0])
+    inter_h = min(a[3], b[3]) - max(a[1], b[1])
+    if inter_w <= 0 or inter_h <= 0:
+        return 0.0
+    intersection = inter_w * inter_h
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return float(intersection / union) if union > 0 else 0.0
+
+
+def _match_track(bbox: np.ndarray) -> Optional[Dict[str, Any]]:
+    best_track, best_iou = None, TRACK_IOU
+    stream = current_stream()
+    for track in _TRACKS:
+        if track["stream"] != stream:
+            continue
+        iou = _iou(track["bbox"], bbox)
+        if iou >= best_iou:
+            best_track, best_iou = track, iou
+    return best_track
+
+
+def _pose_is_stable(track: Dict[str, Any], bbox: np.ndarray, kps: Optional[np.ndarray]) -> bool:
+    if kps is None or track["kps"] is None or kps.shape != track["kps"].shape:
+        return False
+    size = max(face_size(bbox), 1.0)
+    drift = float(np.mean(np.linalg.norm(kps - track["kps"], axis=1))) / size
+    return drift <= getattr(modules.globals, "enhancer_reuse_tolerance", 0.02)
+
+
+def reusable_patch(bbox: np.ndarray, kps: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    """
+    Returns the cached enhanced patch of the track matching this face when the
+    track was enhanced at most enhancer_reuse_frames frames ago and the
+    landmarks have not moved since. Only sequential scopes reuse patches.
+    """
+    reuse_frames = getattr(modules.globals, "enhancer_reuse_frames", 0) or 0
+    if reuse_frames <= 0 or not is_sequential():
+        return None
+    with _LOCK:
+        track = _match_track(bbox)
+        if track is None or track["age"] >= reuse_frames or not _pose_is_stable(track, bbox, kps):
+            return None
+        track["age"] += 1
+        track["seen"] = True
+        return track["patch"]
+
+
+def store_patch(bbox: np.ndarray, kps: Optional[np.ndarray], patch: np.ndarray) -> None:
+    if (getattr(modules.globals, "enhancer_reuse_frames", 0) or 0) <= 0 or not is_sequential():
+        return
+    with _LOCK:
+        track = _match_track(bbox)
+        if track is None:
+            track = {}
+            _TRACKS.append(track)
+        track.update({"bbox": bbox, "kps": kps, "patch": patch, "age": 0, "seen": True, "stream": current_stream()})
+
+
+def end_frame() -> None:
+    """Drops tracks whose face was not seen in the frame that just finished."""
+    if not is_sequential():
+        return
+    stream = current_stream()
+    with _LOCK:
+        _TRACKS[:] = [track for track in _TRACKS if track["stream"] != stream or track.pop("seen", False)]
+
+
+def feather_mask(height: int, width: int) -> np.ndarray:
+    """Elliptical soft mask used to blend reused patches into a newer frame."""
+    mask = _FEATHER_MASKS.get((height, width))
+    if mask is None:
+        mask = np.zeros((height, width), dtype=np.float32)
+        cv2.ellipse(mask, (width // 2, height // 2), (max(1, int(width * 0.4)), max(1, int(height * 0.45))), 0, 0, 360, 1.0, -1)
+        blur = max(3, (min(height, width) // 8) | 1)
+        mask = cv2.GaussianBlur(mask, (blur, blur), 0)[:, :, np.newaxis]
+        _FEATHER_MASKS[(height, width)] = mask
+    return mask
+
+
+def count(event: str, amount: int = 1) -> None:
+    with _LOCK:
+        _STATS[event] = _STATS.get(event, 0) + amount
+
+
+def get_stats() -> Dict[str, int]:
+    with _LOCK:
+        stats = dict(_STATS)
+    stats["saved"] = stats["reused"] + stats["skipped_size"] + stats["frames_without_swaps"]
+    return stats
+
+
+def format_stats() -> str:
+    stats = get_stats()
+    return (
+        f"Enhanced {stats['enhanced']} faces and {stats['full_frames']} full frames; "
+        f"saved {stats['saved']} enhancements "
+        f"({stats['reused']} reused, {stats['skipped_size']} outside size band, "
+        f"{stats['frames_without_swaps']} frames without swapped faces)."
+    )
@@ -7,10 +7,12 @@ import gfpgan
 import os
 import platform
 import torch # Make sure torch is imported
+import numpy as np
 
 import modules.globals
 import modules.processors.frame.core
 from modules.core import update_status
+from modules.processors.frame import enhancement_policy
 from modules.face_analyser import get_one_face
 from modules.typing import Frame, Face
 from modules.utilities import (
@@ -141,21 +143,80 @@ def enhance_face(temp_frame: Frame) -> Frame:
         return temp_frame
 
 
-def process_frame(source_face: Face | None, temp_frame: Frame) -> Frame:
-    """Processes a frame: enhances face if detected."""
-    # We don't strictly need source_face for enhancement only
-    # Check if any face exists to potentially save processing time, though GFPGAN also does detection.
-    # For simplicity and ensuring enhancement is attempted if possible, we can rely on enhance_face.
-    # target_face = get_one_face(temp_frame) # This gets only ONE face
-    # If you want to enhance ONLY if a face is detected by your *own* analyser first:
-    # has_face = get_one_face(temp_frame) is not None # Or use get_many_faces
-    # if has_face:
-    #     temp_frame = enhance_face(temp_frame)
-    # else: # Enhance regardless, let GFPGAN handle detection
-    temp_frame = enhance_face(temp_frame)
+def enhance_region(temp_frame: Frame, box: tuple) -> Frame | None:
+    """Enhances the single face centred in box and returns the restored patch."""
+    x1, y1, x2, y2 = box
+    crop = temp_frame[y1:y2, x1:x2]
+    if crop.size == 0:
+        return None
+    enhancer = get_face_enhancer()
+    try:
+        with THREAD_SEMAPHORE:
+            _, _, restored_crop = enhancer.enhance(
+                crop,
+                has_aligned=False,
+                only_center_face=True, # The crop is centred on the swapped face
+                paste_back=True
+            )
+    except Exception as e:
+        print(f"{NAME}: Error during face enhancement: {e}")
+        return None
+    if restored_crop is None or restored_crop.shape != crop.shape:
+        return None
+    return restored_crop
+
+
+def enhance_swapped_faces(temp_frame: Frame, swapped_faces: list) -> Frame:
+    """Enhances only the faces the swapper touched, honouring the size band and patch reuse."""
+    if not swapped_faces:
+        enhancement_policy.count("frames_without_swaps")
+        enhancement_policy.end_frame()
+        return temp_frame
+    for bbox, kps in swapped_faces:
+        if not enhancement_policy.in_size_band(bbox):
+            enhancement_policy.count("skipped_size")
+            continue
+        box = enhancement_policy.patch_box(bbox, temp_frame.shape)
+        x1, y1, x2, y2 = box
+        if x2 <= x1 or y2 <= y1:
+            continue
+        patch = enhancement_policy.reusable_patch(bbox, kps)
+        if patch is not None:
+            if patch.shape[:2] != (y2 - y1, x2 - x1):
+                patch = cv2.resize(patch, (x2 - x1, y2 - y1), interpolation=cv2.INTER_LINEAR)
+            mask = enhancement_policy.feather_mask(y2 - y1, x2 - x1)
+            region = temp_frame[y1:y2, x1:x2]
+            temp_frame[y1:y2, x1:x2] = (patch * mask + region * (1.0 - mask)).astype(np.uint8)
+            enhancement_policy.count("reused")
+            continue
+        restored_patch = enhance_region(temp_frame, box)
+        if restored_patch is None:
+            continue
+        temp_frame[y1:y2, x1:x2] = restored_patch
+        enhancement_policy.store_patch(bbox, kps, restored_patch)
+        enhancement_policy.count("enhanced")
+    enhancement_policy.end_frame()
     return temp_frame
 
 
+def process_frame(source_face: Face | None, temp_frame: Frame) -> Frame:
+    """
+    Processes a frame: enhances the faces the swapper touched in it.
+    Falls back to enhancing every face GFPGAN finds when no swapper ran on
+    this frame or selective enhancement is disabled.
+    """
+    swapped_faces = enhancement_policy.take_swapped_faces() if enhancement_policy.is_enabled() else None
+    if swapped_faces is None:
+        enhancement_policy.count("full_frames")
+        return enhance_face(temp_frame)
+    return enhance_swapped_faces(temp_frame, swapped_faces)
+
+
+def process_frame_v2(temp_frame: Frame, temp_frame_path: str = "") -> Frame:
+    """Map-faces / live entry point; the swapper's record already tells which faces to enhance."""
+    return process_frame(None, temp_frame)
+
+
 def process_frames(
     source_path: str | None, temp_frame_paths: List[str], progress: Any = None
 ) -> None:
@@ -174,7 +235,8 @@ def process_frames(
                 progress.update(1)
             continue
 
-        result_frame = process_frame(None, temp_frame)
+        with enhancement_policy.frame_scope(temp_frame_path):
+            result_frame = process_frame(None, temp_frame)
         cv2.imwrite(temp_frame_path, result_frame)
         if progress:
             progress.update(1)
@@ -186,21 +248,17 @@ def process_image(source_path: str | None, target_path: str, output_path: str) -
     if target_frame is None:
         print(f"{NAME}: Error: Failed to read target image {target_path}")
         return
-    result_frame = process_frame(None, target_frame)
+    with enhancement_policy.frame_scope(target_path):
+        result_frame = process_frame(None, target_frame)
     cv2.imwrite(output_path, result_frame)
     print(f"{NAME}: Enhanced image saved to {output_path}")
+    print(f"{NAME}: {enhancement_policy.format_stats()}")
 
 
 def process_video(source_path: str | None, temp_frame_paths: List[str]) -> None:
     """Processes video frames using the frame processor core."""
     # source_path might be optional depending on how process_video is called
     modules.processors.frame.core.process_video(source_path, temp_frame_paths, process_frames)
-
-# Optional: Keep process_frame_v2 if it's used elsewhere, otherwise it's redundant
-# def process_frame_v2(temp_frame: Frame) -> Frame:
-#     target_face = get_one_face(temp_frame)
-#     if target_face:
-#         temp_frame = enhance_face(temp_frame)
-#     return temp_frame
+    update_status(enhancement_policy.format_stats(), NAME)
 
 # --- END OF FILE face_enhancer.py ---
\ No newline at end of file
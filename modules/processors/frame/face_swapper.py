@@ -13,7 +13,13 @@ from modules.utilities import (
     is_image,
     is_video,
 )
-from modules.cluster_analysis import find_closest_centroid
+from modules.cluster_analysis import build_embedding_matrix, match_faces_to_targets
+from modules.processors.frame import enhancement_policy
+from modules.inference_scheduler import INFERENCE_SCHEDULER
+from modules.inference_broker import install as install_broker
+from modules.live_session import current_session
+from modules.quality_controller import mouth_mask_enabled
+from modules import face_library
 # Removed modules.globals.face_swapper_enabled - assuming controlled elsewhere or implicitly true if used
 # Removed modules.globals.opacity - accessed via getattr
 import os
@@ -90,6 +96,7 @@ def get_face_swapper() -> Any:
                         for p in modules.globals.execution_providers
                     ],
                 )
+                install_broker(FACE_SWAPPER, "swapper")
                 update_status("Face swapper model loaded successfully.", NAME)
             except Exception as e:
                 update_status(f"Error loading face swapper model: {e}", NAME)
@@ -118,9 +125,10 @@ def swap_face(source_face: Face, target_face: Face, temp_frame: Frame) -> Frame:
 
     # Apply the face swap
     try:
-        swapped_frame_raw = face_swapper.get(
-            temp_frame, target_face, source_face, paste_back=True
-        )
+        with INFERENCE_SCHEDULER.slot("swap"):
+            swapped_frame_raw = face_swapper.get(
+                temp_frame, target_face, source_face, paste_back=True
+            )
 
         # --- START: CRITICAL FIX FOR ORT 1.17 ---
         # Check the output type and range from the model
@@ -157,7 +165,7 @@ def swap_face(source_face: Face, target_face: Face, temp_frame: Frame) -> Frame:
     # --- Post-swap Processing (Masking, Opacity, etc.) ---
     # Now, work with the guaranteed uint8 'swapped_frame'
 
-    if getattr(modules.globals, "mouth_mask", False): # Check if mouth_mask is enabled
+    if mouth_mask_enabled(): # Check if mouth_mask is enabled and not shed by the live quality level
         # Create a mask for the target face
         face_mask = create_face_mask(target_face, temp_frame) # Use temp_frame (original shape) for mask creation geometry
 
@@ -195,10 +203,31 @@ def swap_face(source_face: Face, target_face: Face, temp_frame: Frame) -> Frame:
     return final_swapped_frame
 
 
+def get_previous_frame_result() -> Frame | None:
+    """Interpolation state of the live session bound to this thread, or of the single default stream."""
+    session = current_session()
+    return session.previous_frame_result if session is not None else PREVIOUS_FRAME_RESULT
+
+
+def set_previous_frame_result(frame: Frame | None) -> None:
+    global PREVIOUS_FRAME_RESULT
+    session = current_session()
+    if session is not None:
+        session.previous_frame_result = frame
+    else:
+        PREVIOUS_FRAME_RESULT = frame
+
+
+def session_source_face(session: Any) -> Face | None:
+    if session is not None and session.source_face is not None:
+        return session.source_face
+    return default_source_face()
+
+
 # --- START: Helper function for interpolation and sharpening ---
 def apply_post_processing(current_frame: Frame, swapped_face_bboxes: List[np.ndarray]) -> Frame:
     """Applies sharpening and interpolation."""
-    global PREVIOUS_FRAME_RESULT
+    previous_frame_result = get_previous_frame_result()
 
     processed_frame = current_frame.copy()
 
@@ -252,11 +281,11 @@ def apply_post_processing(current_frame: Frame, swapped_face_bboxes: List[np.nda
     final_frame = processed_frame # Start with the current (potentially sharpened) frame
 
     if enable_interpolation and 0 < interpolation_weight < 1:
-        if PREVIOUS_FRAME_RESULT is not None and PREVIOUS_FRAME_RESULT.shape == processed_frame.shape and PREVIOUS_FRAME_RESULT.dtype == processed_frame.dtype:
+        if previous_frame_result is not None and previous_frame_result.shape == processed_frame.shape and previous_frame_result.dtype == processed_frame.dtype:
             # Perform interpolation
             try:
                  final_frame = cv2.addWeighted(
-                    PREVIOUS_FRAME_RESULT, 1.0 - interpolation_weight,
+                    previous_frame_result, 1.0 - interpolation_weight,
                     processed_frame, interpolation_weight,
                     0
                  )
@@ -265,59 +294,68 @@ def apply_post_processing(current_frame: Frame, swapped_face_bboxes: List[np.nda
             except cv2.error as interp_e:
                  # print(f"Warning: OpenCV error during interpolation: {interp_e}") # Debug
                  final_frame = processed_frame # Use current frame if interpolation fails
-                 PREVIOUS_FRAME_RESULT = None # Reset state if error occurs
+                 set_previous_frame_result(None) # Reset state if error occurs
 
             # Update the state for the next frame *with the interpolated result*
-            PREVIOUS_FRAME_RESULT = final_frame.copy()
+            set_previous_frame_result(final_frame.copy())
         else:
             # If previous frame invalid or doesn't match, use current frame and update state
-            if PREVIOUS_FRAME_RESULT is not None and PREVIOUS_FRAME_RESULT.shape != processed_frame.shape:
+            if previous_frame_result is not None and previous_frame_result.shape != processed_frame.shape:
                 # print("Info: Frame shape changed, resetting interpolation state.") # Debug
                 pass
-            PREVIOUS_FRAME_RESULT = processed_frame.copy()
+            set_previous_frame_result(processed_frame.copy())
     else:
          # If interpolation is off or weight is invalid, just use the current frame
          # Update state with the current (potentially sharpened) frame
          # Reset previous frame state if interpolation was just turned off or weight is invalid
-         PREVIOUS_FRAME_RESULT = processed_frame.copy()
+         set_previous_frame_result(processed_frame.copy())
 
 
     return final_frame
 # --- END: Helper function for interpolation and sharpening ---
 
 
-def process_frame(source_face: Face, temp_frame: Frame) -> Frame:
+def process_frame(source_face: Face, temp_frame: Frame, detected_faces: List[Face] | None = None) -> Frame:
     """
     DEPRECATED / SIMPLER VERSION - Processes a single frame using one source face.
     Consider using process_frame_v2 for more complex scenarios.
+    detected_faces lets a pipelined caller pass faces detected on another thread.
     """
     if getattr(modules.globals, "opacity", 1.0) == 0:
         # If opacity is 0, no swap happens, so no post-processing needed.
         # Also reset interpolation state if it was active.
-        global PREVIOUS_FRAME_RESULT
-        PREVIOUS_FRAME_RESULT = None
+        set_previous_frame_result(None)
+        enhancement_policy.record_swapped_faces([])
         return temp_frame
 
     # Color correction removed from here (better applied before swap if needed)
 
     processed_frame = temp_frame # Start with the input frame
     swapped_face_bboxes = [] # Keep track of where swaps happened
+    swapped_faces = [] # Target faces touched, for the enhancement policy
 
     if modules.globals.many_faces:
-        many_faces = get_many_faces(processed_frame)
+        many_faces = get_many_faces(processed_frame) if detected_faces is None else detected_faces
         if many_faces:
             current_swap_target = processed_frame.copy() # Apply swaps sequentially on a copy
             for target_face in many_faces:
                 current_swap_target = swap_face(source_face, target_face, current_swap_target)
                 if target_face is not None and hasattr(target_face, "bbox") and target_face.bbox is not None:
                     swapped_face_bboxes.append(target_face.bbox.astype(int))
+                    swapped_faces.append(target_face)
             processed_frame = current_swap_target # Assign the final result after all swaps
     else:
-        target_face = get_one_face(processed_frame)
+        if detected_faces is None:
+            target_face = get_one_face(processed_frame)
+        else:
+            target_face = min(detected_faces, key=lambda x: x.bbox[0]) if detected_faces else None
         if target_face:
             processed_frame = swap_face(source_face, target_face, processed_frame)
             if target_face is not None and hasattr(target_face, "bbox") and target_face.bbox is not None:
                     swapped_face_bboxes.append(target_face.bbox.astype(int))
+                    swapped_faces.append(target_face)
+
+    enhancement_policy.record_swapped_faces(swapped_faces)
 
     # Apply sharpening and interpolation
     final_frame = apply_post_processing(processed_frame, swapped_face_bboxes)
@@ -325,17 +363,21 @@ def process_frame(source_face: Face, temp_frame: Frame) -> Frame:
     return final_frame
 
 
-def process_frame_v2(temp_frame: Frame, temp_frame_path: str = "") -> Frame:
-    """Handles complex mapping scenarios (map_faces=True) and live streams."""
+def process_frame_v2(temp_frame: Frame, temp_frame_path: str = "", detected_faces: List[Face] | None = None) -> Frame:
+    """
+    Handles complex mapping scenarios (map_faces=True) and live streams.
+    For live streams, detected_faces skips the detection pass when the caller already ran it.
+    """
     if getattr(modules.globals, "opacity", 1.0) == 0:
         # If opacity is 0, no swap happens, so no post-processing needed.
         # Also reset interpolation state if it was active.
-        global PREVIOUS_FRAME_RESULT
-        PREVIOUS_FRAME_RESULT = None
+        set_previous_frame_result(None)
+        enhancement_policy.record_swapped_faces([])
         return temp_frame
 
     processed_frame = temp_frame # Start with the input frame
     swapped_face_bboxes = [] # Keep track of where swaps happened
+    swapped_faces = [] # Target faces touched, for the enhancement policy
 
     # Determine source/target pairs based on mode
     source_target_pairs = []
@@ -343,6 +385,10 @@ def process_frame_v2(temp_frame: Frame, temp_frame_path: str = "") -> Frame:
     # Ensure maps exist before accessing them
     souce_target_map = getattr(modules.globals, "souce_target_map", None)
     simple_map = getattr(modules.globals, "simple_map", None)
+    # A live session brings its own source face and mapping
+    session = current_session()
+    if session is not None and session.simple_map is not None:
+        simple_map = session.simple_map
 
     # Check if target is a file path (image or video) or live stream
     is_file_target = modules.globals.target_path and (is_image(modules.globals.target_path) or is_video(modules.globals.target_path))
@@ -361,15 +407,11 @@ def process_frame_v2(temp_frame: Frame, temp_frame_path: str = "") -> Frame:
                                 if target_face:
                                     source_target_pairs.append((source_face, target_face))
                         elif is_video(modules.globals.target_path):
-                             # Find faces for the current frame_path in video map
-                             target_frames_data = map_data.get("target_faces_in_frame", [])
+                             # Find faces for the current frame_path in the columnar face store
+                             target_frames_data = map_data.get("target_faces_in_frame")
                              if target_frames_data: # Check if frame data exists
-                                 target_frames = [f for f in target_frames_data if f and f.get("location") == temp_frame_path]
-                                 for frame_data in target_frames:
-                                     faces_in_frame = frame_data.get("faces", [])
-                                     if faces_in_frame: # Check if faces exist
-                                         for target_face in faces_in_frame:
-                                             source_target_pairs.append((source_face, target_face))
+                                 for target_face in target_frames_data.faces_at(temp_frame_path):
+                                     source_target_pairs.append((source_face, target_face))
             else: # Single face or specific mapping
                  for map_data in souce_target_map:
                     source_info = map_data.get("source", {})
@@ -384,51 +426,36 @@ def process_frame_v2(temp_frame: Frame, temp_frame_path: str = "") -> Frame:
                            if target_face:
                               source_target_pairs.append((source_face, target_face))
                     elif is_video(modules.globals.target_path):
-                        target_frames_data = map_data.get("target_faces_in_frame", [])
+                        target_frames_data = map_data.get("target_faces_in_frame")
                         if target_frames_data:
-                           target_frames = [f for f in target_frames_data if f and f.get("location") == temp_frame_path]
-                           for frame_data in target_frames:
-                               faces_in_frame = frame_data.get("faces", [])
-                               if faces_in_frame:
-                                  for target_face in faces_in_frame:
-                                      source_target_pairs.append((source_face, target_face))
+                           for target_face in target_frames_data.faces_at(temp_frame_path):
+                               source_target_pairs.append((source_face, target_face))
 
     else:
-        # Live stream or webcam processing (analyze faces on the fly)
-        detected_faces = get_many_faces(processed_frame)
+        # Live stream or webcam processing (analyze faces on the fly unless already detected)
+        if detected_faces is None:
+            detected_faces = get_many_faces(processed_frame)
         if detected_faces:
             if modules.globals.many_faces:
-                 source_face = default_source_face() # Use default source for all detected targets
+                 source_face = session_source_face(session) # Use default source for all detected targets
                  if source_face:
                      for target_face in detected_faces:
                         source_target_pairs.append((source_face, target_face))
             elif simple_map:
                 # Use simple_map (source_faces <-> target_embeddings)
                 source_faces = simple_map.get("source_faces", [])
-                target_embeddings = simple_map.get("target_embeddings", [])
-
-                if source_faces and target_embeddings and len(source_faces) == len(target_embeddings):
-                     # Match detected faces to the closest target embedding
-                     if len(detected_faces) <= len(target_embeddings):
-                          # More targets defined than detected - match each detected face
-                          for detected_face in detected_faces:
-                              if detected_face.normed_embedding is None: continue
-                              closest_idx, _ = find_closest_centroid(target_embeddings, detected_face.normed_embedding)
-                              if 0 <= closest_idx < len(source_faces):
-                                  source_target_pairs.append((source_faces[closest_idx], detected_face))
-                     else:
-                          # More faces detected than targets defined - match each target embedding to closest detected face
-                          detected_embeddings = [f.normed_embedding for f in detected_faces if f.normed_embedding is not None]
-                          detected_faces_with_embedding = [f for f in detected_faces if f.normed_embedding is not None]
-                          if not detected_embeddings: return processed_frame # No embeddings to match
-
-                          for i, target_embedding in enumerate(target_embeddings):
-                              if 0 <= i < len(source_faces): # Ensure source face exists for this embedding
-                                 closest_idx, _ = find_closest_centroid(detected_embeddings, target_embedding)
-                                 if 0 <= closest_idx < len(detected_faces_with_embedding):
-                                     source_target_pairs.append((source_faces[i], detected_faces_with_embedding[closest_idx]))
+                target_matrix = simple_map.get("target_matrix")
+                if target_matrix is None: # Map built before the matrix was cached
+                    target_matrix = build_embedding_matrix(simple_map.get("target_embeddings", []))
+                    simple_map["target_matrix"] = target_matrix
+
+                if source_faces and len(source_faces) == len(target_matrix):
+                    # Score every detected face against every target at once and assign one-to-one
+                    faces_with_embedding = [f for f in detected_faces if f.normed_embedding is not None]
+                    for face_index, target_index in match_faces_to_targets(target_matrix, [f.normed_embedding for f in faces_with_embedding]):
+                        source_target_pairs.append((source_faces[target_index], faces_with_embedding[face_index]))
             else: # Fallback: if no map, use default source for the single detected face (if any)
-                source_face = default_source_face()
+                source_face = session_source_face(session)
                 target_face = get_one_face(processed_frame, detected_faces) # Use faces already detected
                 if source_face and target_face:
                     source_target_pairs.append((source_face, target_face))
@@ -441,8 +468,11 @@ def process_frame_v2(temp_frame: Frame, temp_frame_path: str = "") -> Frame:
             current_swap_target = swap_face(source_face, target_face, current_swap_target)
             if target_face is not None and hasattr(target_face, "bbox") and target_face.bbox is not None:
                 swapped_face_bboxes.append(target_face.bbox.astype(int))
+                swapped_faces.append(target_face)
     processed_frame = current_swap_target # Assign final result
 
+    enhancement_policy.record_swapped_faces(swapped_faces)
+
 
     # Apply sharpening and interpolation
     final_frame = apply_post_processing(processed_frame, swapped_face_bboxes)
@@ -464,7 +494,11 @@ def process_frames(
 
     # --- Pre-load source face only if needed (Simple Mode: map_faces=False) ---
     if not use_v2:
-        if not source_path or not os.path.exists(source_path):
+        if modules.globals.source_id:
+            source_face = face_library.get_source_face()
+            if source_face is None:
+                update_status(f"Error: Source face {modules.globals.source_id} is not in the face library.", NAME)
+        elif not source_path or not os.path.exists(source_path):
             update_status(f"Error: Source path invalid or not provided for simple mode: {source_path}", NAME)
             # Log the error but allow proceeding; subsequent check will stop processing.
         else:
@@ -474,7 +508,8 @@ def process_frames(
                     # Specific error for file reading failure
                     update_status(f"Error reading source image file {source_path}. Please check the path and file integrity.", NAME)
                 else:
-                    source_face = get_one_face(source_img)
+                    # Detected once per process; frame chunks after the first get the cached face
+                    source_face = face_library.load_face(source_path, source_img)
                     if source_face is None:
                         # Specific message for no face detected after successful read
                         update_status(f"Warning: Successfully read source image {source_path}, but no face was detected. Swaps will be skipped.", NAME)
@@ -519,19 +554,20 @@ def process_frames(
         # Select processing function and execute
         result_frame = None
         try:
-            if use_v2:
-                # V2 uses global maps and needs the frame path for lookup in video mode
-                # update_status(f"Using process_frame_v2 for: {os.path.basename(temp_frame_path)}", NAME) # Optional Debug
-                result_frame = process_frame_v2(temp_frame, temp_frame_path)
-            else:
-                # Simple mode uses the pre-loaded source_face (already checked for validity above)
-                # update_status(f"Using process_frame (simple) for: {os.path.basename(temp_frame_path)}", NAME) # Optional Debug
-                result_frame = process_frame(source_face, temp_frame) # source_face is guaranteed to be valid here
+            with enhancement_policy.frame_scope(temp_frame_path):
+                if use_v2:
+                    # V2 uses global maps and needs the frame path for lookup in video mode
+                    # update_status(f"Using process_frame_v2 for: {os.path.basename(temp_frame_path)}", NAME) # Optional Debug
+                    result_frame = process_frame_v2(temp_frame, temp_frame_path)
+                else:
+                    # Simple mode uses the pre-loaded source_face (already checked for validity above)
+                    # update_status(f"Using process_frame (simple) for: {os.path.basename(temp_frame_path)}", NAME) # Optional Debug
+                    result_frame = process_frame(source_face, temp_frame) # source_face is guaranteed to be valid here
 
-            # Check if processing actually returned a frame
-            if result_frame is None:
-                 print(f"{NAME}: Warning: Processing returned None for frame {temp_frame_path}. Using original.")
-                 result_frame = temp_frame
+                # Check if processing actually returned a frame
+                if result_frame is None:
+                     print(f"{NAME}: Warning: Processing returned None for frame {temp_frame_path}. Using original.")
+                     result_frame = temp_frame
 
         except Exception as proc_e:
             print(f"{NAME}: Error processing frame {temp_frame_path}: {proc_e}")
@@ -560,6 +596,7 @@ def process_image(source_path: str, target_path: str, output_path: str) -> None:
     # --- Reset interpolation state for single image processing ---
     global PREVIOUS_FRAME_RESULT
     PREVIOUS_FRAME_RESULT = None
+    enhancement_policy.reset()
     # ---
 
     use_v2 = getattr(modules.globals, "map_faces", False)
@@ -581,23 +618,31 @@ def process_image(source_path: str, target_path: str, output_path: str) -> None:
                  update_status("Processing image with 'map_faces' and 'many_faces'. Using pre-analysis map.", NAME)
             # V2 processes based on global maps, doesn't need source_path here directly
             # Assumes maps are pre-populated. Pass target_path for map lookup.
-            result = process_frame_v2(target_frame, target_path)
+            with enhancement_policy.frame_scope(output_path):
+                result = process_frame_v2(target_frame, target_path)
 
         else: # Simple mode
             try:
-                source_img = cv2.imread(source_path)
-                if source_img is None:
-                    update_status(f"Error: Could not read source image: {source_path}", NAME)
-                    return
-                source_face = get_one_face(source_img)
-                if not source_face:
-                    update_status(f"Error: No face found in source image: {source_path}", NAME)
-                    return
+                if modules.globals.source_id:
+                    source_face = face_library.get_source_face()
+                    if source_face is None:
+                        update_status(f"Error: Source face {modules.globals.source_id} is not in the face library.", NAME)
+                        return
+                else:
+                    source_img = cv2.imread(source_path)
+                    if source_img is None:
+                        update_status(f"Error: Could not read source image: {source_path}", NAME)
+                        return
+                    source_face = face_library.load_face(source_path, source_img)
+                    if not source_face:
+                        update_status(f"Error: No face found in source image: {source_path}", NAME)
+                        return
             except Exception as src_e:
                  update_status(f"Error reading or analyzing source image {source_path}: {src_e}", NAME)
                  return
 
-            result = process_frame(source_face, target_frame)
+            with enhancement_policy.frame_scope(output_path):
+                result = process_frame(source_face, target_frame)
 
         # Write the result if processing was successful
         if result is not None:
@@ -621,6 +666,7 @@ def process_video(source_path: str, temp_frame_paths: List[str]) -> None:
     # --- Reset interpolation state before starting video processing ---
     global PREVIOUS_FRAME_RESULT
     PREVIOUS_FRAME_RESULT = None
+    enhancement_policy.reset()
     # ---
 
     mode_desc = "'map_faces'" if getattr(modules.globals, "map_faces", False) else "'simple'"
@@ -0,0 +1,143 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import modules.globals
+
+NAME = "DLC.QUALITY"
+
+# Quality ladder, best first. Each level only lists what it changes from the
+# level above; "enhancer" and "mouth_mask" can only switch a user's choice off.
+QUALITY_LEVELS: List[Dict[str, Any]] = [
+    {"det_size": 640, "scale": 1.0, "enhancer": True, "mouth_mask": True, "detection_interval": 1},
+    {"det_size": 480},
+    {"det_size": 320},
+    {"enhancer": False},
+    {"scale": 0.75},
+    {"mouth_mask": False},
+    {"detection_interval": 2},
+    {"scale": 0.5, "detection_interval": 3},
+]
+EVALUATION_INTERVAL = 1.0  # seconds between decisions
+DOWNGRADE_AFTER = 2        # consecutive bad evaluations before stepping down
+UPGRADE_AFTER = 4          # consecutive good evaluations before stepping up
+UPGRADE_HEADROOM = 0.6     # the busiest stage must use less than this share of the frame budget
+EWMA_ALPHA = 0.3
+
+_LOCAL = threading.local()
+
+
+@contextmanager
+def quality_scope(controller: Optional["QualityController"]) -> Iterator[None]:
+    """Binds the calling thread to the controller of the stream whose frame it is processing."""
+    previous = getattr(_LOCAL, "controller", None)
+    _LOCAL.controller = controller
+    try:
+        yield
+    finally:
+        _LOCAL.controller = previous
+
+
+def mouth_mask_enabled() -> bool:
+    """The user's mouth mask choice, unless the bound stream's quality level has switched it off."""
+    controller = getattr(_LOCAL, "controller", None)
+    return bool(modules.globals.mouth_mask) and (controller is None or controller.mouth_mask_allowed)
+
+
+class QualityController:
+    """
+    Holds live fps and latency by stepping through QUALITY_LEVELS. Once per
+    second it compares the measured fps, the smoothed end-to-end latency and
+    the busiest stage's time against the targets. It steps down after
+    repeated misses where processing (not the camera) is the bottleneck, and
+    steps back up after a longer run with clear headroom. The asymmetric
+    counts keep it from oscillating. Every decision is logged.
+
+    The controller never writes globals: each stream asks its own controller,
+    so one session's level leaves other sessions and the user's toggles alone.
+    """
+
+    def __init__(self, target_fps: float = 24.0, latency_target: float = 0.25):
+        self.target_fps = target_fps
+        self.latency_target = latency_target
+        self.level = 0
+        self.settings = self._settings_for(0)
+        self.frames = 0
+        self.window_started = time.time()
+        self.latency = None
+        self.bad_evaluations = 0
+        self.good_evaluations = 0
+        self.decisions: List[dict] = []
+
+    @property
+    def processing_scale(self) -> float:
+        return self.settings["scale"]
+
+    @property
+    def enhancer_allowed(self) -> bool:
+        return self.settings["enhancer"]
+
+    @property
+    def detection_size(self) -> int:
+        return self.settings["det_size"]
+
+    @property
+    def mouth_mask_allowed(self) -> bool:
+        return self.settings["mouth_mask"]
+
+    @property
+    def detection_interval(self) -> int:
+        return self.settings["detection_interval"]
+
+    def observe(self, latency: float, stage_times: Optional[Dict[str, float]] = None) -> None:
+        """Called for every displayed frame with its capture-to-display latency in seconds."""
+        self.frames += 1
+        self.latency = latency if self.latency is None else self.latency + EWMA_ALPHA * (latency - self.latency)
+        elapsed = time.time() - self.window_started
+        if elapsed >= EVALUATION_INTERVAL:
+            self._evaluate(self.frames / elapsed, stage_times or {})
+            self.frames = 0
+            self.window_started = time.time()
+
+    def restore(self) -> None:
+        """Puts every knob back to full quality."""
+        self.level = 0
+        self.settings = self._settings_for(0)
+
+    def _evaluate(self, fps: float, stage_times: Dict[str, float]) -> None:
+        budget = 1.0 / self.target_fps
+        busiest_stage, busiest_time = max(stage_times.items(), key=lambda item: item[1], default=("none", 0.0))
+        too_slow = fps < self.target_fps * 0.9 and busiest_time > budget
+        too_late = self.latency_target and self.latency > self.latency_target
+        has_headroom = busiest_time < budget * UPGRADE_HEADROOM and not (self.latency_target and self.latency > self.latency_target * 0.7)
+
+        if too_slow or too_late:
+            self.bad_evaluations += 1
+            self.good_evaluations = 0
+        elif has_headroom:
+            self.good_evaluations += 1
+            self.bad_evaluations = 0
+        else:
+            self.bad_evaluations = self.good_evaluations = 0
+
+        measured = f"fps {fps:.1f}/{self.target_fps:.0f}, latency {self.latency * 1000:.0f} ms, busiest {busiest_stage} {busiest_time * 1000:.0f} ms"
+        if self.bad_evaluations >= DOWNGRADE_AFTER and self.level < len(QUALITY_LEVELS) - 1:
+            self._set_level(self.level + 1, "down", measured)
+        elif self.good_evaluations >= UPGRADE_AFTER and self.level > 0:
+            self._set_level(self.level - 1, "up", measured)
+
+    def _set_level(self, level: int, direction: str, measured: str) -> None:
+        previous = self.settings
+        self.level = level
+        self.settings = self._settings_for(level)
+        self.bad_evaluations = self.good_evaluations = 0
+        changes = ", ".join(f"{key} {previous[key]} -> {value}" for key, value in self.settings.items() if previous[key] != value)
+        self.decisions.append({"time": time.time(), "level": level, "direction": direction, "changes": changes, "measured": measured})
+        print(f"{NAME}: quality {direction} to level {level} ({changes}); {measured}")
+
+    def _settings_for(self, level: int) -> Dict[str, Any]:
+        settings: Dict[str, Any] = {}
+        for step in QUALITY_LEVELS[:level + 1]:
+            settings.update(step)
+        return settings
@@ -0,0 +1,685 @@
+import copy
+import json
+import multiprocessing
+import os
+import queue
+import re
+import shutil
+import signal
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import deque
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+
+import modules.globals
+
+NAME = "DLC.SERVER"
+CHUNK_SIZE = 1 << 20
+# Request bodies larger than these are refused before any of them is read
+MAX_UPLOAD_SIZE = 4 << 30
+MAX_JSON_SIZE = 1 << 20
+WORKER_CHECK_INTERVAL = 0.5  # seconds between checks for dead workers
+RETENTION_INTERVAL = 60.0    # seconds between sweeps for expired jobs and uploads
+# Job options clients may set, with the type each value is coerced to; everything else keeps the server's settings
+JOB_OPTIONS = {
+    "frame_processors": list,
+    "keep_fps": bool,
+    "keep_audio": bool,
+    "many_faces": bool,
+    "mouth_mask": bool,
+    "color_correction": bool,
+    "nsfw_filter": bool,
+    "video_encoder": str,
+    "video_quality": int,
+    "opacity": float,
+    "sharpness": float,
+    "enable_interpolation": bool,
+    "interpolation_weight": float,
+    "enhancer_min_face_size": int,
+    "enhancer_max_face_size": int,
+    "source_id": str,
+}
+FRAME_PROCESSORS = ("face_swapper", "face_enhancer")
+VIDEO_ENCODERS = ("libx264", "libx265", "libvpx-vp9")
+# Settings copied from the serving process into every worker
+SETTING_TYPES = (bool, int, float, str, list, dict, type(None))
+
+JOBS: Dict[str, dict] = {}
+JOBS_LOCK = threading.Lock()
+
+
+def get_server_root() -> str:
+    return modules.globals.server_root or os.path.join(tempfile.gettempdir(), "deep-live-cam", "server")
+
+
+def get_settings() -> Dict[str, Any]:
+    """Picklable copy of the current global settings for the worker processes."""
+    return {
+        name: value
+        for name, value in vars(modules.globals).items()
+        if not name.startswith("_") and name.islower() and isinstance(value, SETTING_TYPES) and name not in ("souce_target_map", "simple_map")
+    }
+
+
+def parse_options(options: Dict[str, Any]) -> Dict[str, Any]:
+    """Validates client options; raises ValueError with a message fit for the client."""
+    parsed = {}
+    for name, value in options.items():
+        kind = JOB_OPTIONS.get(name)
+        if kind is None:
+            raise ValueError(f"unknown option: {name}")
+        if kind is list:
+            if not isinstance(value, list) or not value or any(item not in FRAME_PROCESSORS for item in value):
+                raise ValueError(f"{name} must be a list of {', '.join(FRAME_PROCESSORS)}")
+            parsed[name] = value
+        elif kind is bool:
+            if not isinstance(value, bool):
+                raise ValueError(f"{name} must be true or false")
+            parsed[name] = value
+        else:
+            try:
+                parsed[name] = kind(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"{name} must be a {kind.__name__}")
+    if "video_encoder" in parsed and parsed["video_encoder"] not in VIDEO_ENCODERS:
+        raise ValueError(f"video_encoder must be one of {', '.join(VIDEO_ENCODERS)}")
+    if "video_quality" in parsed and not 0 <= parsed["video_quality"] <= 51:
+        raise ValueError("video_quality must be between 0 and 51")
+    return parsed
+
+
+def public_job(job: dict) -> dict:
+    """The job as reported to clients, with its progress and ETA."""
+    report = {key: job[key] for key in ("id", "status", "stage", "error", "created", "started", "finished")}
+    report["progress"] = None
+    report["eta"] = None
+    progress = job.get("progress")
+    if progress is not None:
+        index, done, total, started = progress
+        processors = max(1, len(job["options"].get("frame_processors") or modules.globals.frame_processors))
+        fraction = min(1.0, (index + done / max(1, total)) / processors)
+        report["progress"] = {"processor": index + 1, "processors": processors, "frames_done": done, "frames_total": total, "fraction": round(fraction, 4)}
+        elapsed = time.time() - started
+        if fraction > 0 and job["status"] == "running":
+            report["eta"] = round(elapsed * (1 - fraction) / fraction, 1)
+    if job["status"] == "done":
+        report["result"] = f"/jobs/{job['id']}/result"
+    return report
+
+
+def public_face(entry: dict) -> dict:
+    """A face library entry as reported to clients."""
+    report = {key: entry[key] for key in ("id", "name", "created", "width", "height", "det_score", "gender", "age")}
+    report["crop"] = f"/faces/{entry['id']}/crop"
+    return report
+
+
+@contextmanager
+def job_workspace(job: dict) -> Iterator[str]:
+    """
+    The job's target linked (or copied) into a directory of its own, so the
+    frame temp directory next to it belongs to this job alone even when
+    other jobs run on the same upload. The directory is removed afterwards.
+    """
+    os.makedirs(job["work_dir"], exist_ok=True)
+    target_path = os.path.join(job["work_dir"], os.path.basename(job["target_path"]))
+    try:
+        try:
+            os.link(job["target_path"], target_path)
+        except OSError:
+            shutil.copyfile(job["target_path"], target_path)
+        yield target_path
+    finally:
+        shutil.rmtree(job["work_dir"], ignore_errors=True)
+
+
+def worker_main(settings: Dict[str, Any], jobs: Any, events: Any) -> None:
+    """
+    Worker process: loads the frame processors once and runs jobs until it
+    receives None. Global settings are restored before every job, so options
+    never leak from one job into the next, while the models stay loaded.
+    """
+    # The serving process owns Ctrl+C and stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    vars(modules.globals).update(settings)
+    modules.globals.headless = True
+
+    import modules.core
+    import modules.processors.frame.core as frame_core
+
+    modules.core.limit_resources()
+    current = {"job_id": None, "processors": []}
+
+    def on_status(message: str, scope: str) -> None:
+        current["last_status"] = message
+        events.put(("status", current["job_id"], f"{message}" if scope == "DLC.CORE" else f"{scope}: {message}"))
+
+    def on_progress(done: int, total: int, processor_name: str) -> None:
+        processors = current["processors"]
+        index = processors.index(processor_name) if processor_name in processors else 0
+        events.put(("progress", current["job_id"], index, done, total))
+
+    modules.core.STATUS_CALLBACK = on_status
+    frame_core.set_progress_callback(on_progress)
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        current["job_id"] = job["id"]
+        # Deep copies, because processing may modify lists such as frame_processors in place
+        vars(modules.globals).update(copy.deepcopy(settings))
+        vars(modules.globals).update(copy.deepcopy(job["options"]))
+        modules.globals.headless = True
+        modules.globals.source_path = job["source_path"]
+        modules.globals.output_path = job["output_path"]
+        modules.globals.fp_ui = {"face_enhancer": "face_enhancer" in modules.globals.frame_processors}
+        current["processors"] = list(modules.globals.frame_processors)
+        # Processor modules stay imported (and their models loaded); only the job's selection is rebuilt
+        frame_core.FRAME_PROCESSORS_MODULES = []
+        events.put(("started", job["id"], os.getpid()))
+        try:
+            with job_workspace(job) as target_path:
+                modules.globals.target_path = target_path
+                if modules.globals.nsfw_filter:
+                    from modules.predicter import predict_image, predict_video
+                    from modules.utilities import has_image_extension
+
+                    check = predict_image if has_image_extension(target_path) else predict_video
+                    if check(target_path):
+                        raise RuntimeError("target rejected by the NSFW filter")
+                    modules.globals.nsfw_filter = False
+                current["last_status"] = ""
+                modules.core.start()
+            if not os.path.isfile(job["output_path"]) or "failed" in current["last_status"]:
+                raise RuntimeError(current["last_status"] or "processing produced no output")
+            events.put(("done", job["id"]))
+        except Exception as e:
+            traceback.print_exc()
+            events.put(("failed", job["id"], str(e)))
+        current["job_id"] = None
+
+
+class JobServer:
+    """
+    Long-running HTTP front end for offline swap jobs. Uploads and results
+    live under the server root; jobs wait in the server until a worker
+    process is idle, so queued jobs can still be cancelled, and the workers
+    keep their models loaded between jobs. Progress reported by the workers
+    is folded into the job table by an event thread, which also replaces
+    workers that die and fails the job they were given. Every worker has its
+    own job queue, so the server always knows which job each one holds.
+    Finished jobs and their results are forgotten after server_retention
+    hours, as are uploads no job has used for that long. WebSocket clients
+    of /live are served in this process instead, each by its own live
+    session, since they need a frame back within milliseconds; at most
+    server_max_live_sessions of them at a time.
+    """
+
+    def __init__(self, host: str, port: int, workers: int):
+        self.host = host
+        self.port = port
+        self.worker_count = max(1, workers)
+        self.root = get_server_root()
+        self.upload_dir = os.path.join(self.root, "uploads")
+        self.result_dir = os.path.join(self.root, "results")
+        # One directory per running job, holding its target and frame temp directory
+        self.work_dir = os.path.join(self.root, "work")
+        os.makedirs(self.upload_dir, exist_ok=True)
+        os.makedirs(self.result_dir, exist_ok=True)
+        self.context = multiprocessing.get_context("spawn")
+        self.events = self.context.Queue()
+        self.workers: List[Any] = []
+        # Per worker process: its job queue and the id of the job it was given, None while idle
+        self.job_queues: Dict[Any, Any] = {}
+        self.assignments: Dict[Any, Optional[str]] = {}
+        self.settings: Dict[str, Any] = {}
+        self.pending: deque = deque()
+        self.httpd: Optional[ThreadingHTTPServer] = None
+        self.live_connections: List[Any] = []
+        # Live sessions admitted, counted from before the handshake so concurrent upgrades cannot overshoot the limit
+        self.live_admitted = 0
+        self.live_lock = threading.Lock()
+        self.running = False
+
+    def start(self) -> "JobServer":
+        self.settings = get_settings()
+        for _ in range(self.worker_count):
+            self._start_worker()
+        self.running = True
+        threading.Thread(target=self._event_loop, name="server-events", daemon=True).start()
+        handler = type("JobRequestHandler", (JobRequestHandler,), {"server_state": self})
+        self.httpd = ThreadingHTTPServer((self.host, self.port), handler)
+        self.port = self.httpd.server_address[1]
+        threading.Thread(target=self.httpd.serve_forever, name="server-http", daemon=True).start()
+        print(f"{NAME}: serving on http://{self.host}:{self.port} with {self.worker_count} worker(s), files in {self.root}")
+        return self
+
+    def stop(self) -> None:
+        self.running = False
+        with self.live_lock:
+            live_connections = list(self.live_connections)
+        for connection in live_connections:
+            connection.websocket.abort()
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+        for worker in self.workers:
+            self.job_queues[worker].put(None)
+        for worker in self.workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
+        self.job_queues.clear()
+        self.assignments.clear()
+
+    def save_upload(self, name: str, stream: Any, length: int) -> dict:
+        extension = os.path.splitext(name)[1].lower()
+        if not re.fullmatch(r"\.[a-z0-9]{1,5}", extension):
+            raise ValueError("the upload name needs a file extension, e.g. ?name=face.jpg")
+        if length > MAX_UPLOAD_SIZE:
+            raise ValueError(f"uploads are limited to {MAX_UPLOAD_SIZE >> 20} MB")
+        upload_id = uuid.uuid4().hex
+        path = os.path.join(self.upload_dir, upload_id + extension)
+        remaining = length
+        with open(path, "wb") as file:
+            while remaining > 0:
+                chunk = stream.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                file.write(chunk)
+                remaining -= len(chunk)
+        if remaining:
+            os.remove(path)
+            raise ValueError("upload ended before Content-Length bytes were received")
+        return {"id": upload_id + extension, "size": length}
+
+    def resolve_file(self, reference: Any) -> str:
+        """An upload id, or a local path when the server allows path references."""
+        if not isinstance(reference, str) or not reference:
+            raise ValueError("source and target must be upload ids or paths")
+        if re.fullmatch(r"[0-9a-f]{32}\.[a-z0-9]{1,5}", reference):
+            path = os.path.join(self.upload_dir, reference)
+            if os.path.isfile(path):
+                # Retention counts from the last use
+                os.utime(path)
+        elif modules.globals.server_allow_paths:
+            path = os.path.abspath(reference)
+        else:
+            raise ValueError(f"unknown upload: {reference}")
+        if not os.path.isfile(path):
+            raise ValueError(f"file not found: {reference}")
+        return path
+
+    def submit(self, request: dict) -> dict:
+        from modules.utilities import is_image, is_video
+
+        options = parse_options(request.get("options") or {})
+        target_path = self.resolve_file(request.get("target"))
+        if not (is_image(target_path) or is_video(target_path)):
+            raise ValueError("target must be an image or a video")
+        # A library face replaces the source image; the server's own --source-id is the fallback
+        source_id = options.get("source_id") or (None if request.get("source") else modules.globals.source_id)
+        if source_id:
+            from modules import face_library
+
+            if face_library.get_entry(source_id) is None:
+                raise ValueError(f"unknown library face: {source_id}")
+            options["source_id"] = source_id
+            source_path = None
+        else:
+            # Cleared explicitly, or the worker would fall back to the server's --source-id
+            options["source_id"] = None
+            source_path = self.resolve_file(request.get("source"))
+            if not is_image(source_path):
+                raise ValueError("source must be an image")
+        job_id = uuid.uuid4().hex[:12]
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "stage": None,
+            "error": None,
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+            "progress": None,
+            "options": options,
+            "source_path": source_path,
+            "target_path": target_path,
+            "output_path": os.path.join(self.result_dir, job_id + os.path.splitext(target_path)[1].lower()),
+            "work_dir": os.path.join(self.work_dir, job_id),
+        }
+        with JOBS_LOCK:
+            JOBS[job_id] = job
+            self.pending.append(job_id)
+            self._dispatch()
+            return public_job(job)
+
+    def add_face(self, request: dict) -> dict:
+        """Stores the face of an uploaded image in the source face library; detection runs in this process."""
+        from modules import face_library
+
+        name = request.get("name")
+        if name is not None and not isinstance(name, str):
+            raise ValueError("name must be a string")
+        return public_face(face_library.add_face(self.resolve_file(request.get("source")), name or None))
+
+    def cancel(self, job_id: str) -> Optional[dict]:
+        with JOBS_LOCK:
+            job = JOBS.get(job_id)
+            if job is None:
+                return None
+            # Only jobs no worker has taken yet can be cancelled
+            if job["status"] == "queued" and job_id in self.pending:
+                self.pending.remove(job_id)
+                job["status"] = "cancelled"
+                job["finished"] = time.time()
+            return public_job(job)
+
+    def admit_live(self) -> bool:
+        """Reserves a live session slot; every admitted upgrade must end with release_live()."""
+        with self.live_lock:
+            limit = modules.globals.server_max_live_sessions
+            if limit and self.live_admitted >= limit:
+                return False
+            self.live_admitted += 1
+            return True
+
+    def release_live(self) -> None:
+        with self.live_lock:
+            self.live_admitted -= 1
+
+    def run_live(self, connection: Any) -> None:
+        """Serves a WebSocket live connection on the calling handler thread until it closes."""
+        with self.live_lock:
+            self.live_connections.append(connection)
+        try:
+            connection.run()
+        finally:
+            with self.live_lock:
+                self.live_connections.remove(connection)
+
+    def get_live_stats(self) -> List[dict]:
+        with self.live_lock:
+            return [connection.get_stats() for connection in self.live_connections]
+
+    def _start_worker(self) -> None:
+        jobs = self.context.Queue()
+        worker = self.context.Process(target=worker_main, args=(self.settings, jobs, self.events), daemon=True)
+        worker.start()
+        self.workers.append(worker)
+        self.job_queues[worker] = jobs
+        self.assignments[worker] = None
+
+    def _dispatch(self) -> None:
+        # Called with JOBS_LOCK held
+        for worker in self.workers:
+            if not self.pending:
+                return
+            if self.assignments[worker] is None:
+                job = JOBS[self.pending.popleft()]
+                self.assignments[worker] = job["id"]
+                self.job_queues[worker].put({key: job[key] for key in ("id", "options", "source_path", "target_path", "output_path", "work_dir")})
+
+    def _release(self, job_id: str) -> None:
+        # Called with JOBS_LOCK held, when a worker reports the end of its job
+        for worker, assigned in self.assignments.items():
+            if assigned == job_id:
+                self.assignments[worker] = None
+
+    def _replace_dead_workers(self) -> None:
+        # Called with JOBS_LOCK held
+        for worker in [worker for worker in self.workers if not worker.is_alive()]:
+            self.workers.remove(worker)
+            self.job_queues.pop(worker).close()
+            print(f"{NAME}: worker {worker.pid} exited with code {worker.exitcode}, starting a new one")
+            # Whether or not it reported "started", the job it was given died with it
+            job = JOBS.get(self.assignments.pop(worker) or "")
+            if job is not None and job["status"] in ("queued", "running"):
+                job["status"], job["finished"], job["error"] = "failed", time.time(), "worker process exited"
+                shutil.rmtree(job["work_dir"], ignore_errors=True)
+            self._start_worker()
+        self._dispatch()
+
+    def _expire(self) -> None:
+        # Called with JOBS_LOCK held
+        if not modules.globals.server_retention:
+            return
+        cutoff = time.time() - modules.globals.server_retention * 3600
+        paths = []
+        for job_id in [job_id for job_id, job in JOBS.items() if job["finished"] is not None and job["finished"] < cutoff]:
+            paths.append(JOBS.pop(job_id)["output_path"])
+        in_use = {path for job in JOBS.values() if job["finished"] is None for path in (job["source_path"], job["target_path"])}
+        for name in os.listdir(self.upload_dir):
+            path = os.path.join(self.upload_dir, name)
+            try:
+                if path not in in_use and os.path.getmtime(path) < cutoff:
+                    paths.append(path)
+            except OSError:
+                pass
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _event_loop(self) -> None:
+        last_check = last_sweep = time.time()
+        while self.running:
+            # Busy workers report progress every frame, so dead workers are looked for on a timer
+            if time.time() - last_check >= WORKER_CHECK_INTERVAL:
+                last_check = time.time()
+                with JOBS_LOCK:
+                    self._replace_dead_workers()
+            if time.time() - last_sweep >= RETENTION_INTERVAL:
+                last_sweep = time.time()
+                with JOBS_LOCK:
+                    self._expire()
+            try:
+                event = self.events.get(timeout=WORKER_CHECK_INTERVAL)
+            except queue.Empty:
+                continue
+            kind, job_id = event[0], event[1]
+            with JOBS_LOCK:
+                job = JOBS.get(job_id)
+                if job is None:
+                    continue
+                if kind == "started" and job["status"] == "queued":
+                    job["status"], job["started"], job["worker"] = "running", time.time(), event[2]
+                elif kind == "status":
+                    job["stage"] = event[2]
+                elif kind == "progress":
+                    index, done, total = event[2:]
+                    started = job["progress"][3] if job["progress"] is not None else time.time()
+                    job["progress"] = (index, done, total, started)
+                elif kind == "done":
+                    job["status"], job["finished"] = "done", time.time()
+                    self._release(job_id)
+                elif kind == "failed":
+                    job["status"], job["finished"], job["error"] = "failed", time.time(), event[2]
+                    self._release(job_id)
+                self._dispatch()
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    server_state: JobServer = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if modules.globals.log_level in ("debug", "verbose", "info"):
+            print(f"{NAME}: {self.address_string()} {format % args}")
+
+    def do_GET(self) -> None:
+        path = urlparse(self.path).path.rstrip("/")
+        if path == "/health":
+            return self.send_json(200, {"status": "ok", "workers": sum(worker.is_alive() for worker in self.server_state.workers)})
+        if path == "/jobs":
+            with JOBS_LOCK:
+                return self.send_json(200, {"jobs": [public_job(job) for job in JOBS.values()]})
+        if path == "/faces" or path.startswith("/faces/"):
+            return self.get_face(path)
+        if path == "/live":
+            if self.headers.get("Upgrade", "").lower() == "websocket":
+                return self.upgrade_live()
+            return self.send_json(200, {"sessions": self.server_state.get_live_stats()})
+        job_id, action = self.match_job(path)
+        if job_id is None:
+            return self.send_json(404, {"error": "not found"})
+        with JOBS_LOCK:
+            job = JOBS.get(job_id)
+            report = public_job(job) if job is not None else None
+        if report is None:
+            return self.send_json(404, {"error": f"unknown job: {job_id}"})
+        if action is None:
+            return self.send_json(200, report)
+        if action == "result":
+            if report["status"] != "done":
+                return self.send_json(409, {"error": f"job is {report['status']}"})
+            return self.send_file(job["output_path"])
+        return self.send_json(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        url = urlparse(self.path)
+        path = url.path.rstrip("/")
+        try:
+            length = self.content_length()
+            if path == "/uploads":
+                name = parse_qs(url.query).get("name", [""])[0]
+                return self.send_json(201, self.server_state.save_upload(name, self.rfile, length))
+            if path == "/faces":
+                return self.send_json(201, self.server_state.add_face(self.read_json(length)))
+            if path == "/jobs":
+                return self.send_json(201, self.server_state.submit(self.read_json(length)))
+        except ValueError as e:
+            # The body may not have been read, so the connection cannot carry another request
+            self.close_connection = True
+            return self.send_json(400, {"error": str(e)})
+        self.send_json(404, {"error": "not found"})
+
+    def content_length(self) -> int:
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            raise ValueError("Content-Length must be a number")
+        if length < 0:
+            raise ValueError("Content-Length must not be negative")
+        return length
+
+    def read_json(self, length: int) -> dict:
+        if length > MAX_JSON_SIZE:
+            raise ValueError(f"JSON bodies are limited to {MAX_JSON_SIZE >> 10} KB")
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            raise ValueError("the request body must be JSON")
+        if not isinstance(request, dict):
+            raise ValueError("the request body must be a JSON object")
+        return request
+
+    def do_DELETE(self) -> None:
+        path = urlparse(self.path).path.rstrip("/")
+        face_id, action = self.match_face(path)
+        if face_id is not None and action is None:
+            from modules import face_library
+
+            if not face_library.remove_face(face_id):
+                return self.send_json(404, {"error": f"unknown library face: {face_id}"})
+            return self.send_json(200, {"id": face_id, "removed": True})
+        job_id, action = self.match_job(path)
+        report = self.server_state.cancel(job_id) if job_id is not None and action is None else None
+        if report is None:
+            return self.send_json(404, {"error": "not found"})
+        self.send_json(200, report)
+
+    def upgrade_live(self) -> None:
+        """Accepts the WebSocket handshake and hands this connection to a live session."""
+        from modules.websocket_live import LiveConnection, WebSocket, accept_key
+
+        key = self.headers.get("Sec-WebSocket-Key")
+        if not key or self.headers.get("Sec-WebSocket-Version") != "13":
+            self.send_response(426)
+            self.send_header("Sec-WebSocket-Version", "13")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if not self.server_state.admit_live():
+            return self.send_json(503, {"error": f"the server already runs {modules.globals.server_max_live_sessions} live sessions"})
+        try:
+            self.send_response(101)
+            self.send_header("Upgrade", "websocket")
+            self.send_header("Connection", "Upgrade")
+            self.send_header("Sec-WebSocket-Accept", accept_key(key))
+            self.end_headers()
+            self.wfile.flush()
+            # The connection belongs to the WebSocket from here on and is closed when it ends
+            self.close_connection = True
+            self.connection.settimeout(None)
+            websocket = WebSocket(self.rfile, self.wfile, self.connection)
+            self.server_state.run_live(LiveConnection(websocket, self.server_state, self.address_string()))
+        finally:
+            self.server_state.release_live()
+
+    def get_face(self, path: str) -> None:
+        from modules import face_library
+
+        if path == "/faces":
+            return self.send_json(200, {"faces": [public_face(entry) for entry in face_library.list_faces()]})
+        face_id, action = self.match_face(path)
+        entry = face_library.get_entry(face_id) if face_id is not None else None
+        if entry is None:
+            return self.send_json(404, {"error": f"unknown library face: {face_id}"})
+        if action is None:
+            return self.send_json(200, public_face(entry))
+        if action == "crop":
+            data = face_library.get_crop(entry["id"])
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            return self.wfile.write(data)
+        return self.send_json(404, {"error": "not found"})
+
+    def match_face(self, path: str) -> Tuple[Optional[str], Optional[str]]:
+        # Faces are addressed by id or by name
+        match = re.fullmatch(r"/faces/([^/]+)(?:/(\w+))?", path)
+        return (unquote(match.group(1)), match.group(2)) if match else (None, None)
+
+    def match_job(self, path: str) -> Tuple[Optional[str], Optional[str]]:
+        match = re.fullmatch(r"/jobs/([0-9a-f]+)(?:/(\w+))?", path)
+        return (match.group(1), match.group(2)) if match else (None, None)
+
+    def send_json(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_file(self, path: str) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(os.path.getsize(path)))
+        self.send_header("Content-Disposition", f'attachment; filename="{os.path.basename(path)}"')
+        self.end_headers()
+        with open(path, "rb") as file:
+            shutil.copyfileobj(file, self.wfile, CHUNK_SIZE)
+
+
+def serve() -> None:
+    """Runs the job server until interrupted."""
+    server = JobServer(modules.globals.server_host, modules.globals.server_port, modules.globals.server_workers).start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
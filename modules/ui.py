@@ -1,10 +1,11 @@
 import os
 import webbrowser
 import customtkinter as ctk
-from typing import Callable, Tuple
+from typing import Callable, Optional, Tuple
 import cv2
 from cv2_enumerate_cameras import enumerate_cameras  # Add this import
 from PIL import Image, ImageOps
+import threading
 import time
 import json
 import modules.globals
@@ -18,6 +19,8 @@ from modules.face_analyser import (
     simplify_maps,
 )
 from modules.capturer import get_video_frame, get_video_frame_total
+from modules.preview_proxy import start_proxy
+from modules.preview_renderer import PREVIEW_RENDERER, schedule_poll
 from modules.processors.frame.core import get_frame_processors_modules
 from modules.utilities import (
     is_image,
@@ -26,6 +29,12 @@ from modules.utilities import (
     has_image_extension,
 )
 from modules.video_capture import VideoCapturer
+from modules.camera_discovery import CAMERA_DISCOVERY
+from modules import face_library
+from modules.live_pipeline import LivePipeline
+from modules.display_sink import DisplaySink
+from modules.live_recorder import LiveRecorder, get_record_path
+from modules.quality_controller import QualityController
 from modules.gettext import LanguageManager
 from modules import globals
 import platform
@@ -68,6 +77,9 @@ RECENT_DIRECTORY_OUTPUT = None
 _ = None
 preview_label = None
 preview_slider = None
+preview_full_button = None
+preview_record_button = None
+LIVE_RECORDER = None
 source_label = None
 target_label = None
 status_label = None
@@ -87,6 +99,7 @@ def init(start: Callable[[], None], destroy: Callable[[], None], lang: str) -> c
     _ = lang_manager._
     ROOT = create_root(start, destroy)
     PREVIEW = create_preview(ROOT)
+    schedule_poll(ROOT, show_preview_result)
 
     return ROOT
 
@@ -326,23 +339,15 @@ def create_root(start: Callable[[], None], destroy: Callable[[], None]) -> ctk.C
     camera_label = ctk.CTkLabel(root, text=_("Select Camera:"))
     camera_label.place(relx=0.1, rely=0.86, relwidth=0.2, relheight=0.05)
 
-    available_cameras = get_available_cameras()
-    camera_indices, camera_names = available_cameras
-
-    if not camera_names or camera_names[0] == "No cameras found":
-        camera_variable = ctk.StringVar(value="No cameras found")
-        camera_optionmenu = ctk.CTkOptionMenu(
-            root,
-            variable=camera_variable,
-            values=["No cameras found"],
-            state="disabled",
-        )
-    else:
-        camera_variable = ctk.StringVar(value=camera_names[0])
-        camera_optionmenu = ctk.CTkOptionMenu(
-            root, variable=camera_variable, values=camera_names
-        )
-
+    # Filled in by show_cameras once background discovery finishes
+    camera_indices, camera_names = [], []
+    camera_variable = ctk.StringVar(value=_("Searching for cameras..."))
+    camera_optionmenu = ctk.CTkOptionMenu(
+        root,
+        variable=camera_variable,
+        values=[camera_variable.get()],
+        state="disabled",
+    )
     camera_optionmenu.place(relx=0.35, rely=0.86, relwidth=0.25, relheight=0.05)
 
     live_button = ctk.CTkButton(
@@ -353,16 +358,30 @@ def create_root(start: Callable[[], None], destroy: Callable[[], None]) -> ctk.C
             root,
             (
                 camera_indices[camera_names.index(camera_variable.get())]
-                if camera_names and camera_names[0] != "No cameras found"
+                if camera_variable.get() in camera_names
                 else None
             ),
         ),
-        state=(
-            "normal"
-            if camera_names and camera_names[0] != "No cameras found"
-            else "disabled"
-        ),
+        state="disabled",
     )
+
+    def show_cameras() -> None:
+        cameras = CAMERA_DISCOVERY.get_cameras()
+        if cameras is None:
+            root.after(200, show_cameras)
+            return
+        camera_indices[:] = [camera.index for camera in cameras]
+        camera_names[:] = [camera.name for camera in cameras]
+        if not camera_names:
+            camera_variable.set("No cameras found")
+            camera_optionmenu.configure(values=["No cameras found"])
+            return
+        camera_variable.set(camera_names[0])
+        camera_optionmenu.configure(values=camera_names, state="normal")
+        live_button.configure(state="normal")
+
+    CAMERA_DISCOVERY.start()
+    show_cameras()
     live_button.place(relx=0.65, rely=0.86, relwidth=0.2, relheight=0.05)
     # --- End Camera Selection ---
 
@@ -571,7 +590,7 @@ def update_popup_source(
         return map
     else:
         cv2_img = cv2.imread(source_path)
-        face = get_one_face(cv2_img)
+        face = face_library.load_face(source_path, cv2_img)
 
         if face:
             x_min, y_min, x_max, y_max = face["bbox"]
@@ -604,7 +623,7 @@ def update_popup_source(
 
 
 def create_preview(parent: ctk.CTkToplevel) -> ctk.CTkToplevel:
-    global preview_label, preview_slider
+    global preview_label, preview_slider, preview_full_button, preview_record_button
 
     preview = ctk.CTkToplevel(parent)
     preview.withdraw()
@@ -620,6 +639,15 @@ def create_preview(parent: ctk.CTkToplevel) -> ctk.CTkToplevel:
         preview, from_=0, to=0, command=lambda frame_value: update_preview(frame_value)
     )
 
+    preview_full_button = ctk.CTkButton(
+        preview,
+        text=_("Full resolution"),
+        cursor="hand2",
+        command=lambda: update_preview(preview_slider.get(), full_resolution=True),
+    )
+
+    preview_record_button = ctk.CTkButton(preview, text=_("Record"), cursor="hand2")
+
     return preview
 
 
@@ -651,6 +679,7 @@ def select_source_path() -> None:
     global RECENT_DIRECTORY_SOURCE, img_ft, vid_ft
 
     PREVIEW.withdraw()
+    PREVIEW_RENDERER.cancel()
     source_path = ctk.filedialog.askopenfilename(
         title=_("select an source image"),
         initialdir=RECENT_DIRECTORY_SOURCE,
@@ -682,6 +711,7 @@ def swap_faces_paths() -> None:
     RECENT_DIRECTORY_TARGET = os.path.dirname(modules.globals.target_path)
 
     PREVIEW.withdraw()
+    PREVIEW_RENDERER.cancel()
 
     source_image = render_image_preview(modules.globals.source_path, (200, 200))
     source_label.configure(image=source_image)
@@ -694,6 +724,7 @@ def select_target_path() -> None:
     global RECENT_DIRECTORY_TARGET, img_ft, vid_ft
 
     PREVIEW.withdraw()
+    PREVIEW_RENDERER.cancel()
     target_path = ctk.filedialog.askopenfilename(
         title=_("select an target image or video"),
         initialdir=RECENT_DIRECTORY_TARGET,
@@ -766,7 +797,11 @@ def check_and_ignore_nsfw(target, destroy: Callable = None) -> bool:
 def fit_image_to_size(image, width: int, height: int):
     if width is None and height is None:
         return image
-    h, w, _ = image.shape
+    return cv2.resize(image, dsize=get_fit_size(image.shape, width, height))
+
+
+def get_fit_size(shape: Tuple[int, ...], width: int, height: int) -> Tuple[int, int]:
+    h, w = shape[:2]
     ratio_h = 0.0
     ratio_w = 0.0
     if width > height:
@@ -774,8 +809,7 @@ def fit_image_to_size(image, width: int, height: int):
     else:
         ratio_w = width / w
     ratio = max(ratio_w, ratio_h)
-    new_size = (int(ratio * w), int(ratio * h))
-    return cv2.resize(image, dsize=new_size)
+    return (int(ratio * w), int(ratio * h))
 
 
 def render_image_preview(image_path: str, size: Tuple[int, int]) -> ctk.CTkImage:
@@ -804,6 +838,7 @@ def render_video_preview(
 def toggle_preview() -> None:
     if PREVIEW.state() == "normal":
         PREVIEW.withdraw()
+        PREVIEW_RENDERER.cancel()
     elif modules.globals.source_path and modules.globals.target_path:
         init_preview()
         update_preview()
@@ -812,33 +847,42 @@ def toggle_preview() -> None:
 def init_preview() -> None:
     if is_image(modules.globals.target_path):
         preview_slider.pack_forget()
+        preview_full_button.pack_forget()
     if is_video(modules.globals.target_path):
         video_frame_total = get_video_frame_total(modules.globals.target_path)
         preview_slider.configure(to=video_frame_total)
         preview_slider.pack(fill="x")
         preview_slider.set(0)
+        if modules.globals.preview_proxy:
+            start_proxy(modules.globals.target_path)
+            preview_full_button.pack(pady=5)
+        else:
+            preview_full_button.pack_forget()
 
 
-def update_preview(frame_number: int = 0) -> None:
+def update_preview(frame_number: int = 0, full_resolution: bool = False) -> None:
     if modules.globals.source_path and modules.globals.target_path:
         update_status("Processing...")
-        temp_frame = get_video_frame(modules.globals.target_path, frame_number)
-        if modules.globals.nsfw_filter and check_and_ignore_nsfw(temp_frame):
-            return
-        for frame_processor in get_frame_processors_modules(
-                modules.globals.frame_processors
-        ):
-            temp_frame = frame_processor.process_frame(
-                get_one_face(cv2.imread(modules.globals.source_path)), temp_frame
-            )
-        image = Image.fromarray(cv2.cvtColor(temp_frame, cv2.COLOR_BGR2RGB))
-        image = ImageOps.contain(
-            image, (PREVIEW_MAX_WIDTH, PREVIEW_MAX_HEIGHT), Image.LANCZOS
-        )
-        image = ctk.CTkImage(image, size=image.size)
-        preview_label.configure(image=image)
+        PREVIEW_RENDERER.submit(frame_number, full_resolution)
+
+
+def show_preview_result(result: dict) -> None:
+    """Runs on the Tk thread with the newest pass finished by the preview renderer."""
+    if result.get("nsfw"):
+        update_status("Processing ignored!")
+        return
+    if result["frame"] is None:
+        update_status(result.get("error", "Processing failed!"))
+        return
+    image = Image.fromarray(cv2.cvtColor(result["frame"], cv2.COLOR_BGR2RGB))
+    image = ImageOps.contain(
+        image, (PREVIEW_MAX_WIDTH, PREVIEW_MAX_HEIGHT), Image.LANCZOS
+    )
+    image = ctk.CTkImage(image, size=image.size)
+    preview_label.configure(image=image)
+    if result["final"]:
         update_status("Processing succeed!")
-        PREVIEW.deiconify()
+    PREVIEW.deiconify()
 
 
 def webcam_preview(root: ctk.CTk, camera_index: int):
@@ -850,7 +894,7 @@ def webcam_preview(root: ctk.CTk, camera_index: int):
         return
 
     if not modules.globals.map_faces:
-        if modules.globals.source_path is None:
+        if modules.globals.source_path is None and not modules.globals.source_id:
             update_status("Please select a source image first")
             return
         create_webcam_preview(camera_index)
@@ -861,77 +905,6 @@ def webcam_preview(root: ctk.CTk, camera_index: int):
         )
 
 
-
-def get_available_cameras():
-    """Returns a list of available camera names and indices."""
-    if platform.system() == "Windows":
-        try:
-            graph = FilterGraph()
-            devices = graph.get_input_devices()
-
-            # Create list of indices and names
-            camera_indices = list(range(len(devices)))
-            camera_names = devices
-
-            # If no cameras found through DirectShow, try OpenCV fallback
-            if not camera_names:
-                # Try to open camera with index -1 and 0
-                test_indices = [-1, 0]
-                working_cameras = []
-
-                for idx in test_indices:
-                    cap = cv2.VideoCapture(idx)
-                    if cap.isOpened():
-                        working_cameras.append(f"Camera {idx}")
-                        cap.release()
-
-                if working_cameras:
-                    return test_indices[: len(working_cameras)], working_cameras
-
-            # If still no cameras found, return empty lists
-            if not camera_names:
-                return [], ["No cameras found"]
-
-            return camera_indices, camera_names
-
-        except Exception as e:
-            print(f"Error detecting cameras: {str(e)}")
-            return [], ["No cameras found"]
-    else:
-        # Unix-like systems (Linux/Mac) camera detection
-        camera_indices = []
-        camera_names = []
-
-        if platform.system() == "Darwin":  # macOS specific handling
-            # Try to open the default FaceTime camera first
-            cap = cv2.VideoCapture(0)
-            if cap.isOpened():
-                camera_indices.append(0)
-                camera_names.append("FaceTime Camera")
-                cap.release()
-
-            # On macOS, additional cameras typically use indices 1 and 2
-            for i in [1, 2]:
-                cap = cv2.VideoCapture(i)
-                if cap.isOpened():
-                    camera_indices.append(i)
-                    camera_names.append(f"Camera {i}")
-                    cap.release()
-        else:
-            # Linux camera detection - test first 10 indices
-            for i in range(10):
-                cap = cv2.VideoCapture(i)
-                if cap.isOpened():
-                    camera_indices.append(i)
-                    camera_names.append(f"Camera {i}")
-                    cap.release()
-
-        if not camera_names:
-            return [], ["No cameras found"]
-
-        return camera_indices, camera_names
-
-
 def create_webcam_preview(camera_index: int):
     global preview_label, PREVIEW
 
@@ -945,49 +918,52 @@ def create_webcam_preview(camera_index: int):
 
     frame_processors = get_frame_processors_modules(modules.globals.frame_processors)
     source_image = None
+    if not modules.globals.map_faces:
+        source_image = face_library.get_source_face(modules.globals.source_path)
+    if modules.globals.map_faces:
+        modules.globals.target_path = None
+
+    # Frames are processed at camera resolution and only fitted to the window for display
+    pipeline = LivePipeline(
+        cap,
+        frame_processors,
+        source_face=source_image,
+        latency_target=modules.globals.live_latency_target / 1000,
+        async_detection=modules.globals.live_async_detection,
+        quality_controller=QualityController(
+            modules.globals.live_target_fps, modules.globals.live_latency_target / 1000
+        ) if modules.globals.live_quality_control else None,
+        # DisplaySink fits frames to the window, so they are not scaled back to camera size first
+        restore_size=False,
+    ).start()
+
+    preview_record_button.configure(text=_("Record"), command=lambda: toggle_live_recording(cap.get_fps()))
+    preview_record_button.pack(pady=5)
+    if modules.globals.live_record_path:
+        toggle_live_recording(cap.get_fps(), modules.globals.live_record_path)
+
+    display_sink = DisplaySink(preview_label)
     prev_time = time.time()
     fps_update_interval = 0.5
     frame_count = 0
     fps = 0
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
+    while pipeline.running:
+        ROOT.update()
+        if PREVIEW.state() == "withdrawn":
             break
-
-        temp_frame = frame.copy()
-
-        if modules.globals.live_mirror:
-            temp_frame = cv2.flip(temp_frame, 1)
-
-        if modules.globals.live_resizable:
-            temp_frame = fit_image_to_size(
-                temp_frame, PREVIEW.winfo_width(), PREVIEW.winfo_height()
-            )
-
-        else:
-            temp_frame = fit_image_to_size(
-                temp_frame, PREVIEW.winfo_width(), PREVIEW.winfo_height()
-            )
-
-        if not modules.globals.map_faces:
-            if source_image is None and modules.globals.source_path:
-                source_image = get_one_face(cv2.imread(modules.globals.source_path))
-
-            for frame_processor in frame_processors:
-                if frame_processor.NAME == "DLC.FACE-ENHANCER":
-                    if modules.globals.fp_ui["face_enhancer"]:
-                        temp_frame = frame_processor.process_frame(None, temp_frame)
-                else:
-                    temp_frame = frame_processor.process_frame(source_image, temp_frame)
-        else:
-            modules.globals.target_path = None
-            for frame_processor in frame_processors:
-                if frame_processor.NAME == "DLC.FACE-ENHANCER":
-                    if modules.globals.fp_ui["face_enhancer"]:
-                        temp_frame = frame_processor.process_frame_v2(temp_frame)
-                else:
-                    temp_frame = frame_processor.process_frame_v2(temp_frame)
+        live_frame = pipeline.get_frame(timeout=0.005)
+        if live_frame is None:
+            continue
+        temp_frame = live_frame.frame
+        if LIVE_RECORDER is not None:
+            # Queued for the encoder thread; copied only when the FPS overlay is drawn onto it below.
+            # Recordings keep the camera size even while the quality controller reduces the scale.
+            if (temp_frame.shape[1], temp_frame.shape[0]) != live_frame.display_size:
+                record_frame = cv2.resize(temp_frame, live_frame.display_size, interpolation=cv2.INTER_LINEAR)
+            else:
+                record_frame = temp_frame.copy() if modules.globals.show_fps else temp_frame
+            LIVE_RECORDER.write(record_frame, live_frame.captured_at)
 
         # Calculate and display FPS
         current_time = time.time()
@@ -1008,20 +984,54 @@ def create_webcam_preview(camera_index: int):
                 2,
             )
 
-        image = cv2.cvtColor(temp_frame, cv2.COLOR_BGR2RGB)
-        image = Image.fromarray(image)
-        image = ImageOps.contain(
-            image, (temp_frame.shape[1], temp_frame.shape[0]), Image.LANCZOS
-        )
-        image = ctk.CTkImage(image, size=image.size)
-        preview_label.configure(image=image)
-        ROOT.update()
-
-        if PREVIEW.state() == "withdrawn":
-            break
+        display_sink.show(temp_frame, get_fit_size(temp_frame.shape, PREVIEW.winfo_width(), PREVIEW.winfo_height()))
 
+    if LIVE_RECORDER is not None:
+        toggle_live_recording(0)
+    preview_record_button.pack_forget()
+    pipeline.stop()
     cap.release()
     PREVIEW.withdraw()
+    PREVIEW_RENDERER.cancel()
+
+
+def toggle_live_recording(fps: float, path: Optional[str] = None) -> None:
+    """
+    Starts or stops recording the processed live preview in the background.
+    Without a path every take gets a new name, next to --live-record or the
+    output path if one is set.
+    """
+    global LIVE_RECORDER
+
+    if LIVE_RECORDER is not None:
+        finish_live_recording(LIVE_RECORDER)
+        LIVE_RECORDER = None
+        preview_record_button.configure(text=_("Record"))
+        return
+    if path is None:
+        directory = os.path.dirname(modules.globals.live_record_path or modules.globals.output_path or "")
+        path = get_record_path(directory or None)
+    LIVE_RECORDER = LiveRecorder(path, fps, modules.globals.live_record_audio)
+    preview_record_button.configure(text=_("Stop recording"))
+
+
+def finish_live_recording(recorder: LiveRecorder) -> None:
+    """Lets ffmpeg finish the file on its own thread, so the preview keeps running, and reports the outcome."""
+    # Not a daemon: quitting while ffmpeg finishes must not truncate the file
+    thread = threading.Thread(target=recorder.stop, name="live-recorder-close")
+    thread.start()
+
+    def report() -> None:
+        if thread.is_alive():
+            ROOT.after(200, report)
+        elif recorder.sink is None:
+            update_status("Recording stopped before any frame was recorded")
+        elif recorder.sink.error is not None:
+            update_status(f"Recording failed: {recorder.sink.error}")
+        else:
+            update_status(f"Recording saved to {recorder.path}")
+
+    ROOT.after(200, report)
 
 
 def create_source_target_popup_for_webcam(
@@ -1186,7 +1196,7 @@ def update_webcam_source(
         return map
     else:
         cv2_img = cv2.imread(source_path)
-        face = get_one_face(cv2_img)
+        face = face_library.load_face(source_path, cv2_img)
 
         if face:
             x_min, y_min, x_max, y_max = face["bbox"]
@@ -1,4 +1,5 @@
 import glob
+import json
 import mimetypes
 import os
 import platform
@@ -7,10 +8,12 @@ import ssl
 import subprocess
 import urllib
 from pathlib import Path
-from typing import List, Any
+from typing import List, Any, Iterator, Tuple
 from tqdm import tqdm
+import numpy as np
 
 import modules.globals
+from modules import probe_cache
 
 TEMP_FILE = "temp.mp4"
 TEMP_DIRECTORY = "temp"
@@ -20,6 +23,13 @@ if platform.system().lower() == "darwin":
     ssl._create_default_https_context = ssl._create_unverified_context
 
 
+def get_quality_args(encoder: str, quality: int) -> List[str]:
+    """ffmpeg options for constant quality; libvpx-vp9 only honours -crf with the bitrate cap lifted."""
+    if encoder == "libvpx-vp9":
+        return ["-crf", str(quality), "-b:v", "0"]
+    return ["-crf", str(quality)]
+
+
 def run_ffmpeg(args: List[str]) -> bool:
     commands = [
         "ffmpeg",
@@ -38,7 +48,16 @@ def run_ffmpeg(args: List[str]) -> bool:
     return False
 
 
-def detect_fps(target_path: str) -> float:
+def probe_video(target_path: str) -> dict:
+    """
+    Reads fps, resolution, duration and (when the container knows it) frame
+    count with a single ffprobe call. Results are kept in the probe cache, so
+    a target that was seen before is not probed again.
+    """
+    entry = probe_cache.get_entry(target_path)
+    if all(name in entry for name in ("fps", "width", "height", "duration")):
+        return entry
+
     command = [
         "ffprobe",
         "-v",
@@ -46,20 +65,126 @@ def detect_fps(target_path: str) -> float:
         "-select_streams",
         "v:0",
         "-show_entries",
-        "stream=r_frame_rate",
+        "stream=r_frame_rate,width,height,nb_frames,duration:stream_tags=rotate:stream_side_data=rotation:format=duration",
         "-of",
-        "default=noprint_wrappers=1:nokey=1",
+        "json",
         target_path,
     ]
-    output = subprocess.check_output(command).decode().strip().split("/")
+    output = json.loads(subprocess.check_output(command).decode())
+    stream = output["streams"][0]
+    probe = {"fps": 30.0}
     try:
-        numerator, denominator = map(int, output)
-        return numerator / denominator
+        numerator, denominator = map(int, stream["r_frame_rate"].split("/"))
+        probe["fps"] = numerator / denominator
     except Exception:
         pass
+    width, height = int(stream["width"]), int(stream["height"])
+    rotation = stream.get("tags", {}).get("rotate", 0)
+    for side_data in stream.get("side_data_list", []):
+        rotation = side_data.get("rotation", rotation)
+    # ffmpeg autorotates on decode, so portrait phone videos come out transposed
+    if abs(int(float(rotation))) % 180 == 90:
+        width, height = height, width
+    probe["width"], probe["height"] = width, height
+    try:
+        probe["duration"] = float(stream.get("duration") or output.get("format", {})["duration"])
+    except (KeyError, TypeError, ValueError):
+        probe["duration"] = 0.0
+    if str(stream.get("nb_frames", "")).isdigit():
+        probe["frame_total"] = int(stream["nb_frames"])
+
+    probe_cache.set_values(target_path, **probe)
+    entry.update(probe)
+    return entry
+
+
+def detect_fps(target_path: str) -> float:
+    try:
+        return float(probe_video(target_path)["fps"])
+    except (KeyError, IndexError, ValueError):
+        pass
     return 30.0
 
 
+def get_video_dimensions(target_path: str) -> Tuple[int, int]:
+    probe = probe_video(target_path)
+    return int(probe["width"]), int(probe["height"])
+
+
+def get_keyframe_times(target_path: str) -> List[float]:
+    """Timestamps (seconds) of the video's keyframes, read from packet flags without decoding."""
+    keyframes = probe_cache.get_value(target_path, "keyframes")
+    if keyframes is not None:
+        return keyframes
+    command = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-select_streams",
+        "v:0",
+        "-show_entries",
+        "packet=pts_time,flags",
+        "-of",
+        "csv=p=0",
+        target_path,
+    ]
+    keyframes = []
+    for line in subprocess.check_output(command).decode().splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags:
+            try:
+                keyframes.append(float(pts_time))
+            except ValueError:
+                continue
+    keyframes.sort()
+    probe_cache.set_values(target_path, keyframes=keyframes)
+    return keyframes
+
+
+def stream_frames(target_path: str) -> Iterator[np.ndarray]:
+    """
+    Decodes the target through an ffmpeg rawvideo pipe and yields BGR frames.
+    Uses the same decoder settings as extract_frames, so frame n of the
+    stream is the frame extract_frames writes as n+1 (%04d.png).
+    """
+    width, height = get_video_dimensions(target_path)
+    frame_size = width * height * 3
+    commands = [
+        "ffmpeg",
+        "-hide_banner",
+        "-hwaccel",
+        "auto",
+        "-loglevel",
+        modules.globals.log_level,
+        "-i",
+        target_path,
+        "-f",
+        "rawvideo",
+        "-pix_fmt",
+        "bgr24",
+        "pipe:1",
+    ]
+    process = subprocess.Popen(commands, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            buffer = bytearray(frame_size)
+            view = memoryview(buffer)
+            received = 0
+            while received < frame_size:
+                count = process.stdout.readinto(view[received:])
+                if not count:
+                    break
+                received += count
+            if received < frame_size:
+                break
+            yield np.frombuffer(buffer, dtype=np.uint8).reshape(height, width, 3)
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+
+
 def extract_frames(target_path: str) -> None:
     temp_directory_path = get_temp_directory_path(target_path)
     run_ffmpeg(
@@ -84,8 +209,7 @@ def create_video(target_path: str, fps: float = 30.0) -> None:
             os.path.join(temp_directory_path, "%04d.png"),
             "-c:v",
             modules.globals.video_encoder,
-            "-crf",
-            str(modules.globals.video_quality),
+            *get_quality_args(modules.globals.video_encoder, modules.globals.video_quality),
             "-pix_fmt",
             "yuv420p",
             "-vf",
@@ -118,6 +242,11 @@ def restore_audio(target_path: str, output_path: str) -> None:
         move_temp(target_path, output_path)
 
 
+def get_temp_frame_path(target_path: str, frame_index: int) -> str:
+    """Path extract_frames uses for the zero-based frame_index."""
+    return os.path.join(get_temp_directory_path(target_path), "%04d.png" % (frame_index + 1))
+
+
 def get_temp_frame_paths(target_path: str) -> List[str]:
     temp_directory_path = get_temp_directory_path(target_path)
     return glob.glob((os.path.join(glob.escape(temp_directory_path), "*.png")))
@@ -1,25 +1,66 @@
+import os
 import cv2
 import numpy as np
-from typing import Optional, Tuple, Callable
+from collections import deque
+from typing import Optional, Tuple, Callable, Union
 import platform
 import threading
+import time
+from modules.camera_discovery import CAMERA_DISCOVERY
 
 # Only import Windows-specific library if on Windows
 if platform.system() == "Windows":
     from pygrabber.dshow_graph import FilterGraph
 
 
+# Give up on a stream that stays silent this long, so reconnecting can start
+STREAM_TIMEOUT_MSEC = 5000
+MAX_RECONNECT_DELAY = 5.0
+
+
 class VideoCapturer:
-    def __init__(self, device_index: int):
+    def __init__(
+        self,
+        device_index: Union[int, str],
+        loop: bool = False,
+        realtime: bool = True,
+        jitter_buffer: int = 3,
+        reconnect_attempts: int = 10,
+        reconnect_delay: float = 0.5,
+    ):
+        # A camera index, or a video file path / stream URL read through ffmpeg
         self.device_index = device_index
+        self.is_camera = isinstance(device_index, int)
+        self.is_file = not self.is_camera and os.path.isfile(device_index)
+        self.is_stream = not self.is_camera and not self.is_file
+        # Files and streams: loop files at the end, pace files at their own frame
+        # rate, how many decoded frames to hold back, how to retry dropped streams
+        self.loop = loop
+        self.realtime = realtime
+        self.jitter_buffer = max(1, jitter_buffer)
+        self.reconnect_attempts = reconnect_attempts
+        self.reconnect_delay = reconnect_delay
+        self._buffer = deque()
+        self._buffer_condition = threading.Condition()
+        self._decode_thread = None
+        self._decode_finished = False
+        self.reconnects = 0
         self.frame_callback = None
         self._current_frame = None
         self._frame_ready = threading.Event()
+        self._frame_lock = threading.Lock()
+        self._capture_thread = None
+        self._frame_timestamp = 0.0
+        self._frame_sequence = 0
+        self._consumed_sequence = 0
+        self.threaded = False
+        self.captured_frames = 0
+        self.dropped_frames = 0
         self.is_running = False
         self.cap = None
 
         # Initialize Windows-specific components if on Windows
-        if platform.system() == "Windows":
+        if platform.system() == "Windows" and self.is_camera:
             self.graph = FilterGraph()
             # Verify device exists
             devices = self.graph.get_input_devices()
@@ -28,10 +69,16 @@ class VideoCapturer:
                     f"Invalid device index {device_index}. Available devices: {len(devices)}"
                 )
 
-    def start(self, width: int = 960, height: int = 540, fps: int = 60) -> bool:
-        """Initialize and start video capture"""
+    def start(self, width: int = 960, height: int = 540, fps: int = 60, threaded: bool = True) -> bool:
+        """
+        Initialize and start video capture. When threaded, a background thread
+        keeps reading the camera so the driver buffer never backs up, and only
+        the newest frame is kept for read().
+        """
         try:
-            if platform.system() == "Windows":
+            if not self.is_camera:
+                self.cap = self._open_source()
+            elif platform.system() == "Windows":
                 # Windows-specific capture methods
                 capture_methods = [
                     (self.device_index, cv2.CAP_DSHOW),  # Try DirectShow first
@@ -53,14 +100,36 @@ class VideoCapturer:
                 self.cap = cv2.VideoCapture(self.device_index)
 
             if not self.cap or not self.cap.isOpened():
-                raise RuntimeError("Failed to open camera")
+                raise RuntimeError("Failed to open camera" if self.is_camera else f"Failed to open {self.device_index}")
 
             # Configure format
-            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
-            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
-            self.cap.set(cv2.CAP_PROP_FPS, fps)
+            if self.is_camera:
+                # Prefer the probed mode that covers the request with the cheapest decode
+                mode = CAMERA_DISCOVERY.get_mode(self.device_index, width, height, fps)
+                if mode is not None:
+                    # A mode read back from an unusual driver may not carry a real four-character code
+                    if len(mode.fourcc) == 4:
+                        self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*mode.fourcc))
+                    width, height = mode.width, mode.height
+                    fps = int(mode.fps) or fps
+                self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+                self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+                self.cap.set(cv2.CAP_PROP_FPS, fps)
 
             self.is_running = True
+            # Files and streams are always decoded on their own thread and paced out of the jitter buffer
+            self.threaded = threaded or not self.is_camera
+            if self.threaded:
+                self._frame_ready.clear()
+                if self.is_camera:
+                    self._capture_thread = threading.Thread(target=self._capture_loop, daemon=True)
+                else:
+                    self._buffer.clear()
+                    self._decode_finished = False
+                    self._decode_thread = threading.Thread(target=self._decode_loop, daemon=True)
+                    self._decode_thread.start()
+                    self._capture_thread = threading.Thread(target=self._pace_loop, daemon=True)
+                self._capture_thread.start()
             return True
 
         except Exception as e:
@@ -69,24 +138,192 @@ class VideoCapturer:
                 self.cap.release()
             return False
 
-    def read(self) -> Tuple[bool, Optional[np.ndarray]]:
-        """Read a frame from the camera"""
-        if not self.is_running or self.cap is None:
-            return False, None
+    def _open_source(self) -> cv2.VideoCapture:
+        if self.is_stream and hasattr(cv2, "CAP_PROP_OPEN_TIMEOUT_MSEC"):
+            return cv2.VideoCapture(
+                self.device_index,
+                cv2.CAP_FFMPEG,
+                [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, STREAM_TIMEOUT_MSEC, cv2.CAP_PROP_READ_TIMEOUT_MSEC, STREAM_TIMEOUT_MSEC],
+            )
+        return cv2.VideoCapture(self.device_index)
 
-        ret, frame = self.cap.read()
-        if ret:
+    def _publish(self, frame: np.ndarray) -> None:
+        with self._frame_lock:
+            # The previous frame was never handed out, so it is dropped
+            if self._frame_sequence > self._consumed_sequence:
+                self.dropped_frames += 1
             self._current_frame = frame
-            if self.frame_callback:
-                self.frame_callback(frame)
-            return True, frame
-        return False, None
+            self._frame_timestamp = time.time()
+            self._frame_sequence += 1
+            self.captured_frames += 1
+        self._frame_ready.set()
+
+    def _capture_loop(self) -> None:
+        while self.is_running:
+            ret, frame = self.cap.read()
+            if not ret:
+                break
+            self._publish(frame)
+        self.is_running = False
+        self._frame_ready.set()
+
+    def _decode_loop(self) -> None:
+        """Decodes a file or stream into the jitter buffer, looping files and reconnecting streams."""
+        failures = 0
+        while self.is_running:
+            ret, frame = self.cap.read()
+            if ret:
+                failures = 0
+                with self._buffer_condition:
+                    if self.is_file:
+                        # Files can wait for the pacer, so no frame of the recording is lost
+                        while self.is_running and len(self._buffer) >= self.jitter_buffer:
+                            self._buffer_condition.wait(0.1)
+                    elif len(self._buffer) >= self.jitter_buffer:
+                        # A live stream cannot wait; the oldest buffered frame gives way
+                        self._buffer.popleft()
+                        self.dropped_frames += 1
+                    self._buffer.append(frame)
+                    self._buffer_condition.notify_all()
+                continue
+
+            if self.is_file:
+                if not self.loop:
+                    break
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                failures += 1
+                if failures > 1:  # nothing decodes even from the start
+                    break
+                continue
+
+            failures += 1
+            if self.reconnect_attempts and failures > self.reconnect_attempts:
+                print(f"Video capture: giving up on {self.device_index} after {self.reconnect_attempts} reconnect attempts")
+                break
+            delay = min(self.reconnect_delay * 2 ** (failures - 1), MAX_RECONNECT_DELAY)
+            print(f"Video capture: lost {self.device_index}, reconnecting in {delay:.1f}s")
+            time.sleep(delay)
+            if not self.is_running:
+                break
+            self.cap.release()
+            self.cap = self._open_source()
+            self.reconnects += 1
+        with self._buffer_condition:
+            self._decode_finished = True
+            self._buffer_condition.notify_all()
+
+    def _pace_loop(self) -> None:
+        """
+        Hands buffered frames to readers. Files are released at their own
+        frame rate as if they came from a camera; streams first fill the
+        jitter buffer and are then released at the source rate, speeding up
+        while the buffer runs over so latency does not build up.
+        """
+        interval = 1.0 / self.get_fps()
+        next_release = None
+        while self.is_running:
+            with self._buffer_condition:
+                if next_release is None and self.is_stream:
+                    # (Re)fill the jitter buffer before playback starts
+                    while self.is_running and not self._decode_finished and len(self._buffer) < self.jitter_buffer:
+                        self._buffer_condition.wait(0.1)
+                while self.is_running and not self._buffer and not self._decode_finished:
+                    self._buffer_condition.wait(0.1)
+                if not self._buffer:
+                    if self._decode_finished:
+                        break
+                    continue
+                frame = self._buffer.popleft()
+                backlog = len(self._buffer)
+                self._buffer_condition.notify_all()
+
+            now = time.time()
+            if next_release is None:
+                next_release = now
+            # A stream whose buffer is still full after this frame is running late and skips the wait
+            catching_up = self.is_stream and backlog > 0 and backlog >= self.jitter_buffer - 1
+            if (self.realtime or self.is_stream) and not catching_up and next_release > now:
+                time.sleep(next_release - now)
+            # After a stall the schedule restarts instead of bursting to catch up
+            next_release = max(next_release + interval, time.time() - interval)
+            self._publish(frame)
+            if self.is_stream and backlog == 0:
+                next_release = None
+        self.is_running = False
+        self._frame_ready.set()
+
+    def read(self, wait_for_new: bool = False, timeout: float = 5.0) -> Tuple[bool, Optional[np.ndarray]]:
+        """
+        Read a frame from the camera. In threaded mode this returns the newest
+        captured frame without blocking; it only waits for the very first
+        frame, or for a newer one when wait_for_new is set.
+        """
+        if not self.threaded:
+            if not self.is_running or self.cap is None:
+                return False, None
+            ret, frame = self.cap.read()
+            if ret:
+                self._current_frame = frame
+                if self.frame_callback:
+                    self.frame_callback(frame)
+                return True, frame
+            return False, None
+
+        ret, frame, _, _ = self.read_latest(wait_for_new, timeout)
+        return ret, frame
+
+    def read_latest(self, wait_for_new: bool = False, timeout: float = 5.0) -> Tuple[bool, Optional[np.ndarray], float, int]:
+        """Threaded read returning (ret, frame, capture timestamp, sequence number)."""
+        deadline = time.time() + timeout
+        while True:
+            with self._frame_lock:
+                frame = self._current_frame
+                sequence = self._frame_sequence
+                fresh = sequence > self._consumed_sequence
+                if frame is not None and (fresh or (not wait_for_new and self.is_running)):
+                    self._consumed_sequence = sequence
+                    timestamp = self._frame_timestamp
+                    break
+                # Cleared under the lock so a frame published after this check still wakes us
+                self._frame_ready.clear()
+            if not self.is_running or time.time() >= deadline:
+                return False, None, 0.0, 0
+            self._frame_ready.wait(max(0.0, deadline - time.time()))
+        if self.frame_callback:
+            self.frame_callback(frame)
+        return True, frame, timestamp, sequence
+
+    def get_fps(self, default: float = 30.0) -> float:
+        """Frame rate reported by the source, or default when it reports none."""
+        fps = self.cap.get(cv2.CAP_PROP_FPS) if self.cap is not None else 0
+        # Some streams report their timebase (e.g. 90000) instead of a frame rate
+        return fps if fps and 0 < fps <= 240 else default
+
+    def get_stats(self) -> dict:
+        with self._frame_lock:
+            return {
+                "captured": self.captured_frames,
+                "dropped": self.dropped_frames,
+                "sequence": self._frame_sequence,
+                "age": time.time() - self._frame_timestamp if self._frame_timestamp else None,
+                "buffered": len(self._buffer),
+                "reconnects": self.reconnects,
+            }
 
     def release(self) -> None:
         """Stop capture and release resources"""
-        if self.is_running and self.cap is not None:
-            self.cap.release()
+        if self.cap is not None:
             self.is_running = False
+            with self._buffer_condition:
+                self._buffer_condition.notify_all()
+            if self._capture_thread is not None:
+                self._capture_thread.join(timeout=2)
+                self._capture_thread = None
+            if self._decode_thread is not None:
+                # A stream read can block until its timeout; the capture must not be released under it
+                self._decode_thread.join(timeout=STREAM_TIMEOUT_MSEC / 1000 + 1)
+                self._decode_thread = None
+            self.cap.release()
             self.cap = None
 
     def set_frame_callback(self, callback: Callable[[np.ndarray], None]) -> None:
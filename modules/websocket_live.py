@@ -0,0 +1,413 @@
+import base64
+import hashlib
+import json
+import socket
+import struct
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+import modules.globals
+from modules.cluster_analysis import build_embedding_matrix
+from modules import face_library
+from modules.live_session import LiveSession
+from modules.typing import Face, Frame
+
+NAME = "DLC.WEBSOCKET"
+# RFC 6455 section 1.3
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+# Largest message a client may send; a raw 4K BGR frame is about 25 MB
+MAX_MESSAGE_SIZE = 32 << 20
+# Weight of the newest sample in the latency average
+EWMA_ALPHA = 0.1
+
+PROCESSORS_LOCK = threading.Lock()
+
+
+class WebSocketClosed(Exception):
+    pass
+
+
+def accept_key(key: str) -> str:
+    """Sec-WebSocket-Accept value for the client's Sec-WebSocket-Key."""
+    return base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode("ascii")).digest()).decode("ascii")
+
+
+def get_live_processors() -> Optional[List[Any]]:
+    """The frame processors for live connections, loaded in the serving process on first use."""
+    from modules.processors.frame.core import get_frame_processors_modules
+
+    with PROCESSORS_LOCK:
+        frame_processors = get_frame_processors_modules(modules.globals.frame_processors)
+        for frame_processor in frame_processors:
+            if not frame_processor.pre_start():
+                return None
+        return frame_processors
+
+
+def get_default_source_face() -> Optional[Face]:
+    """Face of the server's -s image or --source-id, used until a client sends its own source."""
+    return face_library.get_source_face(modules.globals.source_path)
+
+
+def decode_frame(payload: bytes, raw_size: Optional[Tuple[int, int]]) -> Tuple[Frame, str]:
+    """Decodes a client frame; JPEG and PNG are recognised by their signature, anything else is raw BGR."""
+    is_raw = raw_size is not None and len(payload) == raw_size[0] * raw_size[1] * 3
+    if not is_raw and (payload[:2] == b"\xff\xd8" or payload[:8] == b"\x89PNG\r\n\x1a\n"):
+        frame = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError("could not decode the frame")
+        return frame, "jpeg" if payload[:2] == b"\xff\xd8" else "png"
+    if raw_size is None:
+        raise ValueError("raw frames need width and height in the config message")
+    width, height = raw_size
+    if len(payload) != width * height * 3:
+        raise ValueError(f"a raw {width}x{height} BGR frame is {width * height * 3} bytes, got {len(payload)}")
+    return np.frombuffer(payload, dtype=np.uint8).reshape(height, width, 3), "raw"
+
+
+def encode_frame(frame: Frame, frame_format: str, quality: int) -> bytes:
+    if frame_format == "raw":
+        return np.ascontiguousarray(frame).tobytes()
+    if frame_format == "png":
+        return cv2.imencode(".png", frame)[1].tobytes()
+    return cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+
+class WebSocket:
+    """
+    Server side of an RFC 6455 connection over the streams of an HTTP
+    handler whose upgrade has been accepted. receive() reassembles
+    fragmented messages and answers pings and close frames itself; send()
+    may be called from any thread.
+    """
+
+    def __init__(self, rfile: Any, wfile: Any, connection: Any = None):
+        self.rfile = rfile
+        self.wfile = wfile
+        self.connection = connection
+        self.send_lock = threading.Lock()
+        self.closed = False
+
+    def _read_exactly(self, size: int) -> bytes:
+        data = self.rfile.read(size) if size else b""
+        if len(data) != size:
+            raise WebSocketClosed("connection lost")
+        return data
+
+    def _read_frame(self) -> Tuple[bool, int, bytes]:
+        first, second = self._read_exactly(2)
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", self._read_exactly(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", self._read_exactly(8))[0]
+        if not second & 0x80:
+            raise WebSocketClosed("client frames must be masked")
+        if length > MAX_MESSAGE_SIZE:
+            raise WebSocketClosed("message too large")
+        mask = self._read_exactly(4)
+        payload = np.frombuffer(self._read_exactly(length), dtype=np.uint8)
+        # Unmasking a frame-sized payload byte by byte in Python would cost more than the swap
+        key = np.resize(np.frombuffer(mask, dtype=np.uint8), length)
+        return bool(first & 0x80), first & 0x0F, np.bitwise_xor(payload, key).tobytes()
+
+    def receive(self) -> Tuple[int, bytes]:
+        """The next text or binary message as (opcode, payload); raises WebSocketClosed at the end."""
+        opcode, parts, size = None, [], 0
+        while True:
+            fin, frame_opcode, payload = self._read_frame()
+            if frame_opcode == OP_CLOSE:
+                self.close(payload[:2] if len(payload) >= 2 else b"")
+                raise WebSocketClosed("closed by client")
+            if frame_opcode == OP_PING:
+                self.send(OP_PONG, payload)
+                continue
+            if frame_opcode == OP_PONG:
+                continue
+            if frame_opcode != OP_CONTINUATION:
+                opcode, parts, size = frame_opcode, [], 0
+            elif opcode is None:
+                raise WebSocketClosed("continuation without a message")
+            parts.append(payload)
+            size += len(payload)
+            if size > MAX_MESSAGE_SIZE:
+                raise WebSocketClosed("message too large")
+            if fin:
+                return opcode, b"".join(parts)
+
+    def send(self, opcode: int, payload: bytes) -> None:
+        length = len(payload)
+        if length < 126:
+            header = struct.pack("!BB", 0x80 | opcode, length)
+        elif length < 1 << 16:
+            header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+        with self.send_lock:
+            if self.closed:
+                raise WebSocketClosed("connection closed")
+            try:
+                if length < 1 << 16:
+                    self.wfile.write(header + payload)
+                else:
+                    # Not concatenated, so a large frame is not copied once more
+                    self.wfile.write(header)
+                    self.wfile.write(payload)
+                self.wfile.flush()
+            except OSError:
+                self.closed = True
+                raise WebSocketClosed("connection lost")
+
+    def send_json(self, message: dict) -> None:
+        self.send(OP_TEXT, json.dumps(message).encode("utf-8"))
+
+    def close(self, status: bytes = b"") -> None:
+        if self.closed:
+            return
+        try:
+            self.send(OP_CLOSE, status)
+        except WebSocketClosed:
+            pass
+        self.closed = True
+
+    def abort(self) -> None:
+        """Closes from another thread, waking a receive() blocked on the client."""
+        self.close(struct.pack("!H", 1001))
+        if self.connection is not None:
+            try:
+                self.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class PushCapturer:
+    """
+    Frame source fed by a client instead of a device. It offers the
+    VideoCapturer interface LivePipeline reads from and holds only the
+    newest frame: a frame the pipeline has not picked up yet is replaced by
+    the next one, so a client sending faster than it can be served never
+    builds a queue on the server. The format each frame arrived in is kept
+    by sequence number until the processed frame is sent back.
+    """
+
+    def __init__(self):
+        self.is_running = True
+        self.received_frames = 0
+        self.dropped_frames = 0
+        self.fps = 0.0
+        self._frame: Optional[Frame] = None
+        self._frame_timestamp = 0.0
+        self._frame_sequence = 0
+        self._consumed_sequence = 0
+        self._formats: Dict[int, str] = {}
+        self._condition = threading.Condition()
+
+    def push(self, frame: Frame, received_at: float, frame_format: str = "jpeg") -> None:
+        with self._condition:
+            if self._frame_sequence > self._consumed_sequence:
+                self.dropped_frames += 1
+            if self._frame_timestamp:
+                interval = received_at - self._frame_timestamp
+                if interval > 0:
+                    self.fps = 1 / interval if not self.fps else self.fps + EWMA_ALPHA * (1 / interval - self.fps)
+            self._frame = frame
+            self._frame_timestamp = received_at
+            self._frame_sequence += 1
+            self._formats[self._frame_sequence] = frame_format
+            self.received_frames += 1
+            self._condition.notify_all()
+
+    def pop_format(self, sequence: int) -> str:
+        """Format the frame with this sequence number arrived in; earlier frames were dropped, so theirs are forgotten."""
+        with self._condition:
+            for dropped in [key for key in self._formats if key < sequence]:
+                del self._formats[dropped]
+            return self._formats.pop(sequence, "jpeg")
+
+    def read_latest(self, wait_for_new: bool = False, timeout: float = 5.0) -> Tuple[bool, Optional[Frame], float, int]:
+        deadline = time.time() + timeout
+        with self._condition:
+            while self.is_running:
+                if self._frame is not None and (self._frame_sequence > self._consumed_sequence or not wait_for_new):
+                    self._consumed_sequence = self._frame_sequence
+                    return True, self._frame, self._frame_timestamp, self._frame_sequence
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+        return False, None, 0.0, 0
+
+    def get_fps(self, default: float = 30.0) -> float:
+        """Rate the client has been sending at, or default before there is one."""
+        return self.fps if 0 < self.fps <= 240 else default
+
+    def release(self) -> None:
+        with self._condition:
+            self.is_running = False
+            self._condition.notify_all()
+
+
+class LiveConnection:
+    """
+    One WebSocket client swapping its own frames through a LiveSession, the
+    same pipeline the preview and headless live mode use. The client sends
+    a JSON config message (source face, optional face map, frame format)
+    and then binary frames; processed frames come back in the format they
+    arrived in. Input and output both keep only the newest frame, and the
+    connection keeps its own latency figures for {"type": "stats"}.
+    """
+
+    def __init__(self, websocket: WebSocket, server_state: Any, peer: str):
+        self.websocket = websocket
+        self.server_state = server_state
+        self.peer = peer
+        self.capturer = PushCapturer()
+        self.session: Optional[LiveSession] = None
+        self.raw_size: Optional[Tuple[int, int]] = None
+        self.quality = 90
+        self.sent_frames = 0
+        self.latency = 0.0
+        self.send_time = 0.0
+        self.errors = 0
+
+    def run(self) -> None:
+        frame_processors = get_live_processors()
+        if frame_processors is None:
+            self.websocket.send_json({"type": "error", "error": "the frame processors failed to load"})
+            self.websocket.close(struct.pack("!H", 1011))
+            return
+        self.session = LiveSession(source=f"websocket:{self.peer}", source_face=get_default_source_face(), capturer=self.capturer)
+        self.session.start(frame_processors)
+        sender = threading.Thread(target=self._send_loop, name=f"websocket-send-{self.session.session_id}", daemon=True)
+        sender.start()
+        self.websocket.send_json({"type": "ready", "session_id": self.session.session_id})
+        print(f"{NAME}: {self.peer} connected as live session {self.session.session_id}")
+        try:
+            while True:
+                opcode, payload = self.websocket.receive()
+                if opcode == OP_BINARY:
+                    self._receive_frame(payload)
+                else:
+                    self._receive_message(payload)
+        except WebSocketClosed:
+            pass
+        finally:
+            self.stop()
+            sender.join(timeout=2)
+            print(f"{NAME}: live session {self.session.session_id} closed after {self.sent_frames} frames")
+
+    def stop(self) -> None:
+        if self.session is not None:
+            self.session.stop()
+        self.websocket.close()
+
+    def get_stats(self) -> dict:
+        return {
+            "peer": self.peer,
+            "received": self.capturer.received_frames,
+            "dropped_input": self.capturer.dropped_frames,
+            "sent": self.sent_frames,
+            "errors": self.errors,
+            "latency_ms": self.latency * 1000,
+            "send_ms": self.send_time * 1000,
+            "session": self.session.get_stats() if self.session is not None else None,
+        }
+
+    def _receive_frame(self, payload: bytes) -> None:
+        received_at = time.time()
+        try:
+            frame, frame_format = decode_frame(payload, self.raw_size)
+        except ValueError as e:
+            self.errors += 1
+            self.websocket.send_json({"type": "error", "error": str(e)})
+            return
+        self.capturer.push(frame, received_at, frame_format)
+
+    def _receive_message(self, payload: bytes) -> None:
+        try:
+            message = json.loads(payload)
+            if not isinstance(message, dict):
+                raise ValueError("messages must be JSON objects")
+            kind = message.get("type", "config")
+            if kind == "stats":
+                self.websocket.send_json({"type": "stats", **self.get_stats()})
+            elif kind == "config":
+                self._configure(message)
+                self.websocket.send_json({"type": "config", "map_faces": self.session.map_faces})
+            else:
+                raise ValueError(f"unknown message type: {kind}")
+        except ValueError as e:
+            self.errors += 1
+            self.websocket.send_json({"type": "error", "error": str(e)})
+
+    def _load_face(self, reference: Any, face_id: Any = None) -> Face:
+        """A face from the library by id, or from an uploaded image."""
+        if face_id is not None:
+            face = face_library.get_face(str(face_id))
+            if face is None:
+                raise ValueError(f"unknown library face: {face_id}")
+            return face
+        path = self.server_state.resolve_file(reference)
+        face = face_library.load_face(path)
+        if face is None:
+            raise ValueError(f"no face found in {reference}")
+        return face
+
+    def _configure(self, message: dict) -> None:
+        """Applies a config message; the swapper reads the session's face and map on every frame."""
+        if "width" in message or "height" in message:
+            try:
+                width, height = int(message["width"]), int(message["height"])
+            except (KeyError, TypeError, ValueError):
+                raise ValueError("width and height must be given together as integers")
+            if width <= 0 or height <= 0:
+                raise ValueError("width and height must be positive")
+            self.raw_size = (width, height)
+        if "quality" in message:
+            try:
+                self.quality = max(1, min(100, int(message["quality"])))
+            except (TypeError, ValueError):
+                raise ValueError("quality must be an integer")
+        if "source" in message or "source_id" in message:
+            self.session.source_face = self._load_face(message.get("source"), message.get("source_id"))
+        if "map" in message:
+            pairs = message["map"]
+            if pairs is None:
+                self.session.simple_map = None
+                return
+            if not isinstance(pairs, list) or not all(isinstance(pair, dict) for pair in pairs):
+                raise ValueError('map must be a list of {"source" or "source_id": ..., "target": ...} objects')
+            source_faces = [self._load_face(pair.get("source"), pair.get("source_id")) for pair in pairs]
+            target_embeddings = [self._load_face(pair.get("target")).normed_embedding for pair in pairs]
+            self.session.simple_map = {
+                "source_faces": source_faces,
+                "target_embeddings": target_embeddings,
+                "target_matrix": build_embedding_matrix(target_embeddings),
+            }
+
+    def _send_loop(self) -> None:
+        while self.session.running:
+            live_frame = self.session.get_frame(timeout=0.1)
+            if live_frame is None:
+                continue
+            started = time.time()
+            frame_format = self.capturer.pop_format(live_frame.sequence)
+            try:
+                self.websocket.send(OP_BINARY, encode_frame(live_frame.frame, frame_format, self.quality))
+            except WebSocketClosed:
+                break
+            finished = time.time()
+            self.sent_frames += 1
+            # Frames finished while this send was blocked are replaced in the pipeline's display queue
+            self.send_time += EWMA_ALPHA * ((finished - started) - self.send_time)
+            self.latency += EWMA_ALPHA * ((finished - live_frame.captured_at) - self.latency)
@@ -0,0 +1,95 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+import modules.globals
+import modules.server
+from modules import face_library
+from modules.server import JobServer, job_workspace
+from modules.typing import Face
+from modules.utilities import get_temp_directory_path
+
+# insightface's 112px ArcFace landmark template, a valid kps for norm_crop
+ARCFACE_KPS = np.array([[38.29, 51.70], [73.53, 51.50], [56.03, 71.74], [41.55, 92.37], [70.73, 92.20]], dtype=np.float32)
+
+
+def stub_face(frame):
+    """A face derived from the image, so different images get different identities."""
+    return Face(
+        bbox=np.array([0, 0, frame.shape[1], frame.shape[0]], dtype=np.float32),
+        kps=ARCFACE_KPS,
+        det_score=0.9,
+        embedding=np.full(512, float(frame.mean()) + 1.0, dtype=np.float32),
+        gender=1,
+        age=30,
+    )
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    """An empty face library under tmp_path, with detection stubbed; the detected frames are recorded."""
+    detected = []
+
+    def get_one_face(frame):
+        detected.append(frame)
+        return stub_face(frame) if frame.any() else None
+
+    monkeypatch.setattr(modules.globals, "face_library", str(tmp_path / "faces"))
+    monkeypatch.setattr(modules.globals, "source_id", None)
+    monkeypatch.setattr(face_library, "get_one_face", get_one_face)
+    face_library.IMAGE_FACES.clear()
+    yield detected
+    with face_library.THREAD_LOCK:
+        if face_library.CONNECTION:
+            face_library.CONNECTION.close()
+        face_library.CONNECTION = face_library.CONNECTION_PATH = None
+    face_library.FACES.clear()
+    face_library.IMAGE_FACES.clear()
+
+
+def stub_worker(settings, jobs, events):
+    """
+    Stands in for worker_main, with a frame processor that reverses the
+    target's bytes. Targets starting with "frames" go through a frame temp
+    directory the way video jobs do.
+    """
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        with open(job["target_path"], "rb") as file:
+            data = file.read()
+        if data.startswith(b"crash"):
+            os._exit(1)
+        events.put(("started", job["id"], os.getpid()))
+        if data.startswith(b"slow"):
+            time.sleep(2)
+        if data.startswith(b"chatty"):
+            for done in range(800):
+                events.put(("progress", job["id"], 0, done, 800))
+                time.sleep(0.01)
+        if data.startswith(b"frames"):
+            with job_workspace(job) as target_path:
+                frame_path = os.path.join(get_temp_directory_path(target_path), "0001.png")
+                os.makedirs(os.path.dirname(frame_path))
+                with open(frame_path, "wb") as file:
+                    file.write(job["id"].encode())
+                time.sleep(1)
+                with open(frame_path, "rb") as file:
+                    data = file.read()[::-1]
+        events.put(("progress", job["id"], 0, 1, 1))
+        with open(job["output_path"], "wb") as file:
+            file.write(data[::-1])
+        events.put(("done", job["id"]))
+
+
+@pytest.fixture
+def server(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(modules.globals, "server_root", str(tmp_path))
+    monkeypatch.setattr(modules.globals, "source_id", None)
+    monkeypatch.setattr(modules.server, "worker_main", stub_worker)
+    job_server = JobServer("127.0.0.1", 0, getattr(request, "param", 1)).start()
+    yield job_server
+    job_server.stop()
@@ -0,0 +1,86 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from modules import face_library
+
+
+def write_image(path, value):
+    cv2.imwrite(str(path), np.full((112, 112, 3), value, dtype=np.uint8))
+    return str(path)
+
+
+def test_add_face_and_look_it_up(library, tmp_path):
+    entry = face_library.add_face(write_image(tmp_path / "alice.png", 80), "alice")
+
+    assert entry["name"] == "alice"
+    assert (entry["width"], entry["height"], entry["gender"], entry["age"]) == (112, 112, 1, 30)
+    assert face_library.get_entry(entry["id"]) == entry
+    assert face_library.get_entry("alice") == entry
+    assert [listed["id"] for listed in face_library.list_faces()] == [entry["id"]]
+    assert face_library.get_crop("alice").startswith(b"\x89PNG")
+
+    # A fresh process loads the face from the database
+    face_library.FACES.clear()
+    face = face_library.get_face("alice")
+    np.testing.assert_allclose(face.embedding, np.full(512, 81.0))
+    assert face_library.get_face(entry["id"]) is face
+    assert os.path.isfile(os.path.join(str(tmp_path / "faces"), face_library.DATABASE_NAME))
+
+
+def test_known_image_skips_detection(library, tmp_path):
+    path = write_image(tmp_path / "alice.png", 80)
+    entry = face_library.add_face(path, "alice")
+    assert face_library.add_face(path, "other name") == entry
+
+    face_library.IMAGE_FACES.clear()
+    face_library.FACES.clear()
+    assert face_library.load_face(path) is face_library.get_face(entry["id"])
+    assert len(library) == 1
+
+
+def test_edited_image_is_a_new_face(library, tmp_path):
+    path = write_image(tmp_path / "alice.png", 80)
+    first = face_library.add_face(path)
+    write_image(path, 90)
+    second = face_library.add_face(path)
+    assert second["id"] != first["id"]
+
+
+def test_duplicate_name_is_rejected(library, tmp_path):
+    face_library.add_face(write_image(tmp_path / "alice.png", 80), "alice")
+    with pytest.raises(ValueError, match="already called alice"):
+        face_library.add_face(write_image(tmp_path / "bob.png", 120), "alice")
+    # The name is checked before detection
+    assert len(library) == 1
+
+
+def test_image_without_face_is_rejected(library, tmp_path):
+    with pytest.raises(ValueError, match="no face found"):
+        face_library.add_face(write_image(tmp_path / "empty.png", 0))
+    assert face_library.list_faces() == []
+
+
+def test_remove_face_clears_the_caches(library, tmp_path):
+    path = write_image(tmp_path / "alice.png", 80)
+    entry = face_library.add_face(path, "alice")
+    face_library.get_face("alice")
+    assert face_library.FACES and face_library.IMAGE_FACES
+
+    assert face_library.remove_face("alice")
+    assert face_library.FACES == {}
+    assert face_library.IMAGE_FACES == {}
+    assert face_library.get_entry(entry["id"]) is None
+    assert face_library.get_face("alice") is None
+    assert not face_library.remove_face("alice")
+
+
+def test_source_id_wins_over_source_path(library, tmp_path, monkeypatch):
+    alice = face_library.add_face(write_image(tmp_path / "alice.png", 80), "alice")
+    bob_path = write_image(tmp_path / "bob.png", 120)
+
+    assert face_library.get_source_face(bob_path).embedding[0] == 121.0
+    monkeypatch.setattr(face_library.modules.globals, "source_id", alice["id"])
+    assert face_library.get_source_face(bob_path).embedding[0] == 81.0
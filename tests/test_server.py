@@ -0,0 +1,195 @@
+import http.client
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+
+import cv2
+import numpy as np
+import pytest
+
+import modules.globals
+import modules.server
+
+
+def call(server, method, path, body=None):
+    data = body if isinstance(body, bytes) or body is None else json.dumps(body).encode("utf-8")
+    request = urllib.request.Request(f"http://127.0.0.1:{server.port}{path}", data=data, method=method)
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            payload = response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        payload, status = e.read(), e.code
+    try:
+        return status, json.loads(payload)
+    except ValueError:
+        return status, payload
+
+
+def upload(server, name, data):
+    status, report = call(server, "POST", f"/uploads?name={name}", data)
+    assert status == 201
+    return report["id"]
+
+
+def wait_for(server, job_id, status, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        report = call(server, "GET", f"/jobs/{job_id}")[1]
+        if report["status"] == status:
+            return report
+        time.sleep(0.1)
+    pytest.fail(f"job {job_id} never became {status}: {report}")
+
+
+def test_job_round_trip(server):
+    source = upload(server, "face.jpg", b"face")
+    target = upload(server, "target.png", b"target")
+
+    status, job = call(server, "POST", "/jobs", {"source": source, "target": target, "options": {"many_faces": True}})
+    assert status == 201
+    assert job["status"] == "queued"
+
+    report = wait_for(server, job["id"], "done")
+    assert report["progress"]["fraction"] == 1.0
+    assert call(server, "GET", report["result"]) == (200, b"tegrat")
+
+
+@pytest.mark.parametrize("server", [2], indirect=True)
+def test_concurrent_jobs_on_one_upload(server):
+    source = upload(server, "face.jpg", b"face")
+    target = upload(server, "target.png", b"frames")
+
+    jobs = [call(server, "POST", "/jobs", {"source": source, "target": target})[1] for _ in range(2)]
+    for job in jobs:
+        report = wait_for(server, job["id"], "done")
+        # Each job read back the frame it wrote itself
+        assert call(server, "GET", report["result"]) == (200, job["id"].encode())
+    assert os.listdir(os.path.join(server.root, "work")) == []
+
+
+def test_face_library_round_trip(server, library):
+    _, image = cv2.imencode(".png", np.full((112, 112, 3), 80, dtype=np.uint8))
+    source = upload(server, "alice.png", image.tobytes())
+
+    status, face = call(server, "POST", "/faces", {"source": source, "name": "alice"})
+    assert status == 201
+    assert face["name"] == "alice"
+    assert face["crop"] == f"/faces/{face['id']}/crop"
+    assert call(server, "POST", "/faces", {"source": source, "name": "again"}) == (201, face)
+    assert call(server, "GET", "/faces") == (200, {"faces": [face]})
+    assert call(server, "GET", "/faces/alice") == (200, face)
+    status, crop = call(server, "GET", face["crop"])
+    assert status == 200 and crop.startswith(b"\x89PNG")
+
+    target = upload(server, "target.png", b"target")
+    status, job = call(server, "POST", "/jobs", {"target": target, "options": {"source_id": "alice"}})
+    assert status == 201
+    wait_for(server, job["id"], "done")
+    assert call(server, "POST", "/jobs", {"target": target, "options": {"source_id": "bob"}}) == (400, {"error": "unknown library face: bob"})
+
+    assert call(server, "DELETE", "/faces/alice") == (200, {"id": "alice", "removed": True})
+    assert call(server, "GET", f"/faces/{face['id']}") == (404, {"error": f"unknown library face: {face['id']}"})
+    assert call(server, "DELETE", "/faces/alice")[0] == 404
+
+
+def test_expired_jobs_and_uploads_are_removed(server, monkeypatch):
+    source = upload(server, "face.jpg", b"face")
+    target = upload(server, "target.png", b"target")
+    job = call(server, "POST", "/jobs", {"source": source, "target": target})[1]
+    result_path = os.path.join(server.root, "results", job["id"] + ".png")
+    wait_for(server, job["id"], "done")
+
+    with modules.server.JOBS_LOCK:
+        server._expire()
+    assert os.path.isfile(result_path)
+
+    monkeypatch.setattr(modules.globals, "server_retention", 0.1 / 3600)
+    time.sleep(0.2)
+    kept = upload(server, "kept.png", b"kept")
+    with modules.server.JOBS_LOCK:
+        server._expire()
+    assert call(server, "GET", f"/jobs/{job['id']}")[0] == 404
+    assert not os.path.exists(result_path)
+    assert os.listdir(os.path.join(server.root, "uploads")) == [kept]
+
+
+def test_keep_frames_is_not_a_job_option(server):
+    assert call(server, "POST", "/jobs", {"options": {"keep_frames": True}}) == (400, {"error": "unknown option: keep_frames"})
+
+
+def test_cancel_queued_job(server):
+    source = upload(server, "face.jpg", b"face")
+    slow_target = upload(server, "slow.png", b"slow target")
+    target = upload(server, "target.png", b"target")
+
+    running = call(server, "POST", "/jobs", {"source": source, "target": slow_target})[1]
+    queued = call(server, "POST", "/jobs", {"source": source, "target": target})[1]
+    status, report = call(server, "DELETE", f"/jobs/{queued['id']}")
+    assert status == 200
+    assert report["status"] == "cancelled"
+
+    wait_for(server, running["id"], "done")
+    time.sleep(0.5)
+    assert call(server, "GET", f"/jobs/{queued['id']}")[1]["status"] == "cancelled"
+    assert call(server, "GET", f"/jobs/{queued['id']}/result")[0] == 409
+
+
+def test_worker_dying_before_start_fails_its_job(server):
+    source = upload(server, "face.jpg", b"face")
+    crash_target = upload(server, "crash.png", b"crash")
+    target = upload(server, "target.png", b"target")
+
+    crashed = call(server, "POST", "/jobs", {"source": source, "target": crash_target})[1]
+    queued = call(server, "POST", "/jobs", {"source": source, "target": target})[1]
+
+    assert wait_for(server, crashed["id"], "failed")["error"] == "worker process exited"
+    wait_for(server, queued["id"], "done")
+
+
+@pytest.mark.parametrize("server", [2], indirect=True)
+def test_worker_dying_while_another_reports_progress(server):
+    source = upload(server, "face.jpg", b"face")
+    chatty = call(server, "POST", "/jobs", {"source": source, "target": upload(server, "chatty.png", b"chatty")})[1]
+    wait_for(server, chatty["id"], "running")
+    crashed = call(server, "POST", "/jobs", {"source": source, "target": upload(server, "crash.png", b"crash")})[1]
+
+    wait_for(server, crashed["id"], "failed", timeout=5)
+    assert call(server, "GET", f"/jobs/{chatty['id']}")[1]["status"] == "running"
+    wait_for(server, chatty["id"], "done")
+
+
+@pytest.mark.parametrize(
+    "options, error",
+    [
+        ({"unknown": 1}, "unknown option: unknown"),
+        ({"frame_processors": ["face_blur"]}, "frame_processors must be a list of face_swapper, face_enhancer"),
+        ({"many_faces": "yes"}, "many_faces must be true or false"),
+        ({"opacity": "opaque"}, "opacity must be a float"),
+        ({"video_encoder": "mpeg2"}, "video_encoder must be one of libx264, libx265, libvpx-vp9"),
+        ({"video_quality": 52}, "video_quality must be between 0 and 51"),
+    ],
+)
+def test_invalid_options(server, options, error):
+    assert call(server, "POST", "/jobs", {"source": "a", "target": "b", "options": options}) == (400, {"error": error})
+
+
+def test_invalid_bodies(server, monkeypatch):
+    assert call(server, "POST", "/jobs", b"[1, 2]") == (400, {"error": "the request body must be a JSON object"})
+    assert call(server, "POST", "/uploads?name=face", b"face")[0] == 400
+
+    monkeypatch.setattr(modules.server, "MAX_UPLOAD_SIZE", 4)
+    status, report = call(server, "POST", "/uploads?name=face.jpg", b"faces")
+    assert status == 400
+    assert report["error"].startswith("uploads are limited to")
+
+    for length in ("-1", "many"):
+        connection = http.client.HTTPConnection("127.0.0.1", server.port, timeout=10)
+        connection.putrequest("POST", "/uploads?name=face.jpg")
+        connection.putheader("Content-Length", length)
+        connection.endheaders()
+        response = connection.getresponse()
+        assert response.status == 400
+        connection.close()
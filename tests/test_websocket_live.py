@@ -0,0 +1,171 @@
+import io
+import json
+import socket
+import struct
+
+import cv2
+import numpy as np
+import pytest
+
+import modules.globals
+from modules import live_pipeline, websocket_live
+from modules.websocket_live import OP_BINARY, OP_CLOSE, OP_CONTINUATION, OP_PING, OP_PONG, OP_TEXT, WebSocket, WebSocketClosed, accept_key, decode_frame
+
+# RFC 6455 section 1.3
+SAMPLE_KEY = "dGhlIHNhbXBsZSBub25jZQ=="
+SAMPLE_ACCEPT = "s3pPLMBiTxaQ9kYGzzhZRbK+xOo="
+
+
+class InvertProcessor:
+    NAME = "DLC.INVERT"
+
+    def process_frame(self, source_face, frame, detected_faces=None):
+        return 255 - frame
+
+
+def client_frame(opcode, payload, fin=True, mask=b"\x37\xfa\x21\x3d"):
+    """A frame as a client sends it: masked, with the shortest length encoding."""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", (0x80 if fin else 0) | opcode, 0x80 | length)
+    elif length < 1 << 16:
+        header = struct.pack("!BBH", (0x80 if fin else 0) | opcode, 0x80 | 126, length)
+    else:
+        header = struct.pack("!BBQ", (0x80 if fin else 0) | opcode, 0x80 | 127, length)
+    masked = bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+    return header + mask + masked
+
+
+def server_frame(stream):
+    """(opcode, payload) of the next unmasked frame the server sent."""
+    first, second = stream.read(2)
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", stream.read(2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", stream.read(8))[0]
+    return first & 0x0F, stream.read(length)
+
+
+def test_accept_key():
+    assert accept_key(SAMPLE_KEY) == SAMPLE_ACCEPT
+
+
+def test_receive_unmasks_and_reassembles_fragments():
+    rfile = io.BytesIO(
+        client_frame(OP_TEXT, b"Hel", fin=False)
+        + client_frame(OP_PING, b"are you there")
+        + client_frame(OP_CONTINUATION, b"lo")
+        + client_frame(OP_PONG, b"")
+        + client_frame(OP_BINARY, bytes(range(256)) * 300)
+    )
+    wfile = io.BytesIO()
+    websocket = WebSocket(rfile, wfile)
+
+    assert websocket.receive() == (OP_TEXT, b"Hello")
+    # Pings are answered in the middle of a fragmented message
+    assert wfile.getvalue() == struct.pack("!BB", 0x80 | OP_PONG, 13) + b"are you there"
+    assert websocket.receive() == (OP_BINARY, bytes(range(256)) * 300)
+    with pytest.raises(WebSocketClosed, match="connection lost"):
+        websocket.receive()
+
+
+def test_receive_rejects_unmasked_and_orphaned_frames():
+    with pytest.raises(WebSocketClosed, match="must be masked"):
+        WebSocket(io.BytesIO(struct.pack("!BB", 0x80 | OP_TEXT, 2) + b"hi"), io.BytesIO()).receive()
+    with pytest.raises(WebSocketClosed, match="continuation without a message"):
+        WebSocket(io.BytesIO(client_frame(OP_CONTINUATION, b"hi")), io.BytesIO()).receive()
+
+
+def test_receive_answers_close():
+    wfile = io.BytesIO()
+    websocket = WebSocket(io.BytesIO(client_frame(OP_CLOSE, struct.pack("!H", 1000))), wfile)
+    with pytest.raises(WebSocketClosed, match="closed by client"):
+        websocket.receive()
+    assert wfile.getvalue() == struct.pack("!BBH", 0x80 | OP_CLOSE, 2, 1000)
+    assert websocket.closed
+
+
+def test_decode_frame():
+    frame = np.arange(24, dtype=np.uint8).reshape(2, 4, 3)
+    decoded, frame_format = decode_frame(frame.tobytes(), (4, 2))
+    assert frame_format == "raw"
+    np.testing.assert_array_equal(decoded, frame)
+
+    with pytest.raises(ValueError, match="a raw 4x2 BGR frame is 24 bytes, got 23"):
+        decode_frame(frame.tobytes()[:-1], (4, 2))
+    with pytest.raises(ValueError, match="raw frames need width and height"):
+        decode_frame(frame.tobytes(), None)
+
+    png = cv2.imencode(".png", frame)[1].tobytes()
+    decoded, frame_format = decode_frame(png, (4, 2))
+    assert frame_format == "png"
+    np.testing.assert_array_equal(decoded, frame)
+    assert decode_frame(cv2.imencode(".jpg", frame)[1].tobytes(), None)[1] == "jpeg"
+
+
+@pytest.fixture
+def live_server(server, monkeypatch):
+    monkeypatch.setattr(websocket_live, "get_live_processors", lambda: [InvertProcessor()])
+    monkeypatch.setattr(live_pipeline, "get_many_faces", lambda frame, det_size=None: [])
+    monkeypatch.setattr(modules.globals, "source_path", None)
+    return server
+
+
+def open_live(server):
+    """Sends the upgrade request; returns the socket, its read stream, the status code and headers."""
+    connection = socket.create_connection(("127.0.0.1", server.port), timeout=10)
+    connection.sendall(
+        (
+            "GET /live HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {SAMPLE_KEY}\r\nSec-WebSocket-Version: 13\r\n\r\n"
+        ).encode("ascii")
+    )
+    stream = connection.makefile("rb")
+    status = int(stream.readline().split()[1])
+    headers = {}
+    for line in iter(stream.readline, b"\r\n"):
+        name, value = line.decode("ascii").split(":", 1)
+        headers[name.strip().lower()] = value.strip()
+    return connection, stream, status, headers
+
+
+def test_live_round_trip(live_server):
+    connection, stream, status, headers = open_live(live_server)
+    assert status == 101
+    assert headers["sec-websocket-accept"] == SAMPLE_ACCEPT
+    opcode, payload = server_frame(stream)
+    assert opcode == OP_TEXT and json.loads(payload)["type"] == "ready"
+
+    connection.sendall(client_frame(OP_TEXT, json.dumps({"width": 4, "height": 2}).encode()))
+    assert server_frame(stream) == (OP_TEXT, json.dumps({"type": "config", "map_faces": False}).encode())
+
+    frame = np.full((2, 4, 3), 200, dtype=np.uint8)
+    connection.sendall(client_frame(OP_BINARY, frame.tobytes()))
+    assert server_frame(stream) == (OP_BINARY, (255 - frame).tobytes())
+
+    # A JPEG after raw frames comes back as JPEG
+    connection.sendall(client_frame(OP_BINARY, cv2.imencode(".jpg", frame)[1].tobytes()))
+    opcode, payload = server_frame(stream)
+    assert opcode == OP_BINARY and payload[:2] == b"\xff\xd8"
+    np.testing.assert_allclose(cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_COLOR), 255 - frame, atol=4)
+
+    connection.sendall(client_frame(OP_BINARY, b"not a frame"))
+    opcode, payload = server_frame(stream)
+    assert opcode == OP_TEXT and json.loads(payload)["type"] == "error"
+
+    connection.sendall(client_frame(OP_CLOSE, struct.pack("!H", 1000)))
+    assert server_frame(stream) == (OP_CLOSE, struct.pack("!H", 1000))
+    connection.close()
+
+
+def test_live_sessions_are_capped(live_server, monkeypatch):
+    monkeypatch.setattr(modules.globals, "server_max_live_sessions", 1)
+    connection, stream, status, _ = open_live(live_server)
+    assert status == 101
+    assert json.loads(server_frame(stream)[1])["type"] == "ready"
+
+    refused, _, status, _ = open_live(live_server)
+    assert status == 503
+    refused.close()
+    connection.close()